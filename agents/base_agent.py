@@ -40,6 +40,10 @@ class Task(BaseModel):
 class BaseAgent(ABC):
     """Базовый класс для всех агентов"""
     
+    # Параллельная обработка задач включается только у агентов, чей process_task
+    # безопасен при одновременных вызовах; остальные всегда работают последовательно
+    supports_concurrent_tasks = False
+    
     def __init__(self, name: str, config: Dict[str, Any]):
         self.name = name
         self.config = config
@@ -56,6 +60,13 @@ class BaseAgent(ABC):
         self.db_pool: Optional[asyncpg.Pool] = None
         self.http_session: Optional[aiohttp.ClientSession] = None
         self.running = False
+        # Сколько задач агент может обрабатывать одновременно (1 - последовательно)
+        self.max_concurrent_tasks = max(1, int(config.get('max_concurrent_tasks', 1)))
+        if self.max_concurrent_tasks > 1 and not self.supports_concurrent_tasks:
+            self.logger.warning(f"Агент {name} не поддерживает параллельные задачи, max_concurrent_tasks = 1")
+            self.max_concurrent_tasks = 1
+        # Ссылки на выполняющиеся задачи: event loop хранит только слабые ссылки
+        self._running_tasks: set = set()
         
     async def initialize(self):
         """Инициализация агента"""
@@ -114,6 +125,10 @@ class BaseAgent(ABC):
             self.running = False
             self.status.status = "stopped"
             
+            # Захваченные задачи дописывают результаты до закрытия пула
+            if self._running_tasks:
+                await asyncio.gather(*self._running_tasks, return_exceptions=True)
+            
             # Закрытие соединений
             if self.http_session:
                 await self.http_session.close()
@@ -133,6 +148,10 @@ class BaseAgent(ABC):
     
     async def _main_loop(self):
         """Основной цикл агента"""
+        if self.max_concurrent_tasks > 1:
+            await self._concurrent_main_loop()
+            return
+        
         while self.running:
             try:
                 # Получение задач из очереди
@@ -155,6 +174,97 @@ class BaseAgent(ABC):
                 self.status.errors_count += 1
                 await asyncio.sleep(5.0)  # Пауза при ошибке
     
+    async def _concurrent_main_loop(self):
+        """Основной цикл с параллельной обработкой до max_concurrent_tasks задач"""
+        slots = asyncio.Semaphore(self.max_concurrent_tasks)
+        
+        while self.running:
+            acquired = False
+            try:
+                await slots.acquire()
+                acquired = True
+                
+                # Задача сразу помечается как processing, чтобы не взять ее повторно
+                task = await self._claim_next_task()
+                
+                if task:
+                    running = asyncio.create_task(self._run_claimed_task(task, slots))
+                    self._running_tasks.add(running)
+                    running.add_done_callback(self._running_tasks.discard)
+                    acquired = False
+                    self.status.last_activity = datetime.now()
+                    # Свободный слот - сразу пробуем взять следующую задачу
+                    continue
+                
+                slots.release()
+                acquired = False
+                
+                await self._background_work()
+                self.status.last_activity = datetime.now()
+                await asyncio.sleep(self.config.get('loop_interval', 1.0))
+                
+            except Exception as e:
+                if acquired:
+                    slots.release()
+                self.logger.error(f"Ошибка в основном цикле агента {self.name}: {e}")
+                self.status.errors_count += 1
+                await asyncio.sleep(5.0)  # Пауза при ошибке
+    
+    async def _run_claimed_task(self, task: Task, slots: asyncio.Semaphore):
+        """Обработка захваченной задачи с освобождением слота"""
+        try:
+            await self._process_task(task)
+        finally:
+            slots.release()
+    
+    async def _claim_next_task(self) -> Optional[Task]:
+        """Атомарное получение следующей задачи со сменой статуса на processing"""
+        if not self.db_pool:
+            return None
+            
+        try:
+            async with self.db_pool.acquire() as conn:
+                async with conn.transaction():
+                    row = await conn.fetchrow(
+                        """
+                        UPDATE tasks SET status = 'processing'
+                        WHERE id = (
+                            SELECT id FROM tasks
+                            WHERE agent_name = $1 AND status = 'pending'
+                            ORDER BY priority DESC, created_at ASC
+                            LIMIT 1
+                            FOR UPDATE SKIP LOCKED
+                        )
+                        RETURNING *
+                        """,
+                        self.name
+                    )
+                    
+                    tasks = await self._tasks_from_claimed_rows(conn, [row] if row else [])
+                    return tasks[0] if tasks else None
+                
+        except Exception as e:
+            self.logger.error(f"Ошибка получения задачи: {e}")
+            return None
+    
+    async def _tasks_from_claimed_rows(self, conn, rows) -> List[Task]:
+        """Разбор захваченных строк в той же транзакции, что и захват
+        
+        Строка, которую не удалось разобрать, помечается failed: иначе она
+        осталась бы в processing навсегда, а возврат в pending зациклил бы захват.
+        """
+        tasks = []
+        for row in rows:
+            try:
+                tasks.append(Task(**dict(row)))
+            except Exception as e:
+                self.logger.error(f"Некорректная задача {row['id']}: {e}")
+                await conn.execute(
+                    "UPDATE tasks SET status = 'failed' WHERE id = $1",
+                    row['id']
+                )
+        return tasks
+    
     async def _get_next_task(self) -> Optional[Task]:
         """Получение следующей задачи из базы данных"""
         if not self.db_pool:
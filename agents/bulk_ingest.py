@@ -0,0 +1,358 @@
+"""
+Потоковая массовая загрузка корпусов текстов в EmbeddingAgent
+
+Файлы NDJSON, CSV и каталоги с текстовыми файлами читаются генераторами,
+тексты режутся скользящим окном, кодируются в пуле процессов на всех ядрах
+и записываются в хранилище конвейером. Подготовку батча (дедупликация, кэш
+эмбеддингов) и запись выполняет агент, кодирование промахов - пул процессов. Число батчей в работе ограничено,
+поэтому потребление памяти не зависит от размера корпуса. Контрольные точки
+позволяют продолжить прерванную загрузку.
+"""
+
+import asyncio
+import csv
+import hashlib
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+import numpy as np
+
+
+TEXT_EXTENSIONS = (".txt", ".md")
+NDJSON_EXTENSIONS = (".jsonl", ".ndjson")
+CSV_EXTENSIONS = (".csv",)
+
+_worker_encode: Optional[Callable[[List[str]], np.ndarray]] = None
+
+
+def _init_worker(model_path: str, onnx: Optional[Tuple[str, str, bool]] = None):
+    """Загрузка модели один раз на процесс пула
+
+    onnx - (models_path, имя, quantize) активного ONNX бэкенда агента: процессы
+    используют тот же экспорт, поэтому векторы совпадают с кэшем и хранилищем.
+    """
+    global _worker_encode
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    # Параллелизм дают процессы, потоки torch внутри процесса лишь конкурируют
+    torch.set_num_threads(1)
+    model = SentenceTransformer(model_path)
+    if onnx:
+        from .onnx_backend import OnnxSentenceEncoder
+
+        models_path, name, quantize = onnx
+        encoder = OnnxSentenceEncoder(model, models_path, name, threads=1, quantize=quantize)
+        _worker_encode = lambda texts: encoder.encode(texts, batch_size=64)
+    else:
+        _worker_encode = lambda texts: model.encode(
+            texts, batch_size=64, convert_to_numpy=True, show_progress_bar=False
+        )
+
+
+def _encode_in_worker(texts: List[str]) -> np.ndarray:
+    return np.asarray(_worker_encode(texts), dtype=np.float32)
+
+
+@dataclass
+class Chunk:
+    """Фрагмент текста с позицией в корпусе"""
+    id: str
+    text: str
+    metadata: Dict[str, Any]
+    file_index: int
+    record_index: int
+
+
+@dataclass
+class IngestCheckpoint:
+    """Позиция последнего записанного батча и граница батча, запись которого начата
+
+    Если загрузка прервалась во время записи, фрагменты до pending-позиции могли
+    частично попасть в хранилище; при возобновлении они перезаписываются
+    независимо от размера батча.
+    """
+    path: str
+    file_index: int = -1
+    record_index: int = -1
+    pending_file_index: int = -1
+    pending_record_index: int = -1
+    chunks_written: int = 0
+    finished: bool = False
+    started_at: float = field(default_factory=time.time)
+
+    @classmethod
+    def load(cls, path: str) -> "IngestCheckpoint":
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                return cls(path=path, **json.load(f))
+        return cls(path=path)
+
+    def save(self):
+        state = {
+            "file_index": self.file_index,
+            "record_index": self.record_index,
+            "pending_file_index": self.pending_file_index,
+            "pending_record_index": self.pending_record_index,
+            "chunks_written": self.chunks_written,
+            "finished": self.finished,
+            "started_at": self.started_at
+        }
+        tmp_file = self.path + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_file, self.path)
+
+    def is_done(self, file_index: int, record_index: int) -> bool:
+        return (file_index, record_index) <= (self.file_index, self.record_index)
+
+    def may_be_written(self, file_index: int, record_index: int) -> bool:
+        """Запись могла быть сохранена прерванным батчем"""
+        return (file_index, record_index) <= (self.pending_file_index, self.pending_record_index)
+
+
+def list_source_files(source: str) -> List[str]:
+    """Файлы корпуса в стабильном порядке (важно для возобновления)"""
+    if os.path.isfile(source):
+        return [source]
+    files = []
+    for root, _, names in os.walk(source):
+        for name in names:
+            if name.lower().endswith(TEXT_EXTENSIONS + NDJSON_EXTENSIONS + CSV_EXTENSIONS):
+                files.append(os.path.join(root, name))
+    return sorted(files)
+
+
+def iter_records(filename: str, text_field: str = "text", id_field: Optional[str] = None) -> Iterator[Tuple[Optional[str], str, Dict[str, Any]]]:
+    """Записи файла: (id или None, текст, метаданные)"""
+    lower = filename.lower()
+    if lower.endswith(NDJSON_EXTENSIONS):
+        with open(filename, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                text = record.pop(text_field, "")
+                record_id = record.pop(id_field, None) if id_field else None
+                yield record_id, text, _scalar_metadata(record)
+    elif lower.endswith(CSV_EXTENSIONS):
+        with open(filename, "r", encoding="utf-8", newline="") as f:
+            for record in csv.DictReader(f):
+                text = record.pop(text_field, "") or ""
+                record_id = record.pop(id_field, None) if id_field else None
+                yield record_id, text, _scalar_metadata(record)
+    else:
+        # Текстовый файл читается по абзацам, а не целиком
+        paragraph: List[str] = []
+        with open(filename, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                if line.strip():
+                    paragraph.append(line.strip())
+                elif paragraph:
+                    yield None, " ".join(paragraph), {}
+                    paragraph = []
+        if paragraph:
+            yield None, " ".join(paragraph), {}
+
+
+def _scalar_metadata(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Хранилища принимают только скалярные значения метаданных"""
+    return {
+        key: value for key, value in record.items()
+        if isinstance(value, (str, int, float, bool)) and key
+    }
+
+
+def sliding_window(text: str, window: int, overlap: int) -> Iterator[str]:
+    """Нарезка текста окнами по словам с перекрытием"""
+    words = text.split()
+    if not words:
+        return
+    step = max(1, window - overlap)
+    for start in range(0, len(words), step):
+        yield " ".join(words[start:start + window])
+        if start + window >= len(words):
+            break
+
+
+def iter_chunks(source: str, job_id: str, checkpoint: IngestCheckpoint, text_field: str = "text",
+                id_field: Optional[str] = None, window: int = 200, overlap: int = 50) -> Iterator[Chunk]:
+    """Фрагменты корпуса, начиная с позиции после контрольной точки"""
+    files = list_source_files(source)
+    base = source if os.path.isdir(source) else os.path.dirname(source)
+
+    for file_index, filename in enumerate(files):
+        if file_index < checkpoint.file_index:
+            continue
+        relpath = os.path.relpath(filename, base)
+        for record_index, (record_id, text, metadata) in enumerate(iter_records(filename, text_field, id_field)):
+            if checkpoint.is_done(file_index, record_index):
+                continue
+            doc_id = record_id or f"{job_id}:{relpath}:{record_index}"
+            for chunk_index, chunk_text in enumerate(sliding_window(text, window, overlap)):
+                yield Chunk(
+                    id=f"{doc_id}:{chunk_index}",
+                    text=chunk_text,
+                    metadata={
+                        **metadata,
+                        "source_file": relpath,
+                        "document_id": doc_id,
+                        "chunk_index": chunk_index,
+                        "ingest_job": job_id
+                    },
+                    file_index=file_index,
+                    record_index=record_index
+                )
+
+
+def _take(iterator: Iterator[Chunk], count: int) -> List[Chunk]:
+    return list(itertools.islice(iterator, count))
+
+
+def default_job_id(source: str) -> str:
+    return "ingest_" + hashlib.sha1(os.path.abspath(source).encode("utf-8")).hexdigest()[:12]
+
+
+EncodeFn = Callable[[List[str]], Awaitable[np.ndarray]]
+PrepareFn = Callable[[List[str], List[str], List[Dict[str, Any]], bool, EncodeFn], Awaitable[Any]]
+WriteFn = Callable[[List[str], Any, bool], Awaitable[None]]
+
+
+class BulkIngestor:
+    """Конвейер: генератор фрагментов -> подготовка и кодирование в пуле процессов -> запись"""
+
+    def __init__(self, model_path: str, checkpoint_dir: str, workers: Optional[int] = None,
+                 batch_size: int = 256, max_inflight: Optional[int] = None,
+                 onnx: Optional[Tuple[str, str, bool]] = None):
+        self.model_path = model_path
+        self.checkpoint_dir = checkpoint_dir
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.max_inflight = max_inflight or self.workers * 2
+        self.onnx = onnx
+        self.logger = logging.getLogger("agent.embedding_agent.bulk_ingest")
+
+    async def run(self, source: str, prepare: PrepareFn, write: WriteFn, job_id: Optional[str] = None,
+                  resume: bool = True, text_field: str = "text", id_field: Optional[str] = None,
+                  window: int = 200, overlap: int = 50) -> Dict[str, Any]:
+        """Загрузка корпуса
+
+        prepare(ids, texts, metadatas, replace, encode) готовит батч (до max_inflight
+        одновременно); encode кодирует тексты в пуле процессов. write(ids, prepared,
+        replace) пишет подготовленные батчи строго по порядку корпуса.
+        """
+        if not os.path.exists(source):
+            raise FileNotFoundError(f"Источник не найден: {source}")
+        if overlap >= window:
+            raise ValueError("Перекрытие должно быть меньше окна")
+
+        job_id = job_id or default_job_id(source)
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        checkpoint_file = os.path.join(self.checkpoint_dir, f"{job_id}.json")
+        if not resume and os.path.exists(checkpoint_file):
+            os.remove(checkpoint_file)
+        checkpoint = IngestCheckpoint.load(checkpoint_file)
+        if checkpoint.finished:
+            return {"job_id": job_id, "status": "already_finished", "chunks_written": checkpoint.chunks_written}
+
+        resumed = checkpoint.file_index >= 0
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        chunks_this_run = 0
+
+        pending: Deque[Tuple[List[Chunk], bool, asyncio.Future]] = deque()
+
+        def submit(batch: List[Chunk], pool: ProcessPoolExecutor):
+            # Фрагменты, которые прерванный запуск мог успеть записать, перезаписываются
+            first = batch[0]
+            replace = checkpoint.may_be_written(first.file_index, first.record_index)
+
+            def encode(texts: List[str]) -> Awaitable[np.ndarray]:
+                return loop.run_in_executor(pool, _encode_in_worker, texts)
+
+            prepared = asyncio.ensure_future(prepare(
+                [c.id for c in batch], [c.text for c in batch], [c.metadata for c in batch], replace, encode
+            ))
+            pending.append((batch, replace, prepared))
+
+        async def drain_one():
+            nonlocal chunks_this_run
+            batch, replace, future = pending.popleft()
+            prepared = await future
+            last = batch[-1]
+            # Граница не уменьшается: после возобновления первые батчи могут быть
+            # короче прерванного, и его хвост все еще нужно перезаписать
+            checkpoint.pending_file_index, checkpoint.pending_record_index = max(
+                (checkpoint.pending_file_index, checkpoint.pending_record_index),
+                (last.file_index, last.record_index)
+            )
+            await loop.run_in_executor(None, checkpoint.save)
+            await write([c.id for c in batch], prepared, replace)
+            checkpoint.file_index = last.file_index
+            checkpoint.record_index = last.record_index
+            checkpoint.chunks_written += len(batch)
+            chunks_this_run += len(batch)
+            await loop.run_in_executor(None, checkpoint.save)
+
+        # spawn: дочерние процессы не наследуют потоки torch/OpenMP родителя (fork после
+        # их запуска может зависнуть)
+        with ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.model_path, self.onnx)
+        ) as pool:
+            try:
+                # Чтение и разбор файлов - в пуле потоков, порциями по размеру батча
+                chunks = iter_chunks(source, job_id, checkpoint, text_field, id_field, window, overlap)
+                batch: List[Chunk] = []
+                while True:
+                    portion = await loop.run_in_executor(None, _take, chunks, self.batch_size)
+                    if not portion:
+                        break
+                    for chunk in portion:
+                        # Батч закрывается только на границе записи, чтобы контрольная точка была точной
+                        if len(batch) >= self.batch_size and self._starts_record(batch[-1], chunk):
+                            submit(batch, pool)
+                            batch = []
+                            if len(pending) >= self.max_inflight:
+                                await drain_one()
+                        batch.append(chunk)
+                if batch:
+                    submit(batch, pool)
+                while pending:
+                    await drain_one()
+            finally:
+                # При ошибке подготовка остальных батчей не должна продолжаться без записи
+                for _, _, future in pending:
+                    future.cancel()
+                if pending:
+                    await asyncio.gather(*(future for _, _, future in pending), return_exceptions=True)
+
+        checkpoint.finished = True
+        await loop.run_in_executor(None, checkpoint.save)
+
+        elapsed = time.perf_counter() - started
+        return {
+            "job_id": job_id,
+            "status": "finished",
+            "resumed": resumed,
+            "chunks_written": checkpoint.chunks_written,
+            "chunks_this_run": chunks_this_run,
+            "seconds": elapsed,
+            "chunks_per_second": chunks_this_run / elapsed if elapsed else 0.0,
+            "workers": self.workers
+        }
+
+    @staticmethod
+    def _starts_record(previous: Chunk, chunk: Chunk) -> bool:
+        """Фрагмент начинает новую запись (фрагменты одной записи идут подряд)"""
+        return (previous.file_index, previous.record_index) != (chunk.file_index, chunk.record_index)
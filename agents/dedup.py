@@ -0,0 +1,230 @@
+"""
+NearDuplicateIndex - обнаружение точных и почти точных дублей текстов при загрузке
+
+Точные дубли определяются по хэшу нормализованного текста, почти точные -
+по MinHash сигнатурам символьных шинглов с LSH бэндингом. Проверка выполняется
+до вызова модели, поэтому дубли не кодируются и не сохраняются повторно.
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from .embedding_cache import normalize_text
+
+
+MERSENNE_PRIME = np.uint64((1 << 31) - 1)
+
+# Шинглов на проход MinHash: матрица num_perm x chunk остается в пределах ~4 МБ
+SIGNATURE_CHUNK = 4096
+
+
+class NearDuplicateIndex:
+    """MinHash LSH индекс для дедупликации"""
+
+    def __init__(
+        self,
+        path: str,
+        name: str,
+        num_perm: int = 128,
+        bands: int = 16,
+        shingle_size: int = 5,
+        threshold: float = 0.9
+    ):
+        if num_perm % bands:
+            raise ValueError("num_perm должно делиться на bands")
+
+        self.snapshot_file = os.path.join(path, name, "dedup_snapshot.pkl")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.threshold = threshold
+        self.logger = logging.getLogger("agent.embedding_agent.dedup")
+        self._lock = threading.RLock()
+
+        rng = np.random.default_rng(1)
+        self._a = rng.integers(1, int(MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, int(MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+
+        self._exact: Dict[bytes, str] = {}
+        self._signatures: Dict[str, np.ndarray] = {}
+        self._buckets: List[Dict[bytes, List[str]]] = [{} for _ in range(bands)]
+        self._aliases: Dict[str, str] = {}
+        self._dirty = False
+
+        self.stats = {"checked": 0, "exact_duplicates": 0, "near_duplicates": 0}
+
+        os.makedirs(os.path.dirname(self.snapshot_file), exist_ok=True)
+        self._restore()
+
+    # ---- сигнатуры ------------------------------------------------------
+
+    def _shingle_hashes(self, text: str) -> np.ndarray:
+        """Полиномиальные хэши символьных n-грамм (векторно по всему тексту)"""
+        codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+        n = self.shingle_size
+        if len(codes) < n:
+            codes = np.pad(codes, (0, n - len(codes)))
+        windows = np.lib.stride_tricks.sliding_window_view(codes, n)
+        powers = np.array([pow(1000003, n - 1 - j, int(MERSENNE_PRIME)) for j in range(n)], dtype=np.uint64)
+        hashes = (windows % MERSENNE_PRIME) * powers % MERSENNE_PRIME
+        return np.unique(hashes.sum(axis=1) % MERSENNE_PRIME)
+
+    def signature(self, text: str) -> np.ndarray:
+        """MinHash сигнатура: минимум (a*h + b) mod p по всем шинглам (порциями)"""
+        hashes = self._shingle_hashes(text)
+        signature = np.full(self.num_perm, MERSENNE_PRIME, dtype=np.uint64)
+        for start in range(0, len(hashes), SIGNATURE_CHUNK):
+            chunk = hashes[start:start + SIGNATURE_CHUNK]
+            permuted = (self._a[:, None] * chunk[None, :] + self._b[:, None]) % MERSENNE_PRIME
+            np.minimum(signature, permuted.min(axis=1), out=signature)
+        return signature.astype(np.uint32)
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [
+            signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)
+        ]
+
+    # ---- проверка и регистрация ---------------------------------------------
+
+    def check_and_add(self, ids: List[str], texts: List[str],
+                      detect_near: bool = True) -> List[Optional[Tuple[str, str, float]]]:
+        """Для каждого текста: None (новый) или (id оригинала, тип дубля, сходство).
+
+        Регистрируются все тексты, которые вызывающий сохранит: новые, а при
+        detect_near=False и почти точные дубли - тогда повторная отправка того
+        же текста распознается как точный дубль. Регистрация сразу, поэтому
+        дубли внутри одного батча тоже обнаруживаются.
+        """
+        results: List[Optional[Tuple[str, str, float]]] = []
+        with self._lock:
+            for doc_id, text in zip(ids, texts):
+                self.stats["checked"] += 1
+                normalized = normalize_text(text).lower()
+                digest = hashlib.sha1(normalized.encode("utf-8")).digest()
+
+                original = self._exact.get(digest)
+                if original is not None:
+                    self.stats["exact_duplicates"] += 1
+                    results.append((original, "exact", 1.0))
+                    continue
+
+                signature = self.signature(normalized)
+                band_keys = self._band_keys(signature)
+                match = self._best_candidate(signature, band_keys) if detect_near else None
+                if match is not None:
+                    # Почти точный дубль отбрасывается или связывается вызывающим
+                    self.stats["near_duplicates"] += 1
+                    results.append((match[0], "near", match[1]))
+                    continue
+
+                self._exact[digest] = doc_id
+                self._signatures[doc_id] = signature
+                for bucket, key in zip(self._buckets, band_keys):
+                    bucket.setdefault(key, []).append(doc_id)
+                self._dirty = True
+                results.append(None)
+        return results
+
+    def _best_candidate(self, signature: np.ndarray, band_keys: List[bytes]) -> Optional[Tuple[str, float]]:
+        candidates = set()
+        for bucket, key in zip(self._buckets, band_keys):
+            candidates.update(bucket.get(key, ()))
+        if not candidates:
+            return None
+
+        candidate_ids = list(candidates)
+        matrix = np.stack([self._signatures[c] for c in candidate_ids])
+        similarity = (matrix == signature).mean(axis=1)
+        best = int(np.argmax(similarity))
+        if similarity[best] >= self.threshold:
+            return candidate_ids[best], float(similarity[best])
+        return None
+
+    def forget(self, ids: List[str]):
+        """Удаление регистрации (например, если сохранение не удалось)"""
+        with self._lock:
+            forgotten = set(ids)
+            for doc_id in ids:
+                signature = self._signatures.pop(doc_id, None)
+                if signature is None:
+                    continue
+                for bucket, key in zip(self._buckets, self._band_keys(signature)):
+                    members = bucket.get(key)
+                    if members and doc_id in members:
+                        members.remove(doc_id)
+                        if not members:
+                            del bucket[key]
+            self._exact = {d: i for d, i in self._exact.items() if i not in forgotten}
+            self._dirty = True
+
+    def link(self, alias_id: str, original_id: str):
+        """Запоминание связи дубля с оригиналом"""
+        with self._lock:
+            self._aliases[alias_id] = self._aliases.get(original_id, original_id)
+            self._dirty = True
+
+    def resolve(self, ids: List[str]) -> List[str]:
+        """ID оригиналов для связанных дублей"""
+        with self._lock:
+            return [self._aliases.get(doc_id, doc_id) for doc_id in ids]
+
+    # ---- персистентность --------------------------------------------------
+
+    def _restore(self):
+        if not os.path.exists(self.snapshot_file):
+            return
+        try:
+            with open(self.snapshot_file, "rb") as f:
+                state = pickle.load(f)
+        except Exception as e:
+            self.logger.error(f"Ошибка чтения индекса дублей: {e}")
+            return
+        if state.get("num_perm") != self.num_perm or state.get("shingle_size") != self.shingle_size:
+            self.logger.warning("Параметры MinHash изменились, индекс дублей сброшен")
+            return
+
+        self._exact = state["exact"]
+        self._aliases = state["aliases"]
+        ids = state["ids"]
+        signatures = state["signatures"]
+        for doc_id, signature in zip(ids, signatures):
+            self._signatures[doc_id] = signature
+            for bucket, key in zip(self._buckets, self._band_keys(signature)):
+                bucket.setdefault(key, []).append(doc_id)
+        self.logger.info(f"Индекс дублей загружен: {len(ids)} сигнатур")
+
+    def snapshot(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            ids = list(self._signatures)
+            state = {
+                "num_perm": self.num_perm,
+                "shingle_size": self.shingle_size,
+                "exact": self._exact,
+                "aliases": self._aliases,
+                "ids": ids,
+                "signatures": (
+                    np.stack([self._signatures[i] for i in ids])
+                    if ids else np.zeros((0, self.num_perm), dtype=np.uint32)
+                )
+            }
+            tmp_file = self.snapshot_file + ".tmp"
+            with open(tmp_file, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, self.snapshot_file)
+            self._dirty = False
+
+    def get_stats(self) -> Dict[str, Any]:
+        checked = self.stats["checked"]
+        duplicates = self.stats["exact_duplicates"] + self.stats["near_duplicates"]
+        return {
+            **self.stats,
+            "dedup_ratio": duplicates / checked if checked else 0.0,
+            "indexed": len(self._signatures)
+        }
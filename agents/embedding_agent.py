@@ -3,27 +3,92 @@ EmbeddingAgent - векторизация текста с помощью Sentenc
 """
 
 import asyncio
+import contextlib
+import functools
 import logging
 import os
-from typing import Dict, Any, Optional, List, Union
+from typing import Awaitable, Callable, Dict, Any, Optional, List, Union
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from sentence_transformers import SentenceTransformer
 import chromadb
 from chromadb.config import Settings as ChromaSettings
 from .base_agent import BaseAgent, Task
+from .embedding_batcher import EmbeddingBatcher
+from .embedding_cache import EmbeddingCache
+from .vector_store import AsyncVectorStore, ChromaVectorStore, LocalVectorStore
+from .text_index import TextIndex, reciprocal_rank_fusion
+from .embedding_clustering import StreamingClusterer
+from .dedup import NearDuplicateIndex
+from .bulk_ingest import BulkIngestor
+from .embedding_export import EXPORT_FORMATS, export_arrow, export_npy, iter_pages
+from .namespaces import NamespaceRouter, namespace_from
+from .onnx_backend import OnnxSentenceEncoder, benchmark, parity_report
 
 
 class EmbeddingAgent(BaseAgent):
     """Агент для создания векторных представлений текста"""
     
+    # Запросы параллельных задач объединяются EmbeddingBatcher в общие батчи
+    supports_concurrent_tasks = True
+    
+    # Тексты для сверки ONNX с torch (разные длины и языки)
+    PARITY_TEXTS = [
+        "Счет-фактура № 1542 от 12.03.2024",
+        "The quick brown fox jumps over the lazy dog",
+        "Распознанный текст документа с таблицей и подписью руководителя организации",
+        "invoice",
+        "Сообщение из Telegram чата: напомни завтра в 10:00 про встречу с командой разработки"
+    ]
+    
     def __init__(self, config: Dict[str, Any]):
         super().__init__("embedding_agent", config)
         self.model_path = config.get('models_path', '/app/models')
         self.chroma_config = config.get('chroma', {})
+        self.model_name = "sentence-transformers/all-MiniLM-L6-v2"
         self.model: Optional[SentenceTransformer] = None
+        # torch или onnx; ONNX включается только после сверки с torch
+        self.inference_backend = config.get('inference_backend', 'torch')
+        self.onnx_config = config.get('onnx', {})
+        self.onnx_encoder: Optional[OnnxSentenceEncoder] = None
         self.chroma_client: Optional[chromadb.ClientAPI] = None
+        self.vector_store_config = config.get('vector_store', {})
+        self.vector_backend = self.vector_store_config.get('backend', 'chroma')
+        self.collection: Optional[AsyncVectorStore] = None
         self.collection_name = "agi_embeddings"
+        # Отдельные коллекции тенантов и чатов, открываются по первому обращению
+        self.namespace_config = config.get('namespaces', {})
+        self.namespaces: Optional[NamespaceRouter] = None
+        self.namespace_executor = ThreadPoolExecutor(
+            max_workers=self.namespace_config.get('max_workers', 4),
+            thread_name_prefix="vector_store_namespaces"
+        )
+        self.text_index_config = config.get('text_index', {})
+        self.text_index: Optional[TextIndex] = None
+        self.clustering_config = config.get('clustering', {})
+        self.clustering_path = self.clustering_config.get('path', '/app/data/clusters')
+        self.dedup_config = config.get('dedup', {})
+        self.dedup_index: Optional[NearDuplicateIndex] = None
+        self.dedup_seconds_saved = 0.0
+        self.bulk_ingest_config = config.get('bulk_ingest', {})
+        self.export_path = config.get('export_path', '/app/data/exports')
+        # Модель, по которой размечаются новые вставки; сохраняется в фоне, если изменилась
+        self.cluster_model: Optional[StreamingClusterer] = None
+        self.cluster_model_dirty = False
+        self.add_batch_size = config.get('chroma_add_batch_size', 512)
+        self.batching_config = config.get('embedding_batching', {})
+        self.batcher: Optional[EmbeddingBatcher] = None
+        self.cache_config = config.get('embedding_cache', {})
+        self.cache: Optional[EmbeddingCache] = None
+        # Один поток для модели - параллелизм обеспечивает сам torch
+        self.inference_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="embedding_inference"
+        )
+        # Кэш не потокобезопасен: все обращения к нему идут через один поток
+        self.cache_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="embedding_cache"
+        )
         
     async def _initialize_agent(self):
         """Инициализация EmbeddingAgent"""
@@ -32,15 +97,54 @@ class EmbeddingAgent(BaseAgent):
         # Загрузка модели SentenceTransformers
         await self._load_model()
         
-        # Подключение к ChromaDB
-        await self._connect_chromadb()
+        if self.inference_backend == 'onnx':
+            await self._enable_onnx_backend()
+        
+        # Микро-батчер для объединения запросов из параллельных задач
+        self.batcher = EmbeddingBatcher(
+            self._encode_batch,
+            max_batch_items=self.batching_config.get('max_batch_items', 256),
+            bucket_size=self.batching_config.get('bucket_size', 32),
+            min_wait_ms=self.batching_config.get('min_wait_ms', 1.0),
+            max_wait_ms=self.batching_config.get('max_wait_ms', 10.0),
+            executor=self.inference_executor
+        )
+        self.batcher.start()
+        
+        # Персистентный кэш эмбеддингов
+        if self.cache_config.get('enabled', True):
+            self.cache = EmbeddingCache(
+                self.cache_config.get('path', '/app/data/embedding_cache'),
+                model_id=self._embedding_model_id(),
+                dimension=self.model.get_sentence_embedding_dimension(),
+                memory_items=self.cache_config.get('memory_items', 50000)
+            )
+        
+        # Подключение к хранилищу векторов (ChromaDB или локальный индекс)
+        await self._connect_vector_store()
+        
+        # Инвертированный индекс BM25 для гибридного поиска
+        await self._load_text_index()
+        
+        # Индекс дублей для фильтрации при загрузке
+        if self.dedup_config.get('mode', 'exact') != 'off':
+            self.dedup_index = NearDuplicateIndex(
+                self.dedup_config.get('path', '/app/data/dedup'),
+                name=self.collection_name,
+                threshold=self.dedup_config.get('threshold', 0.9)
+            )
+        
+        # Сохраненная модель кластеров для разметки новых вставок
+        self.cluster_model = StreamingClusterer.load(
+            self.clustering_path, self.clustering_config.get('active_model', 'default')
+        )
         
         self.logger.info("EmbeddingAgent успешно инициализирован")
     
     async def _load_model(self):
         """Загрузка модели SentenceTransformers"""
         try:
-            model_name = "sentence-transformers/all-MiniLM-L6-v2"
+            model_name = self.model_name
             model_file = os.path.join(self.model_path, "sentence_transformers")
             
             self.logger.info(f"Загрузка SentenceTransformers из {model_file}")
@@ -59,6 +163,75 @@ class EmbeddingAgent(BaseAgent):
             self.logger.error(f"Ошибка загрузки модели: {e}")
             raise
     
+    async def _connect_vector_store(self):
+        """Подключение к выбранному бэкенду хранилища векторов"""
+        if self.vector_backend == 'local':
+            self.collection = self._create_local_store(self.collection_name)
+            self.logger.info(f"Подключен локальный индекс {self.collection_name}")
+        else:
+            await self._connect_chromadb()
+        
+        # Синхронные вызовы хранилища не должны блокировать event loop
+        self.collection = self._wrap_store(self.collection)
+        
+        self.namespaces = NamespaceRouter(
+            self._open_namespace_store,
+            base_name=self.collection_name,
+            small_threshold=self.namespace_config.get('small_threshold', 2048),
+            max_open=self.namespace_config.get('max_open', 256),
+            open_text_index=self._open_namespace_text_index,
+            compact_text_index=self._compact_text_index
+        )
+    
+    def _create_local_store(self, name: str) -> LocalVectorStore:
+        return LocalVectorStore(
+            self.vector_store_config.get('path', '/app/data/vectors'),
+            name=name,
+            dimension=self.model.get_sentence_embedding_dimension(),
+            nprobe=self.vector_store_config.get('nprobe', 8),
+            quantization=self.vector_store_config.get('quantization'),
+            rescore_factor=self.vector_store_config.get('rescore_factor', 4)
+        )
+    
+    def _wrap_store(self, store, executor: Optional[ThreadPoolExecutor] = None) -> AsyncVectorStore:
+        return AsyncVectorStore(
+            store,
+            max_workers=self.vector_store_config.get('max_workers', 4),
+            timeout=self.vector_store_config.get('timeout', 30.0),
+            retries=self.vector_store_config.get('retries', 2),
+            add_batch_size=self.add_batch_size,
+            max_inflight_adds=self.vector_store_config.get('max_inflight_adds', 4),
+            executor=executor
+        )
+    
+    async def _open_namespace_store(self, name: str) -> AsyncVectorStore:
+        """Открытие (или создание) коллекции пространства имен в текущем бэкенде"""
+        loop = asyncio.get_running_loop()
+        if self.vector_backend == 'local':
+            store = await loop.run_in_executor(self.namespace_executor, self._create_local_store, name)
+        else:
+            store = ChromaVectorStore(await loop.run_in_executor(
+                self.namespace_executor,
+                functools.partial(
+                    self.chroma_client.get_or_create_collection,
+                    name=name,
+                    metadata={"hnsw:space": "cosine"},
+                    embedding_function=None
+                )
+            ))
+        # Коллекций может быть много - все используют общий пул потоков
+        return self._wrap_store(store, executor=self.namespace_executor)
+    
+    @contextlib.asynccontextmanager
+    async def _collection_for(self, data: Dict[str, Any]):
+        """Коллекция задачи: пространство имен (namespace, tenant, chat_id) или общая"""
+        namespace = namespace_from(data)
+        if namespace is None:
+            yield self.collection, None
+            return
+        async with self.namespaces.use(namespace) as collection:
+            yield collection, namespace
+    
     async def _connect_chromadb(self):
         """Подключение к ChromaDB"""
         try:
@@ -70,17 +243,20 @@ class EmbeddingAgent(BaseAgent):
                 port=chroma_port
             )
             
-            # Создание или получение коллекции
+            # Создание или получение коллекции. embedding_function=None:
+            # векторы всегда считает собственная модель агента, а не Chroma
             try:
-                self.collection = self.chroma_client.get_collection(
-                    name=self.collection_name
-                )
+                self.collection = ChromaVectorStore(self.chroma_client.get_collection(
+                    name=self.collection_name,
+                    embedding_function=None
+                ))
                 self.logger.info(f"Подключена существующая коллекция {self.collection_name}")
             except:
-                self.collection = self.chroma_client.create_collection(
+                self.collection = ChromaVectorStore(self.chroma_client.create_collection(
                     name=self.collection_name,
-                    metadata={"hnsw:space": "cosine"}
-                )
+                    metadata={"hnsw:space": "cosine"},
+                    embedding_function=None
+                ))
                 self.logger.info(f"Создана новая коллекция {self.collection_name}")
             
         except Exception as e:
@@ -92,26 +268,183 @@ class EmbeddingAgent(BaseAgent):
                         persist_directory="/app/data/chroma"
                     )
                 )
-                self.collection = self.chroma_client.get_or_create_collection(
-                    name=self.collection_name
-                )
+                self.collection = ChromaVectorStore(self.chroma_client.get_or_create_collection(
+                    name=self.collection_name,
+                    metadata={"hnsw:space": "cosine"},
+                    embedding_function=None
+                ))
                 self.logger.info("Подключена локальная ChromaDB")
             except Exception as e2:
                 self.logger.error(f"Критическая ошибка подключения к ChromaDB: {e2}")
                 raise
     
+    def _build_onnx_encoder(self) -> OnnxSentenceEncoder:
+        return OnnxSentenceEncoder(
+            self.model,
+            self.model_path,
+            self.model_name,
+            threads=self.onnx_config.get('threads', 0),
+            quantize=self.onnx_config.get('quantize', False)
+        )
+    
+    def _onnx_parity(self, encoder: OnnxSentenceEncoder, texts: List[str]) -> Dict[str, Any]:
+        """Сверка эмбеддингов ONNX с torch на одних и тех же текстах"""
+        reference = self.model.encode(texts, convert_to_numpy=True, show_progress_bar=False)
+        report = parity_report(reference, encoder.encode(texts), cosine=True)
+        # Int8 веса дают заметно большее отклонение, чем float32 экспорт
+        report["min_cosine_required"] = self.onnx_config.get(
+            'min_cosine', 0.99 if encoder.quantize else 0.9999
+        )
+        report["passed"] = report["min_cosine"] >= report["min_cosine_required"]
+        return report
+    
+    async def _enable_onnx_backend(self):
+        """Экспорт модели в ONNX (один раз) и переключение инференса после сверки с torch"""
+        loop = asyncio.get_running_loop()
+        try:
+            encoder = await loop.run_in_executor(self.inference_executor, self._build_onnx_encoder)
+            parity = await loop.run_in_executor(
+                self.inference_executor, self._onnx_parity, encoder, self.PARITY_TEXTS
+            )
+            if not parity["passed"]:
+                self.logger.warning(f"ONNX модель не прошла сверку с torch ({parity}), используется torch")
+                return
+            self.onnx_encoder = encoder
+            self.logger.info(f"Инференс через ONNX Runtime: {encoder.model_file}")
+        except Exception as e:
+            self.logger.warning(f"ONNX бэкенд недоступен ({e}), используется torch")
+    
+    def _embedding_model_id(self) -> str:
+        """Идентификатор модели для кэша: int8 веса дают другие векторы"""
+        if self.onnx_encoder and self.onnx_encoder.quantize:
+            return f"{self.model_name}@onnx-int8"
+        return self.model_name
+    
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        """Синхронное кодирование одного батча (выполняется в inference_executor)"""
+        if self.onnx_encoder:
+            return self.onnx_encoder.encode(texts, batch_size=len(texts))
+        return self.model.encode(
+            texts,
+            batch_size=len(texts),
+            convert_to_numpy=True,
+            show_progress_bar=False
+        )
+    
+    async def _encode(self, texts: List[str],
+                      encode_misses: Optional[Callable[[List[str]], Awaitable[np.ndarray]]] = None) -> np.ndarray:
+        """Векторизация текстов: попадания в кэш минуют модель, промахи идут в общий батч
+        (или в encode_misses - например, в пул процессов массовой загрузки)"""
+        encode_misses = encode_misses or self.batcher.encode
+        if not self.cache:
+            return await encode_misses(texts)
+        
+        loop = asyncio.get_running_loop()
+        found, misses = await loop.run_in_executor(self.cache_executor, self.cache.get_many, texts)
+        if misses:
+            missing_texts = [texts[i] for i in misses]
+            encoded = await encode_misses(missing_texts)
+            await loop.run_in_executor(self.cache_executor, self.cache.put_many, missing_texts, encoded)
+            for i, vector in zip(misses, encoded):
+                found[i] = vector
+        
+        return np.stack(found).astype(np.float32, copy=False)
+    
+    def _create_text_index(self, name: str) -> TextIndex:
+        return TextIndex(
+            self.text_index_config.get('path', '/app/data/text_index'),
+            name=name,
+            compact_every=self.text_index_config.get('compact_every', 10000)
+        )
+    
+    async def _load_text_index(self):
+        """Загрузка BM25 индекса и дозаполнение из хранилища при первом запуске"""
+        loop = asyncio.get_running_loop()
+        self.text_index = await loop.run_in_executor(None, self._create_text_index, self.collection_name)
+        
+        if self.text_index.count() == 0 and await self.collection.count() > 0:
+            asyncio.create_task(self._backfill_text_index(self.collection, self.text_index))
+    
+    async def _open_namespace_text_index(self, name: str, collection: AsyncVectorStore) -> TextIndex:
+        """BM25 индекс пространства имен (свой для каждой коллекции)"""
+        loop = asyncio.get_running_loop()
+        text_index = await loop.run_in_executor(self.namespace_executor, self._create_text_index, name)
+        # Пространства, записанные до появления отдельных индексов, заполняются один раз
+        if text_index.count() == 0 and await collection.count() > 0:
+            await self._backfill_text_index(collection, text_index)
+        return text_index
+    
+    async def _compact_text_index(self, text_index: TextIndex, force: bool):
+        await asyncio.get_running_loop().run_in_executor(
+            self.namespace_executor, functools.partial(text_index.compact, force=force)
+        )
+    
+    async def _backfill_text_index(self, collection: AsyncVectorStore, text_index: TextIndex):
+        """Однократное заполнение BM25 индекса уже сохраненными документами"""
+        page_size = 1000
+        offset = 0
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                page = await collection.get(limit=page_size, offset=offset, include=["documents"])
+                if not page['ids']:
+                    break
+                ids = [id_ for id_, doc in zip(page['ids'], page['documents']) if doc]
+                docs = [doc for doc in page['documents'] if doc]
+                await loop.run_in_executor(None, text_index.add, ids, docs)
+                offset += len(page['ids'])
+            self.logger.info(f"BM25 индекс {collection.name} заполнен: {text_index.count()} документов")
+        except Exception as e:
+            self.logger.error(f"Ошибка заполнения BM25 индекса: {e}")
+    
+    async def _background_work(self):
+        """Периодический снапшот локального индекса, свертка журнала BM25 и сброс кэша эмбеддингов"""
+        if self.cache:
+            await asyncio.get_running_loop().run_in_executor(self.cache_executor, self.cache.flush)
+        if self.collection:
+            await self.collection.snapshot()
+        if self.namespaces:
+            await self.namespaces.snapshot()
+        if self.text_index:
+            await asyncio.get_running_loop().run_in_executor(None, self.text_index.compact)
+        if self.dedup_index:
+            await asyncio.get_running_loop().run_in_executor(None, self.dedup_index.snapshot)
+        if self.cluster_model and self.cluster_model_dirty:
+            await self._save_cluster_model()
+    
+    async def _save_cluster_model(self):
+        """Снапшот модели кластеров, дообученной новыми вставками"""
+        self.cluster_model_dirty = False
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.cluster_model.save)
+        except Exception as e:
+            self.cluster_model_dirty = True
+            self.logger.error(f"Ошибка сохранения модели кластеров: {e}")
+    
     async def process_task(self, task: Task) -> Dict[str, Any]:
         """Обработка задач векторизации"""
         if task.task_type == "text_embedding":
             return await self._create_embeddings(task)
         elif task.task_type == "similarity_search":
             return await self._similarity_search(task)
+        elif task.task_type == "hybrid_search":
+            return await self._hybrid_search(task)
         elif task.task_type == "store_embeddings":
             return await self._store_embeddings(task)
         elif task.task_type == "retrieve_embeddings":
             return await self._retrieve_embeddings(task)
         elif task.task_type == "cluster_texts":
             return await self._cluster_texts(task)
+        elif task.task_type == "cluster_collection":
+            return await self._cluster_collection(task)
+        elif task.task_type == "quantization_benchmark":
+            return await self._quantization_benchmark(task)
+        elif task.task_type == "bulk_ingest":
+            return await self._bulk_ingest(task)
+        elif task.task_type == "export_embeddings":
+            return await self._export_embeddings(task)
+        elif task.task_type == "backend_benchmark":
+            return await self._backend_benchmark(task)
         
         return {"status": "unknown_task_type"}
     
@@ -127,12 +460,8 @@ class EmbeddingAgent(BaseAgent):
             
             self.logger.info(f"Создание эмбеддингов для {len(texts)} текстов")
             
-            # Создание эмбеддингов
-            embeddings = self.model.encode(
-                texts,
-                convert_to_tensor=False,
-                show_progress_bar=True
-            )
+            # Создание эмбеддингов (в составе общего батча)
+            embeddings = await self._encode(texts)
             
             # Преобразование в список для JSON сериализации
             embeddings_list = embeddings.tolist()
@@ -154,55 +483,180 @@ class EmbeddingAgent(BaseAgent):
             return {"status": "error", "error": str(e)}
     
     async def _similarity_search(self, task: Task) -> Dict[str, Any]:
-        """Поиск похожих текстов"""
+        """Поиск похожих текстов (один или несколько запросов за один вызов)"""
         try:
             query_text = task.data.get("query_text", "")
+            query_texts = task.data.get("query_texts") or ([query_text] if query_text else [])
             top_k = task.data.get("top_k", 10)
             filter_metadata = task.data.get("filter", {})
             
+            if not query_texts:
+                return {"status": "error", "error": "Не указан поисковый запрос"}
+            
+            self.logger.info(f"Поиск похожих текстов для {len(query_texts)} запросов: {query_texts[0][:100]}...")
+            
+            # Все запросы векторизуются одним батчем собственной модели
+            query_embeddings = await self._encode(query_texts)
+            
+            # Поиск одним вызовом для всех запросов только в коллекции пространства имен
+            async with self._collection_for(task.data) as (collection, _):
+                results = await collection.query(
+                    query_embeddings=query_embeddings.tolist(),
+                    n_results=top_k,
+                    where=filter_metadata if filter_metadata else None
+                )
+            
+            per_query = [
+                {
+                    "query": text,
+                    "similar_texts": self._format_query_results(results, qi),
+                }
+                for qi, text in enumerate(query_texts)
+            ]
+            
+            response = {
+                "status": "success",
+                "query": query_texts[0],
+                "similar_texts": per_query[0]["similar_texts"],
+                "results_count": len(per_query[0]["similar_texts"]),
+                "metadata": {
+                    "searched_at": datetime.now().isoformat(),
+                    "model": "SentenceTransformers"
+                }
+            }
+            if len(query_texts) > 1:
+                response["results"] = per_query
+            return response
+            
+        except Exception as e:
+            self.logger.error(f"Ошибка поиска похожих текстов: {e}")
+            return {"status": "error", "error": str(e)}
+    
+    async def _hybrid_search(self, task: Task) -> Dict[str, Any]:
+        """Гибридный поиск: BM25 + векторный, слияние через reciprocal rank fusion"""
+        try:
+            query_text = task.data.get("query_text", "")
+            top_k = task.data.get("top_k", 10)
+            filter_metadata = task.data.get("filter", {}) or None
+            dense_weight = task.data.get("dense_weight", 1.0)
+            sparse_weight = task.data.get("sparse_weight", 1.0)
+            rrf_k = task.data.get("rrf_k", 60)
+            candidates = task.data.get("candidates", top_k * 4)
+            
             if not query_text:
                 return {"status": "error", "error": "Не указан поисковый запрос"}
             
-            self.logger.info(f"Поиск похожих текстов для: {query_text[:100]}...")
+            self.logger.info(f"Гибридный поиск для: {query_text[:100]}...")
             
-            # Поиск в ChromaDB
-            results = self.collection.query(
-                query_texts=[query_text],
-                n_results=top_k,
-                where=filter_metadata if filter_metadata else None
-            )
+            loop = asyncio.get_running_loop()
+            query_embedding = await self._encode([query_text])
             
-            # Обработка результатов
-            similar_texts = []
-            if results['documents'] and results['documents'][0]:
-                for i, (doc, distance, metadata) in enumerate(zip(
-                    results['documents'][0],
-                    results['distances'][0],
-                    results['metadatas'][0] or [{}] * len(results['documents'][0])
-                )):
-                    similar_texts.append({
-                        "text": doc,
-                        "similarity": 1 - distance,  # Преобразование расстояния в схожесть
-                        "distance": distance,
-                        "metadata": metadata,
-                        "rank": i + 1
-                    })
+            async with self._collection_for(task.data) as (collection, namespace):
+                # У пространства имен свой BM25 индекс - поиск не затрагивает остальной корпус
+                text_index = collection.text_index if namespace else self.text_index
+                
+                async def sparse_search():
+                    # Фильтр применяется до отбора кандидатов BM25: иначе неподходящие
+                    # документы вытесняют подходящие и результатов меньше top_k
+                    allowed_ids = None
+                    if filter_metadata:
+                        allowed = await collection.get(where=filter_metadata, include=[])
+                        allowed_ids = set(allowed['ids'])
+                    return await loop.run_in_executor(
+                        None, functools.partial(text_index.search, query_text, candidates, allowed_ids)
+                    )
+                
+                # Плотный и разреженный поиск выполняются параллельно
+                dense_results, sparse_hits = await asyncio.gather(
+                    collection.query(
+                        query_embeddings=query_embedding.tolist(),
+                        n_results=candidates,
+                        where=filter_metadata
+                    ),
+                    sparse_search()
+                )
+                
+                dense_hits = self._format_query_results(dense_results, 0)
+                dense_ids = [hit["id"] for hit in dense_hits]
+                sparse_ids = [doc_id for doc_id, _ in sparse_hits]
+                
+                # Документы, найденные только BM25: загрузка содержимого
+                # (в BM25 индексе могут остаться уже удаленные из хранилища)
+                records = {hit["id"]: hit for hit in dense_hits}
+                missing = [doc_id for doc_id in sparse_ids if doc_id not in records]
+                if missing:
+                    extra = await collection.get(ids=missing)
+                    for doc_id, doc, metadata in zip(
+                        extra['ids'],
+                        extra['documents'],
+                        extra['metadatas'] or [{}] * len(extra['ids'])
+                    ):
+                        records[doc_id] = {"id": doc_id, "text": doc, "metadata": metadata}
+                    sparse_ids = [doc_id for doc_id in sparse_ids if doc_id in records]
+            
+            fused = reciprocal_rank_fusion(
+                [dense_ids, sparse_ids],
+                weights=[dense_weight, sparse_weight],
+                k=rrf_k
+            )[:top_k]
+            
+            dense_rank = {doc_id: i + 1 for i, doc_id in enumerate(dense_ids)}
+            sparse_rank = {doc_id: i + 1 for i, doc_id in enumerate(sparse_ids)}
+            bm25_scores = dict(sparse_hits)
+            
+            results = []
+            for rank, (doc_id, score) in enumerate(fused, start=1):
+                record = records[doc_id]
+                results.append({
+                    "id": doc_id,
+                    "text": record["text"],
+                    "metadata": record["metadata"],
+                    "score": score,
+                    "similarity": record.get("similarity"),
+                    "bm25_score": bm25_scores.get(doc_id),
+                    "dense_rank": dense_rank.get(doc_id),
+                    "bm25_rank": sparse_rank.get(doc_id),
+                    "rank": rank
+                })
             
             return {
                 "status": "success",
                 "query": query_text,
-                "similar_texts": similar_texts,
-                "results_count": len(similar_texts),
+                "results": results,
+                "results_count": len(results),
                 "metadata": {
                     "searched_at": datetime.now().isoformat(),
-                    "model": "SentenceTransformers"
+                    "model": "SentenceTransformers + BM25"
                 }
             }
             
         except Exception as e:
-            self.logger.error(f"Ошибка поиска похожих текстов: {e}")
+            self.logger.error(f"Ошибка гибридного поиска: {e}")
             return {"status": "error", "error": str(e)}
     
+    def _format_query_results(self, results: Dict[str, Any], query_index: int) -> List[Dict[str, Any]]:
+        """Преобразование ответа collection.query для одного запроса"""
+        similar_texts = []
+        documents = results['documents'][query_index] if results['documents'] else []
+        if not documents:
+            return similar_texts
+        
+        metadatas = (results['metadatas'] and results['metadatas'][query_index]) or [{}] * len(documents)
+        for i, (doc, distance, metadata) in enumerate(zip(
+            documents,
+            results['distances'][query_index],
+            metadatas
+        )):
+            similar_texts.append({
+                "id": results['ids'][query_index][i],
+                "text": doc,
+                "similarity": 1 - distance,  # Преобразование расстояния в схожесть
+                "distance": distance,
+                "metadata": metadata,
+                "rank": i + 1
+            })
+        return similar_texts
+    
     async def _store_embeddings(self, task: Task) -> Dict[str, Any]:
         """Сохранение эмбеддингов в ChromaDB"""
         try:
@@ -221,28 +675,39 @@ class EmbeddingAgent(BaseAgent):
             if not metadatas:
                 metadatas = [{} for _ in texts]
             elif len(metadatas) != len(texts):
-                metadatas = [metadatas[0] if metadatas else {} for _ in texts]
+                metadatas = [dict(metadatas[0]) if metadatas else {} for _ in texts]
             
             # Добавление временных меток
             for metadata in metadatas:
                 metadata["created_at"] = datetime.now().isoformat()
             
-            self.logger.info(f"Сохранение {len(texts)} текстов в ChromaDB")
-            
-            # Сохранение в ChromaDB
-            self.collection.add(
-                documents=texts,
-                metadatas=metadatas,
-                ids=ids
+            # Дедупликация до вызова модели. Индекс дублей общий, поэтому для
+            # пространств имен она отключена: связь с документом другого тенанта недопустима
+            namespace = namespace_from(task.data)
+            dedup_mode = "off" if namespace else task.data.get("dedup", self.dedup_config.get('mode', 'exact'))
+            texts, metadatas, ids, dedup_report = await self._filter_duplicates(
+                texts, metadatas, ids, dedup_mode
             )
             
+            if texts:
+                self.logger.info(f"Сохранение {len(texts)} текстов в ChromaDB")
+                try:
+                    async with self._collection_for(task.data) as (collection, namespace):
+                        await self._embed_and_add(texts, metadatas, ids, collection, namespace)
+                except Exception:
+                    if self.dedup_index:
+                        self.dedup_index.forget(ids)
+                    raise
+            
             return {
                 "status": "success",
                 "stored_count": len(texts),
                 "ids": ids,
+                "dedup": dedup_report,
                 "metadata": {
                     "stored_at": datetime.now().isoformat(),
-                    "collection": self.collection_name
+                    "collection": self.collection_name,
+                    "namespace": namespace
                 }
             }
             
@@ -250,24 +715,110 @@ class EmbeddingAgent(BaseAgent):
             self.logger.error(f"Ошибка сохранения эмбеддингов: {e}")
             return {"status": "error", "error": str(e)}
     
+    async def _filter_duplicates(self, texts: List[str], metadatas: List[Dict[str, Any]],
+                                 ids: List[str], mode: str):
+        """Отсев точных и почти точных дублей (mode: off, exact, skip, link)"""
+        report = {"mode": mode, "skipped": 0, "linked": {}, "duplicates": []}
+        if not self.dedup_index or mode == "off":
+            return texts, metadatas, ids, report
+        
+        # В режиме exact почти точные дубли сохраняются и регистрируются как новые
+        matches = await asyncio.get_running_loop().run_in_executor(
+            None, self.dedup_index.check_and_add, ids, texts, mode != "exact"
+        )
+        
+        keep = []
+        for i, match in enumerate(matches):
+            if match is None:
+                keep.append(i)
+                continue
+            original_id, kind, similarity = match
+            report["duplicates"].append({
+                "id": ids[i], "original_id": original_id, "type": kind, "similarity": similarity
+            })
+            if mode == "link":
+                self.dedup_index.link(ids[i], original_id)
+                report["linked"][ids[i]] = original_id
+            else:
+                report["skipped"] += 1
+        
+        # Оценка сэкономленного времени по средней стоимости кодирования текста
+        duplicates = len(matches) - len(keep)
+        stats = self.batcher.get_stats() if self.batcher else {}
+        per_text = stats.get("encode_seconds", 0.0) / stats["unique_texts"] if stats.get("unique_texts") else 0.0
+        report["estimated_seconds_saved"] = duplicates * per_text
+        self.dedup_seconds_saved += duplicates * per_text
+        
+        return (
+            [texts[i] for i in keep],
+            [metadatas[i] for i in keep],
+            [ids[i] for i in keep],
+            report
+        )
+    
+    async def _embed_and_add(self, texts: List[str], metadatas: List[Dict[str, Any]], ids: List[str],
+                             collection=None, namespace: Optional[str] = None):
+        """Векторизация и запись в хранилище (по умолчанию общее) и BM25 индекс"""
+        embeddings = await self._encode(texts)
+        await self._add_embedded(texts, metadatas, ids, embeddings, collection, namespace)
+    
+    async def _add_embedded(self, texts: List[str], metadatas: List[Dict[str, Any]], ids: List[str],
+                            embeddings: np.ndarray, collection=None, namespace: Optional[str] = None):
+        """Разметка кластеров и запись готовых векторов в хранилище и BM25 индекс"""
+        collection = collection or self.collection
+        loop = asyncio.get_running_loop()
+        
+        # Инкрементальное назначение кластеров без полного пересчета
+        if self.cluster_model:
+            labels = await loop.run_in_executor(None, self.cluster_model.assign_new, embeddings)
+            for metadata, label in zip(metadatas, labels):
+                metadata[f"cluster_{self.cluster_model.name}"] = int(label)
+            self.cluster_model_dirty = True
+        
+        # Сохранение в хранилище конвейером чанков с готовыми векторами
+        await collection.add(
+            embeddings=embeddings.tolist(),
+            documents=texts,
+            metadatas=metadatas,
+            ids=ids
+        )
+        
+        # Инкрементальное обновление BM25 индекса (своего у пространства имен)
+        text_index = collection.text_index if namespace else self.text_index
+        if text_index:
+            await loop.run_in_executor(None, text_index.add, ids, texts)
+    
     async def _retrieve_embeddings(self, task: Task) -> Dict[str, Any]:
         """Получение эмбеддингов из ChromaDB"""
         try:
             ids = task.data.get("ids", [])
             limit = task.data.get("limit", 100)
             offset = task.data.get("offset", 0)
+            next_cursor = None
             
             self.logger.info(f"Получение эмбеддингов из ChromaDB")
             
-            if ids:
-                # Получение по конкретным ID
-                results = self.collection.get(ids=ids)
-            else:
-                # Получение всех с пагинацией
-                results = self.collection.get(
-                    limit=limit,
-                    offset=offset
-                )
+            async with self._collection_for(task.data) as (collection, namespace):
+                if ids:
+                    # Получение по конкретным ID (связанные дубли разрешаются в оригиналы)
+                    if self.dedup_index and namespace is None:
+                        ids = list(dict.fromkeys(self.dedup_index.resolve(ids)))
+                    results = await collection.get(ids=ids)
+                elif "cursor" in task.data:
+                    # Keyset-пагинация: следующая страница по курсору из прошлого ответа
+                    results = await collection.scan(
+                        where=task.data.get("filter_metadata"),
+                        cursor=task.data["cursor"],
+                        limit=limit,
+                        include_documents=True
+                    )
+                    next_cursor = results['cursor']
+                else:
+                    # Получение всех с пагинацией
+                    results = await collection.get(
+                        limit=limit,
+                        offset=offset
+                    )
             
             # Обработка результатов
             retrieved_data = []
@@ -286,6 +837,7 @@ class EmbeddingAgent(BaseAgent):
                 "status": "success",
                 "retrieved_data": retrieved_data,
                 "count": len(retrieved_data),
+                "next_cursor": next_cursor,
                 "metadata": {
                     "retrieved_at": datetime.now().isoformat(),
                     "collection": self.collection_name
@@ -296,6 +848,73 @@ class EmbeddingAgent(BaseAgent):
             self.logger.error(f"Ошибка получения эмбеддингов: {e}")
             return {"status": "error", "error": str(e)}
     
+    async def _iter_stored_embeddings(self, where: Optional[Dict[str, Any]], chunk_size: int):
+        """Потоковое чтение сохраненных векторов чанками"""
+        async for page in iter_pages(self.collection, where=where, page_size=chunk_size):
+            yield page['ids'], page['embeddings']
+    
+    async def _cluster_collection(self, task: Task) -> Dict[str, Any]:
+        """Кластеризация сохраненной коллекции MiniBatchKMeans без повторного кодирования"""
+        try:
+            name = task.data.get("name", "default")
+            num_clusters = task.data.get("num_clusters", 5)
+            filter_metadata = task.data.get("filter", {}) or None
+            chunk_size = task.data.get("chunk_size", 1024)
+            passes = task.data.get("passes", 1)
+            assign_new = task.data.get("assign_new", True)
+            samples_per_cluster = task.data.get("samples_per_cluster", 5)
+            
+            self.logger.info(f"Кластеризация коллекции на {num_clusters} кластеров (модель {name})")
+            
+            loop = asyncio.get_running_loop()
+            clusterer = None
+            if not task.data.get("reset", False):
+                clusterer = StreamingClusterer.load(self.clustering_path, name)
+                if clusterer and clusterer.num_clusters != num_clusters:
+                    clusterer = None
+            if clusterer is None:
+                clusterer = StreamingClusterer(self.clustering_path, name, num_clusters, batch_size=chunk_size)
+            
+            # Обучение: векторы читаются из хранилища чанками
+            for _ in range(passes):
+                async for _, vectors in self._iter_stored_embeddings(filter_metadata, chunk_size):
+                    await loop.run_in_executor(None, clusterer.partial_fit, vectors)
+                await loop.run_in_executor(None, clusterer.finish)
+            
+            # Назначение кластеров и примеры документов
+            clusterer.reset_sizes()
+            samples: Dict[int, List[str]] = {i: [] for i in range(num_clusters)}
+            async for ids, vectors in self._iter_stored_embeddings(filter_metadata, chunk_size):
+                labels = await loop.run_in_executor(None, clusterer.predict, vectors)
+                for id_, label in zip(ids, labels):
+                    if len(samples[int(label)]) < samples_per_cluster:
+                        samples[int(label)].append(id_)
+            
+            await loop.run_in_executor(None, clusterer.save)
+            if assign_new:
+                self.cluster_model = clusterer
+                self.cluster_model_dirty = False
+            
+            info = clusterer.get_info()
+            return {
+                "status": "success",
+                "model": name,
+                "num_clusters": num_clusters,
+                "cluster_sizes": info["cluster_sizes"],
+                "sample_ids": samples,
+                "centroids": clusterer.model.cluster_centers_.tolist(),
+                "samples_seen": info["samples_seen"],
+                "metadata": {
+                    "clustered_at": datetime.now().isoformat(),
+                    "model": "MiniBatchKMeans",
+                    "collection": self.collection_name
+                }
+            }
+            
+        except Exception as e:
+            self.logger.error(f"Ошибка кластеризации коллекции: {e}")
+            return {"status": "error", "error": str(e)}
+    
     async def _cluster_texts(self, task: Task) -> Dict[str, Any]:
         """Кластеризация текстов"""
         try:
@@ -307,8 +926,8 @@ class EmbeddingAgent(BaseAgent):
             
             self.logger.info(f"Кластеризация {len(texts)} текстов на {num_clusters} кластеров")
             
-            # Создание эмбеддингов
-            embeddings = self.model.encode(texts, convert_to_tensor=False)
+            # Создание эмбеддингов (с использованием кэша)
+            embeddings = await self._encode(texts)
             
             # Простая кластеризация K-means
             from sklearn.cluster import KMeans
@@ -346,12 +965,217 @@ class EmbeddingAgent(BaseAgent):
             self.logger.error(f"Ошибка кластеризации: {e}")
             return {"status": "error", "error": str(e)}
     
+    async def _quantization_benchmark(self, task: Task) -> Dict[str, Any]:
+        """Оценка recall@k и задержки квантизованного поиска против float32"""
+        try:
+            num_queries = task.data.get("num_queries", 100)
+            top_k = task.data.get("top_k", 10)
+            
+            self.logger.info(f"Оценка квантизации на {num_queries} запросах, k={top_k}")
+            
+            report = await self.collection.benchmark_quantization(num_queries=num_queries, k=top_k)
+            
+            return {
+                "status": "success",
+                "report": report,
+                "metadata": {
+                    "benchmarked_at": datetime.now().isoformat(),
+                    "collection": self.collection_name
+                }
+            }
+            
+        except Exception as e:
+            self.logger.error(f"Ошибка оценки квантизации: {e}")
+            return {"status": "error", "error": str(e)}
+    
+    async def _bulk_ingest(self, task: Task) -> Dict[str, Any]:
+        """Потоковая загрузка корпуса из файлов (NDJSON, CSV, каталог текстов)"""
+        try:
+            source = task.data.get("source")
+            if not source:
+                return {"status": "error", "error": "Не указан источник для загрузки"}
+            
+            # Процессы пула кодируют тем же бэкендом, что и агент (ONNX - если прошел сверку)
+            onnx = None
+            if self.onnx_encoder:
+                onnx = (self.model_path, self.model_name, self.onnx_encoder.quantize)
+            ingestor = BulkIngestor(
+                model_path=os.path.join(self.model_path, "sentence_transformers"),
+                checkpoint_dir=self.bulk_ingest_config.get('checkpoint_path', '/app/data/ingest'),
+                workers=task.data.get("workers", self.bulk_ingest_config.get('workers')),
+                batch_size=task.data.get("batch_size", self.bulk_ingest_config.get('batch_size', 256)),
+                onnx=onnx
+            )
+            
+            # Как и при store_embeddings: дедупликация только в общей коллекции
+            namespace = namespace_from(task.data)
+            dedup_mode = "off" if namespace else task.data.get("dedup", self.dedup_config.get('mode', 'exact'))
+            dedup_totals = {"mode": dedup_mode, "skipped": 0, "linked": 0}
+            
+            self.logger.info(f"Массовая загрузка из {source} ({ingestor.workers} процессов)")
+            
+            async def prepare(ids, texts, metadatas, replace, encode):
+                # ID фрагментов детерминированы: регистрация прошлого (прерванного)
+                # запуска не должна сделать фрагмент дублем самого себя
+                if self.dedup_index and dedup_mode != "off":
+                    self.dedup_index.forget(ids)
+                texts, metadatas, ids, dedup_report = await self._filter_duplicates(
+                    texts, metadatas, ids, dedup_mode
+                )
+                dedup_totals["skipped"] += dedup_report["skipped"]
+                dedup_totals["linked"] += len(dedup_report["linked"])
+                # Кэш эмбеддингов проверяется до пула процессов - кодируются только промахи
+                embeddings = await self._encode(texts, encode) if texts else None
+                return texts, metadatas, ids, embeddings
+            
+            async with self._collection_for(task.data) as (collection, namespace):
+                async def write(batch_ids, prepared, replace):
+                    texts, metadatas, ids, embeddings = prepared
+                    # После возобновления батч перезаписывается, чтобы не получить дубли ID
+                    if replace:
+                        await collection.delete(ids=batch_ids)
+                    if texts:
+                        await self._add_embedded(texts, metadatas, ids, embeddings, collection, namespace)
+                
+                report = await ingestor.run(
+                    source,
+                    prepare,
+                    write,
+                    job_id=task.data.get("job_id"),
+                    resume=task.data.get("resume", True),
+                    text_field=task.data.get("text_field", "text"),
+                    id_field=task.data.get("id_field"),
+                    window=task.data.get("window", self.bulk_ingest_config.get('window', 200)),
+                    overlap=task.data.get("overlap", self.bulk_ingest_config.get('overlap', 50))
+                )
+            report["dedup"] = dedup_totals
+            
+            self.logger.info(
+                f"Загрузка {report['job_id']}: {report['chunks_written']} фрагментов"
+            )
+            
+            return {
+                "status": "success",
+                "report": report,
+                "metadata": {
+                    "ingested_at": datetime.now().isoformat(),
+                    "collection": self.collection_name,
+                    "namespace": namespace
+                }
+            }
+            
+        except Exception as e:
+            self.logger.error(f"Ошибка массовой загрузки: {e}")
+            return {"status": "error", "error": str(e)}
+    
+    async def _export_embeddings(self, task: Task) -> Dict[str, Any]:
+        """Потоковый экспорт id, векторов и метаданных в .npy или Arrow IPC"""
+        try:
+            export_format = task.data.get("format", "npy")
+            if export_format not in EXPORT_FORMATS:
+                return {"status": "error", "error": f"Неизвестный формат экспорта: {export_format}"}
+            
+            filter_metadata = task.data.get("filter_metadata")
+            page_size = task.data.get("page_size", 4096)
+            out_dir = os.path.join(
+                self.export_path,
+                task.data.get("name") or f"{self.collection_name}_{datetime.now():%Y%m%d_%H%M%S}"
+            )
+            
+            self.logger.info(f"Экспорт эмбеддингов в {out_dir} ({export_format})")
+            
+            pages = iter_pages(
+                self.collection,
+                where=filter_metadata,
+                page_size=page_size,
+                include_documents=task.data.get("include_documents", False)
+            )
+            dimension = self.model.get_sentence_embedding_dimension()
+            if export_format == "arrow":
+                report = await export_arrow(pages, out_dir, dimension)
+            else:
+                report = await export_npy(pages, out_dir, dimension)
+            
+            return {
+                "status": "success",
+                "export": report,
+                "metadata": {
+                    "exported_at": datetime.now().isoformat(),
+                    "collection": self.collection_name,
+                    "filter": filter_metadata
+                }
+            }
+            
+        except Exception as e:
+            self.logger.error(f"Ошибка экспорта эмбеддингов: {e}")
+            return {"status": "error", "error": str(e)}
+    
+    async def _backend_benchmark(self, task: Task) -> Dict[str, Any]:
+        """Сверка и сравнение пропускной способности torch и ONNX Runtime"""
+        try:
+            num_texts = task.data.get("num_texts", 256)
+            texts = task.data.get("texts") or self.PARITY_TEXTS
+            texts = (texts * (num_texts // len(texts) + 1))[:num_texts]
+            batch_size = task.data.get("batch_size", 64)
+            
+            self.logger.info(f"Сравнение бэкендов инференса на {len(texts)} текстах")
+            
+            loop = asyncio.get_running_loop()
+            encoder = self.onnx_encoder or await loop.run_in_executor(
+                self.inference_executor, self._build_onnx_encoder
+            )
+            
+            def run():
+                parity = self._onnx_parity(encoder, texts[:64])
+                throughput = benchmark({
+                    "torch": lambda: self.model.encode(
+                        texts, batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False
+                    ),
+                    "onnx": lambda: encoder.encode(texts, batch_size=batch_size)
+                }, items=len(texts), repeats=task.data.get("repeats", 3))
+                return parity, throughput
+            
+            parity, throughput = await loop.run_in_executor(self.inference_executor, run)
+            
+            return {
+                "status": "success",
+                "active_backend": "onnx" if self.onnx_encoder else "torch",
+                "onnx_model": encoder.model_file,
+                "quantized": encoder.quantize,
+                "parity": parity,
+                "throughput": throughput,
+                "speedup": throughput["onnx"]["items_per_second"] / throughput["torch"]["items_per_second"],
+                "metadata": {
+                    "benchmarked_at": datetime.now().isoformat(),
+                    "batch_size": batch_size
+                }
+            }
+            
+        except Exception as e:
+            self.logger.error(f"Ошибка сравнения бэкендов: {e}")
+            return {"status": "error", "error": str(e)}
+    
     async def _cleanup_agent(self):
         """Очистка ресурсов EmbeddingAgent"""
+        if self.batcher:
+            await self.batcher.stop()
+        if self.cache:
+            await asyncio.get_running_loop().run_in_executor(self.cache_executor, self.cache.close)
+        if self.text_index:
+            self.text_index.compact(force=True)
+        if self.cluster_model and self.cluster_model_dirty:
+            await self._save_cluster_model()
         if self.model:
             del self.model
-        if self.chroma_client:
-            # ChromaDB клиент автоматически закрывает соединения
+        # ChromaDB клиент автоматически закрывает соединения,
+        # локальный индекс сохраняет снапшот
+        if self.collection:
+            await self.collection.close()
+        if self.namespaces:
+            await self.namespaces.close()
+        self.namespace_executor.shutdown(wait=False)
+        self.inference_executor.shutdown(wait=False)
+        self.cache_executor.shutdown(wait=False)
         
         self.logger.info("EmbeddingAgent очищен")
     
@@ -363,21 +1187,31 @@ class EmbeddingAgent(BaseAgent):
             "embedding_dimension": 384,
             "loaded": self.model is not None,
             "chromadb_connected": self.chroma_client is not None,
+            "vector_backend": self.vector_backend,
+            "inference_backend": "onnx" if self.onnx_encoder else "torch",
             "collection": self.collection_name
         }
     
     async def health_check(self) -> Dict[str, Any]:
         """Проверка здоровья агента"""
         try:
-            # Проверка ChromaDB
-            collection_count = self.collection.count() if self.chroma_client else -1
+            # Проверка хранилища векторов
+            collection_count = await self.collection.count() if self.collection else -1
             
             return {
                 "status": "healthy" if self.model is not None else "error",
                 "model_loaded": self.model is not None,
                 "chromadb_connected": self.chroma_client is not None,
+                "vector_backend": self.vector_backend,
                 "collection_count": collection_count,
-                "collection_name": self.collection_name
+                "collection_name": self.collection_name,
+                "batching": self.batcher.get_stats() if self.batcher else {},
+                "embedding_cache": self.cache.get_stats() if self.cache else {},
+                "dedup": {
+                    **(self.dedup_index.get_stats() if self.dedup_index else {}),
+                    "estimated_seconds_saved": self.dedup_seconds_saved
+                },
+                "namespaces": self.namespaces.get_stats() if self.namespaces else {}
             }
         except Exception as e:
             return {
@@ -0,0 +1,228 @@
+"""
+EmbeddingBatcher - динамический микро-батчинг запросов к SentenceTransformer (CPU-only)
+
+Тексты из одновременно выполняющихся задач собираются в течение короткого окна
+(или до заполнения батча), кодируются одним вызовом модели с группировкой по длине
+и раздаются обратно каждой задаче.
+"""
+
+import asyncio
+import logging
+import time
+from concurrent.futures import Executor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+
+
+EncodeFn = Callable[[List[str]], np.ndarray]
+
+
+class EmbeddingBatcher:
+    """Динамический микро-батчер вызовов encode"""
+
+    def __init__(
+        self,
+        encode_fn: EncodeFn,
+        max_batch_items: int = 256,
+        bucket_size: int = 32,
+        min_wait_ms: float = 1.0,
+        max_wait_ms: float = 10.0,
+        executor: Optional[Executor] = None
+    ):
+        self.encode_fn = encode_fn
+        self.max_batch_items = max(1, max_batch_items)
+        self.bucket_size = max(1, bucket_size)
+        self.min_wait = min_wait_ms / 1000.0
+        self.max_wait = max(max_wait_ms, min_wait_ms) / 1000.0
+        self.executor = executor
+        self.logger = logging.getLogger("agent.embedding_agent.batcher")
+
+        # Текущее окно ожидания, адаптируется под нагрузку
+        self.window = self.min_wait
+
+        self._pending: List[Tuple[List[str], asyncio.Future]] = []
+        # Батч, который сейчас кодируется (уже извлечен из _pending)
+        self._inflight: List[Tuple[List[str], asyncio.Future]] = []
+        self._pending_items = 0
+        self._has_items: Optional[asyncio.Event] = None
+        self._batch_full: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+
+        self.stats = {
+            "batches": 0,
+            "requests": 0,
+            "texts": 0,
+            "unique_texts": 0,
+            "encode_seconds": 0.0
+        }
+
+    def start(self):
+        """Запуск фонового обработчика батчей"""
+        if self._worker is None or self._worker.done():
+            self._has_items = asyncio.Event()
+            self._batch_full = asyncio.Event()
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановка батчера с отменой ожидающих запросов"""
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+        for _, future in self._inflight + self._pending:
+            if not future.done():
+                future.cancel()
+        self._inflight = []
+        self._pending = []
+        self._pending_items = 0
+
+    async def encode(self, texts: List[str]) -> np.ndarray:
+        """Векторизация текстов в составе общего батча"""
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        self.start()
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((list(texts), future))
+        self._pending_items += len(texts)
+
+        self._has_items.set()
+        if self._pending_items >= self.max_batch_items:
+            self._batch_full.set()
+
+        return await future
+
+    async def _run(self):
+        """Сбор запросов в батчи и их кодирование"""
+        loop = asyncio.get_running_loop()
+
+        while True:
+            await self._has_items.wait()
+
+            # Ожидание новых запросов в пределах окна или до заполнения батча
+            deadline = loop.time() + self.window
+            while self._pending_items < self.max_batch_items:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                self._batch_full.clear()
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+
+            batch = self._take_batch()
+            self._has_items.clear()
+            if self._pending:
+                self._has_items.set()
+
+            if batch:
+                # При отмене обработчика ссылка остается - stop() отменит ожидающих
+                self._inflight = batch
+                await self._encode_batch(batch)
+                self._inflight = []
+
+    def _take_batch(self) -> List[Tuple[List[str], asyncio.Future]]:
+        """Извлечение запросов, помещающихся в один батч"""
+        batch = []
+        items = 0
+        while self._pending:
+            texts, future = self._pending[0]
+            if batch and items + len(texts) > self.max_batch_items:
+                break
+            self._pending.pop(0)
+            self._pending_items -= len(texts)
+            if future.cancelled():
+                continue
+            batch.append((texts, future))
+            items += len(texts)
+        return batch
+
+    async def _encode_batch(self, batch: List[Tuple[List[str], asyncio.Future]]):
+        """Кодирование батча и раздача результатов по запросам"""
+        all_texts = [text for texts, _ in batch for text in texts]
+
+        # Одинаковые тексты кодируются один раз
+        unique_index: Dict[str, int] = {}
+        unique_texts: List[str] = []
+        positions = np.empty(len(all_texts), dtype=np.int64)
+        for i, text in enumerate(all_texts):
+            idx = unique_index.get(text)
+            if idx is None:
+                idx = len(unique_texts)
+                unique_index[text] = idx
+                unique_texts.append(text)
+            positions[i] = idx
+
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            unique_embeddings = await loop.run_in_executor(
+                self.executor, self._encode_bucketed, unique_texts
+            )
+        except Exception as e:
+            self.logger.error(f"Ошибка кодирования батча: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        elapsed = time.perf_counter() - started
+
+        embeddings = unique_embeddings[positions]
+        offset = 0
+        for texts, future in batch:
+            if not future.done():
+                future.set_result(embeddings[offset:offset + len(texts)])
+            offset += len(texts)
+
+        self.stats["batches"] += 1
+        self.stats["requests"] += len(batch)
+        self.stats["texts"] += len(all_texts)
+        self.stats["unique_texts"] += len(unique_texts)
+        self.stats["encode_seconds"] += elapsed
+
+        self._adapt_window(len(batch), len(all_texts))
+
+    def _encode_bucketed(self, texts: List[str]) -> np.ndarray:
+        """Кодирование с группировкой текстов близкой длины (меньше паддинга)"""
+        order = np.argsort([len(text) for text in texts], kind="stable")
+        result: Optional[np.ndarray] = None
+
+        for start in range(0, len(order), self.bucket_size):
+            bucket = order[start:start + self.bucket_size]
+            vectors = np.asarray(
+                self.encode_fn([texts[i] for i in bucket]),
+                dtype=np.float32
+            )
+            if result is None:
+                result = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+            result[bucket] = vectors
+
+        return result
+
+    def _adapt_window(self, requests: int, items: int):
+        """Подстройка окна ожидания под текущую нагрузку"""
+        if items >= self.max_batch_items:
+            # Батчи заполняются быстрее окна - ожидание не нужно
+            self.window = max(self.min_wait, self.window * 0.5)
+        elif requests > 1:
+            # Запросы объединяются - более длинное окно даст большие батчи
+            self.window = min(self.max_wait, self.window * 1.5)
+        else:
+            # Одиночный запрос - ожидание только добавляет задержку
+            self.window = max(self.min_wait, self.window * 0.75)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика батчинга"""
+        batches = self.stats["batches"]
+        return {
+            **self.stats,
+            "avg_batch_texts": self.stats["texts"] / batches if batches else 0.0,
+            "avg_batch_requests": self.stats["requests"] / batches if batches else 0.0,
+            "window_ms": self.window * 1000.0
+        }
@@ -0,0 +1,224 @@
+"""
+EmbeddingCache - персистентный контентно-адресуемый кэш эмбеддингов
+
+Ключ - хэш (идентификатор модели, нормализованный текст). Два уровня:
+LRU в памяти и дисковый уровень (memory-mapped матрица float32 + индекс хэшей).
+Новые записи сбрасываются на диск периодически (flush): сначала векторы,
+затем их ключи, поэтому ключ на диске всегда указывает на записанный вектор.
+Класс не потокобезопасен - вызовы должны идти из одного потока.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+
+
+KEY_SIZE = 20  # sha1 digest
+
+
+def normalize_text(text: str) -> str:
+    """Нормализация текста перед хэшированием"""
+    text = unicodedata.normalize("NFC", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def text_key(model_id: str, text: str) -> bytes:
+    """Контентный ключ эмбеддинга"""
+    payload = f"{model_id}\0{normalize_text(text)}".encode("utf-8")
+    return hashlib.sha1(payload).digest()
+
+
+class EmbeddingCache:
+    """Двухуровневый кэш эмбеддингов, переживающий перезапуски"""
+
+    def __init__(
+        self,
+        cache_dir: str,
+        model_id: str,
+        dimension: int,
+        memory_items: int = 50000,
+        initial_capacity: int = 4096
+    ):
+        self.model_id = model_id
+        self.dimension = dimension
+        self.memory_items = memory_items
+        self.logger = logging.getLogger("agent.embedding_agent.cache")
+
+        model_slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", model_id)
+        self.cache_dir = os.path.join(cache_dir, model_slug)
+        self.vectors_file = os.path.join(self.cache_dir, "vectors.f32")
+        self.keys_file = os.path.join(self.cache_dir, "keys.bin")
+        self.meta_file = os.path.join(self.cache_dir, "meta.json")
+
+        self._memory: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._index: Dict[bytes, int] = {}
+        self._rows = 0
+        self._capacity = 0
+        self._vectors: Optional[np.memmap] = None
+        # Ключи строк, векторы которых еще не сброшены на диск
+        self._pending_keys: List[bytes] = []
+        self._initial_capacity = initial_capacity
+
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stored": 0}
+
+        self._open()
+
+    def _open(self):
+        """Открытие или создание дискового уровня"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        if os.path.exists(self.meta_file):
+            with open(self.meta_file, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("dimension") != self.dimension or meta.get("model_id") != self.model_id:
+                self.logger.warning("Параметры кэша эмбеддингов изменились, кэш сброшен")
+                for path in (self.vectors_file, self.keys_file):
+                    if os.path.exists(path):
+                        os.remove(path)
+
+        with open(self.meta_file, "w", encoding="utf-8") as f:
+            json.dump({"model_id": self.model_id, "dimension": self.dimension}, f)
+
+        row_bytes = self.dimension * 4
+        file_rows = os.path.getsize(self.vectors_file) // row_bytes if os.path.exists(self.vectors_file) else 0
+
+        keys = b""
+        if os.path.exists(self.keys_file):
+            with open(self.keys_file, "rb") as f:
+                keys = f.read()
+
+        # Ключ записывается после вектора, поэтому строк с ключами не больше, чем векторов
+        self._rows = min(len(keys) // KEY_SIZE, file_rows)
+        for row in range(self._rows):
+            self._index[keys[row * KEY_SIZE:(row + 1) * KEY_SIZE]] = row
+
+        if len(keys) != self._rows * KEY_SIZE:
+            with open(self.keys_file, "r+b" if keys else "wb") as f:
+                f.truncate(self._rows * KEY_SIZE)
+
+        self._map(max(file_rows, self._initial_capacity))
+        self.logger.info(f"Кэш эмбеддингов открыт: {self._rows} записей в {self.cache_dir}")
+
+    def _map(self, capacity: int):
+        """(Пере)отображение файла векторов с заданной емкостью"""
+        if self._vectors is not None:
+            self._vectors.flush()
+            del self._vectors
+
+        row_bytes = self.dimension * 4
+        with open(self.vectors_file, "ab") as f:
+            if f.tell() < capacity * row_bytes:
+                f.truncate(capacity * row_bytes)
+
+        self._capacity = capacity
+        self._vectors = np.memmap(
+            self.vectors_file, dtype=np.float32, mode="r+", shape=(capacity, self.dimension)
+        )
+
+    def get_many(self, texts: List[str]) -> Tuple[List[Optional[np.ndarray]], List[int]]:
+        """Пакетный поиск: векторы (None для промахов) и индексы промахов"""
+        keys = [text_key(self.model_id, text) for text in texts]
+        found: List[Optional[np.ndarray]] = [None] * len(texts)
+        disk_positions: List[int] = []
+        disk_rows: List[int] = []
+        misses: List[int] = []
+
+        for i, key in enumerate(keys):
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                found[i] = vector
+                self.stats["memory_hits"] += 1
+                continue
+            row = self._index.get(key)
+            if row is not None:
+                disk_positions.append(i)
+                disk_rows.append(row)
+            else:
+                misses.append(i)
+
+        if disk_rows:
+            # Одно обращение к memmap на весь батч
+            vectors = np.array(self._vectors[np.asarray(disk_rows)])
+            for position, vector in zip(disk_positions, vectors):
+                found[position] = vector
+                self._remember(keys[position], vector)
+            self.stats["disk_hits"] += len(disk_rows)
+
+        self.stats["misses"] += len(misses)
+        return found, misses
+
+    def put_many(self, texts: List[str], vectors: np.ndarray):
+        """Сохранение новых эмбеддингов в оба уровня"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        new_keys: List[bytes] = []
+        new_vectors: List[np.ndarray] = []
+        seen = set()
+
+        for text, vector in zip(texts, vectors):
+            key = text_key(self.model_id, text)
+            self._remember(key, vector)
+            if key not in self._index and key not in seen:
+                seen.add(key)
+                new_keys.append(key)
+                new_vectors.append(vector)
+
+        if not new_keys:
+            return
+
+        needed = self._rows + len(new_keys)
+        if needed > self._capacity:
+            capacity = self._capacity
+            while capacity < needed:
+                capacity *= 2
+            self._map(capacity)
+
+        start = self._rows
+        self._vectors[start:needed] = np.stack(new_vectors)
+        self._pending_keys.extend(new_keys)
+
+        for offset, key in enumerate(new_keys):
+            self._index[key] = start + offset
+        self._rows = needed
+        self.stats["stored"] += len(new_keys)
+
+    def _remember(self, key: bytes, vector: np.ndarray):
+        """Помещение вектора в LRU уровень памяти"""
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def flush(self):
+        """Сброс новых векторов и дозапись их ключей в индекс"""
+        if not self._pending_keys or self._vectors is None:
+            return
+        self._vectors.flush()
+        with open(self.keys_file, "ab") as f:
+            f.write(b"".join(self._pending_keys))
+        self._pending_keys = []
+
+    def close(self):
+        """Сброс данных на диск"""
+        if self._vectors is not None:
+            self.flush()
+            self._vectors.flush()
+            del self._vectors
+            self._vectors = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика кэша"""
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        lookups = hits + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "disk_entries": self._rows
+        }
@@ -0,0 +1,148 @@
+"""
+StreamingClusterer - инкрементальная кластеризация сохраненных эмбеддингов
+
+MiniBatchKMeans обучается по чанкам векторов, прочитанных из хранилища,
+без повторного кодирования текстов. Модель сохраняется на диск, и новые
+вставки назначаются в кластеры (с дообучением) без полного пересчета.
+"""
+
+import logging
+import os
+import pickle
+import re
+import tempfile
+import threading
+from typing import Any, Dict, List, Optional
+import numpy as np
+
+
+class StreamingClusterer:
+    """Персистентная модель MiniBatchKMeans"""
+
+    def __init__(self, path: str, name: str, num_clusters: int, batch_size: int = 1024):
+        from sklearn.cluster import MiniBatchKMeans
+
+        self.path = path
+        self.name = name
+        self.num_clusters = num_clusters
+        self.model = MiniBatchKMeans(
+            n_clusters=num_clusters,
+            batch_size=batch_size,
+            random_state=42,
+            n_init=3
+        )
+        self.samples_seen = 0
+        self.cluster_sizes = np.zeros(num_clusters, dtype=np.int64)
+        self._buffer: List[np.ndarray] = []
+        self._buffered = 0
+        self.fitted = False
+        self.logger = logging.getLogger("agent.embedding_agent.clustering")
+        # Модель дообучается из параллельных задач вставки - изменения и сохранение под блокировкой
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        state.pop("logger", None)
+        state.pop("_lock", None)
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]):
+        self.__dict__.update(state)
+        self.logger = logging.getLogger("agent.embedding_agent.clustering")
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def model_file(path: str, name: str) -> str:
+        safe_name = re.sub(r"[^A-Za-z0-9_.-]+", "_", name)
+        return os.path.join(path, f"{safe_name}.pkl")
+
+    def partial_fit(self, vectors: np.ndarray):
+        """Обучение на очередном чанке (первые чанки копятся до num_clusters векторов)"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            self._partial_fit(vectors)
+
+    def _partial_fit(self, vectors: np.ndarray):
+        if not self.fitted:
+            self._buffer.append(vectors)
+            self._buffered += len(vectors)
+            if self._buffered < self.num_clusters:
+                return
+            vectors = np.concatenate(self._buffer)
+            self._buffer, self._buffered = [], 0
+
+        self.model.partial_fit(vectors)
+        self.fitted = True
+        self.samples_seen += len(vectors)
+
+    def finish(self):
+        """Завершение прохода обучения"""
+        with self._lock:
+            if self._buffer:
+                remaining = np.concatenate(self._buffer)
+                self._buffer, self._buffered = [], 0
+                if not self.fitted:
+                    raise ValueError(
+                        f"Недостаточно векторов для {self.num_clusters} кластеров: {len(remaining)}"
+                    )
+                self.model.partial_fit(remaining)
+                self.samples_seen += len(remaining)
+
+    def _predict(self, vectors: np.ndarray) -> np.ndarray:
+        labels = self.model.predict(vectors)
+        self.cluster_sizes += np.bincount(labels, minlength=self.num_clusters)
+        return labels
+
+    def predict(self, vectors: np.ndarray) -> np.ndarray:
+        """Назначение кластеров без дообучения"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            return self._predict(vectors)
+
+    def assign_new(self, vectors: np.ndarray) -> np.ndarray:
+        """Назначение кластеров новым вставкам с дообучением модели"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            labels = self._predict(vectors)
+            self.model.partial_fit(vectors)
+            self.samples_seen += len(vectors)
+        return labels
+
+    def reset_sizes(self):
+        with self._lock:
+            self.cluster_sizes[:] = 0
+
+    def save(self):
+        """Атомарное сохранение модели"""
+        os.makedirs(self.path, exist_ok=True)
+        filename = self.model_file(self.path, self.name)
+        # Уникальный временный файл: модель с тем же именем может сохраняться и из обучения
+        fd, tmp_file = tempfile.mkstemp(dir=self.path, prefix=os.path.basename(filename), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f, self._lock:
+                pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, filename)
+        except BaseException:
+            try:
+                os.remove(tmp_file)
+            except FileNotFoundError:
+                pass
+            raise
+
+    @classmethod
+    def load(cls, path: str, name: str) -> Optional["StreamingClusterer"]:
+        """Загрузка сохраненной модели"""
+        filename = cls.model_file(path, name)
+        if not os.path.exists(filename):
+            return None
+        with open(filename, "rb") as f:
+            return pickle.load(f)
+
+    def get_info(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "name": self.name,
+                "num_clusters": self.num_clusters,
+                "samples_seen": self.samples_seen,
+                "cluster_sizes": self.cluster_sizes.tolist()
+            }
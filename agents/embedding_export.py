@@ -0,0 +1,134 @@
+"""
+Потоковый колоночный экспорт эмбеддингов
+
+Страницы хранилища (VectorStore.scan) пишутся сразу на диск, коллекция
+никогда не собирается целиком в объектах Python:
+- npy: vectors.npy (читается через np.load(..., mmap_mode="r")) + records.jsonl
+  с id, метаданными и документами в том же порядке строк
+- arrow: один Arrow IPC файл (id, embedding fixed_size_list<float32>, metadata JSON);
+  требует установленный pyarrow
+"""
+
+import asyncio
+import json
+import os
+import struct
+from typing import Any, AsyncIterator, Dict, Optional
+import numpy as np
+
+
+EXPORT_FORMATS = ("npy", "arrow")
+
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+# Заголовок с запасом под максимальную форму, чтобы переписать его на месте
+NPY_HEADER_SIZE = 128
+
+
+def _npy_header(rows: int, dimension: int) -> bytes:
+    """Заголовок .npy версии 1.0 фиксированного размера для float32 матрицы"""
+    header = repr({"descr": "<f4", "fortran_order": False, "shape": (rows, dimension)})
+    padding = NPY_HEADER_SIZE - len(NPY_MAGIC) - 2 - len(header) - 1
+    if padding < 0:
+        raise ValueError("Форма массива не помещается в заголовок .npy")
+    body = (header + " " * padding + "\n").encode("latin1")
+    return NPY_MAGIC + struct.pack("<H", len(body)) + body
+
+
+async def export_npy(pages: AsyncIterator[Dict[str, Any]], out_dir: str, dimension: int) -> Dict[str, Any]:
+    """Экспорт в vectors.npy + records.jsonl"""
+    os.makedirs(out_dir, exist_ok=True)
+    vectors_file = os.path.join(out_dir, "vectors.npy")
+    records_file = os.path.join(out_dir, "records.jsonl")
+
+    loop = asyncio.get_running_loop()
+    rows = 0
+    with open(vectors_file, "wb") as vectors, open(records_file, "w", encoding="utf-8") as records:
+        vectors.write(_npy_header(0, dimension))
+
+        def write_page(page: Dict[str, Any]):
+            embeddings = np.ascontiguousarray(page["embeddings"], dtype="<f4")
+            vectors.write(memoryview(embeddings).cast("B"))
+            documents = page.get("documents")
+            for i, doc_id in enumerate(page["ids"]):
+                record = {"id": doc_id, "metadata": page["metadatas"][i]}
+                if documents is not None:
+                    record["document"] = documents[i]
+                records.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+        async for page in pages:
+            # Запись на диск не блокирует цикл событий
+            await loop.run_in_executor(None, write_page, page)
+            rows += len(page["ids"])
+
+        # Итоговая форма известна только в конце - заголовок переписывается на месте
+        vectors.seek(0)
+        vectors.write(_npy_header(rows, dimension))
+
+    return {
+        "format": "npy",
+        "rows": rows,
+        "dimension": dimension,
+        "files": {"vectors": vectors_file, "records": records_file},
+        "bytes": os.path.getsize(vectors_file) + os.path.getsize(records_file)
+    }
+
+
+async def export_arrow(pages: AsyncIterator[Dict[str, Any]], out_dir: str, dimension: int) -> Dict[str, Any]:
+    """Экспорт в Arrow IPC файл по одному record batch на страницу"""
+    try:
+        import pyarrow as pa
+        import pyarrow.ipc
+    except ImportError:
+        raise ValueError("Для экспорта в Arrow требуется пакет pyarrow")
+
+    os.makedirs(out_dir, exist_ok=True)
+    arrow_file = os.path.join(out_dir, "embeddings.arrow")
+    schema = pa.schema([
+        ("id", pa.string()),
+        ("embedding", pa.list_(pa.float32(), dimension)),
+        ("metadata", pa.string()),
+        ("document", pa.string())
+    ])
+
+    loop = asyncio.get_running_loop()
+    rows = 0
+    with pa.OSFile(arrow_file, "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+
+        def write_page(page: Dict[str, Any]):
+            count = len(page["ids"])
+            # Плоский буфер float32 оборачивается без копирования
+            flat = pa.array(np.ascontiguousarray(page["embeddings"], dtype=np.float32).reshape(-1))
+            documents = page.get("documents")
+            writer.write_batch(pa.RecordBatch.from_arrays([
+                pa.array(page["ids"], type=pa.string()),
+                pa.FixedSizeListArray.from_arrays(flat, dimension),
+                pa.array([json.dumps(m, ensure_ascii=False) for m in page["metadatas"]], type=pa.string()),
+                pa.array(documents if documents is not None else [None] * count, type=pa.string())
+            ], schema=schema))
+
+        async for page in pages:
+            await loop.run_in_executor(None, write_page, page)
+            rows += len(page["ids"])
+
+    return {
+        "format": "arrow",
+        "rows": rows,
+        "dimension": dimension,
+        "files": {"arrow": arrow_file},
+        "bytes": os.path.getsize(arrow_file)
+    }
+
+
+async def iter_pages(store, where: Optional[Dict[str, Any]] = None, page_size: int = 4096,
+                     include_documents: bool = False) -> AsyncIterator[Dict[str, Any]]:
+    """Страницы AsyncVectorStore по курсору"""
+    cursor = None
+    while True:
+        page = await store.scan(
+            where=where, cursor=cursor, limit=page_size, include_documents=include_documents
+        )
+        if page["ids"]:
+            yield page
+        cursor = page["cursor"]
+        if cursor is None:
+            break
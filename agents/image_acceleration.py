@@ -0,0 +1,86 @@
+"""
+Ускорение UNet Stable Diffusion на CPU (опционально)
+
+- Token merging (ToMe, пакет tomesd): похожие токены латента объединяются
+  перед self-attention и MLP блоков трансформера, доля задается ratio
+- DeepCache (пакет DeepCache): высокоуровневые признаки UNet кэшируются
+  и переиспользуются на соседних шагах, полный проход - раз в interval шагов
+
+Оба режима меняют результат, поэтому quality_metrics сравнивает изображения
+с базовой генерацией при том же сиде.
+"""
+
+import contextlib
+from typing import Dict, Iterator
+import numpy as np
+from PIL import Image
+
+
+def tomesd_available() -> bool:
+    try:
+        import tomesd  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def deepcache_available() -> bool:
+    try:
+        import DeepCache  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+@contextlib.contextmanager
+def accelerated(pipeline, tome_ratio: float = 0.0, deepcache_interval: int = 0,
+                deepcache_branch_id: int = 0) -> Iterator[None]:
+    """Патчи UNet на время одного вызова пайплайна (UNet общий для всех пайплайнов агента)"""
+    undo = []
+    try:
+        if tome_ratio > 0:
+            import tomesd
+
+            tomesd.apply_patch(pipeline, ratio=tome_ratio)
+            undo.append(lambda: tomesd.remove_patch(pipeline))
+        if deepcache_interval > 1:
+            from DeepCache import DeepCacheSDHelper
+
+            helper = DeepCacheSDHelper(pipe=pipeline)
+            helper.set_params(cache_interval=deepcache_interval, cache_branch_id=deepcache_branch_id)
+            helper.enable()
+            undo.append(helper.disable)
+        yield
+    finally:
+        for restore in reversed(undo):
+            restore()
+
+
+def _luminance(image: Image.Image) -> np.ndarray:
+    return np.asarray(image.convert("L"), dtype=np.float64)
+
+
+def quality_metrics(reference: Image.Image, candidate: Image.Image, window: int = 8) -> Dict[str, float]:
+    """PSNR и SSIM (среднее по окнам window x window) относительно базового изображения"""
+    ref = _luminance(reference)
+    cand = _luminance(candidate.resize(reference.size) if candidate.size != reference.size else candidate)
+
+    mse = float(np.mean((ref - cand) ** 2))
+    # Для идентичных изображений PSNR бесконечен - ограничивается 100 дБ (JSON без inf)
+    psnr = 100.0 if mse == 0 else min(100.0, float(10 * np.log10(255.0 ** 2 / mse)))
+
+    h = ref.shape[0] // window * window
+    w = ref.shape[1] // window * window
+    # Окна без перекрытия: (строки окон, окна в строке, пиксели окна)
+    blocks_ref = ref[:h, :w].reshape(h // window, window, w // window, window).transpose(0, 2, 1, 3)
+    blocks_cand = cand[:h, :w].reshape(h // window, window, w // window, window).transpose(0, 2, 1, 3)
+    blocks_ref = blocks_ref.reshape(-1, window * window)
+    blocks_cand = blocks_cand.reshape(-1, window * window)
+
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    mu_r, mu_c = blocks_ref.mean(axis=1), blocks_cand.mean(axis=1)
+    var_r, var_c = blocks_ref.var(axis=1), blocks_cand.var(axis=1)
+    cov = ((blocks_ref - mu_r[:, None]) * (blocks_cand - mu_c[:, None])).mean(axis=1)
+    ssim = ((2 * mu_r * mu_c + c1) * (2 * cov + c2)) / ((mu_r ** 2 + mu_c ** 2 + c1) * (var_r + var_c + c2))
+
+    return {"psnr": psnr, "ssim": float(ssim.mean())}
@@ -3,26 +3,110 @@ ImageAgent - генерация изображений с помощью Stable
 """
 
 import asyncio
+import json
 import logging
 import os
-from typing import Dict, Any, Optional
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, List, Callable
 from datetime import datetime
 import torch
-from diffusers import StableDiffusionPipeline
+from diffusers import StableDiffusionImg2ImgPipeline, StableDiffusionPipeline
 from PIL import Image
 import aiofiles
 from .base_agent import BaseAgent, Task
+from .prompt_cache import PromptEmbeddingCache
+from .image_cache import ImageResultCache, content_key
+from .image_store import ImageOutputStore, store_key, variant_path
+from .image_acceleration import accelerated, deepcache_available, quality_metrics, tomesd_available
+from .latent_preview import latents_to_previews
+from .tiled_upscale import upscale_to_png, validate_upscale
+from .memory_planner import ExecutionPlan, MemoryPlanner, is_oom_error, peak_rss_mb
+from .image_profiles import (
+    DEFAULT_SCHEDULER, SCHEDULER_PROFILES, SCHEDULERS, create_scheduler, sql_profile_case
+)
 
 
 class ImageAgent(BaseAgent):
     """Агент для генерации изображений"""
     
+    # Конвейер: денойзинг следующей задачи идет параллельно с декодированием предыдущей
+    supports_concurrent_tasks = True
+    
     def __init__(self, config: Dict[str, Any]):
         super().__init__("image_agent", config)
         self.model_path = config.get('models_path', '/app/models')
         self.output_path = config.get('output_path', '/app/output/images')
         self.pipeline: Optional[StableDiffusionPipeline] = None
         self.device = "cpu"  # CPU-only
+        # Пакетная генерация: совместимые задачи выполняются одним вызовом пайплайна
+        self.max_batch_size = config.get('max_batch_size', 4)
+        # Оценка памяти на одно изображение 512x512 (масштабируется по площади)
+        self.batch_item_memory_mb = config.get('batch_item_memory_mb', 1200)
+        # Режим внимания, VAE и размер пакета выбираются по свободной памяти на каждый запрос
+        self.memory_planner = MemoryPlanner(
+            self.batch_item_memory_mb, self.max_batch_size, overlapped=self.max_concurrent_tasks > 1
+        )
+        self.attention_slicing = False
+        # Пайплайны с альтернативными планировщиками разделяют компоненты основного
+        self.scheduler_pipelines: Dict[str, StableDiffusionPipeline] = {}
+        # img2img пайплайны поверх тех же компонентов (по планировщику)
+        self.img2img_pipelines: Dict[str, StableDiffusionImg2ImgPipeline] = {}
+        self.default_profile = config.get('default_profile')
+        # Скользящее среднее секунд на изображение по профилям
+        self.profile_timings: Dict[str, Dict[str, float]] = {}
+        # Кэш эмбеддингов CLIP для промптов и негативных промптов
+        self.prompt_cache_config = config.get('prompt_cache', {})
+        self.prompt_cache: Optional[PromptEmbeddingCache] = None
+        # Шардированное хранилище: оригинал PNG, вариант доставки и миниатюра
+        output_store = config.get('output_store', {})
+        self.image_store = ImageOutputStore(
+            self.output_path,
+            delivery_format=output_store.get('delivery_format', 'jpeg'),
+            delivery_quality=output_store.get('delivery_quality', 85),
+            delivery_max_side=output_store.get('delivery_max_side', 1024),
+            thumbnail_size=output_store.get('thumbnail_size', 256)
+        )
+        # Кэш результатов для задач с заданным сидом (0 - без ограничения размера)
+        self.image_cache_max_bytes = config.get('cache_max_mb', 2048) * 1024 * 1024
+        self.image_cache: Optional[ImageResultCache] = None
+        # Сколько дней запись истории удерживает файл кэша от вытеснения (0 - бессрочно)
+        self.image_cache_reference_days = config.get('cache_reference_days', 7)
+        self.cache_maintenance_interval = config.get('cache_maintenance_interval', 3600)
+        self._cache_maintained_at = 0.0
+        self.model_id = "stable_diffusion_1_5"
+        # Прогресс по шагам и превью из латентов (раз в preview_interval шагов, 0 - без превью)
+        self.preview_interval = config.get('preview_interval', 5)
+        self.preview_size = config.get('preview_size', 256)
+        self.preview_path = os.path.join(self.output_path, "previews")
+        # Запланированные из потока денойзинга публикации прогресса по задачам:
+        # очистка по завершении задачи дожидается их, иначе они восстановили бы строку
+        self._progress_publishes: Dict[str, List[Any]] = {}
+        # Большая сторона вариации по умолчанию: SD 1.5 обучена на 512, а память
+        # внимания растет как квадрат площади
+        self.variation_max_side = config.get('variation_max_side', 768)
+        # Опциональное ускорение UNet: ToMe (доля объединяемых токенов) и DeepCache
+        # (полный проход UNet раз в interval шагов); 0 - выключено
+        acceleration = config.get('acceleration', {})
+        self.tome_ratio = float(acceleration.get('tome_ratio', 0.0))
+        self.deepcache_interval = int(acceleration.get('deepcache_interval', 0))
+        self.deepcache_branch_id = int(acceleration.get('deepcache_branch_id', 0))
+        # Конвейер стадий: UNet и VAE декодирование в отдельных потоках, запись PNG
+        # и вставка в БД асинхронно; при max_concurrent_tasks > 1 денойзинг
+        # следующей задачи идет, пока предыдущая декодируется и пишется
+        self.denoise_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="image_denoise")
+        self.decode_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="image_decode")
+        # VAE общий для всех пайплайнов: смена его режима и декодирование идут под одной блокировкой
+        self._vae_lock = threading.Lock()
+        # Тайловое увеличение: ресемплинг тайлов в пуле, память ограничена полосой тайлов
+        upscale = config.get('upscale', {})
+        self.upscale_tile_size = upscale.get('tile_size', 512)
+        self.upscale_max_pixels = upscale.get('max_output_pixels', 64_000_000)
+        self.upscale_executor = ThreadPoolExecutor(
+            max_workers=upscale.get('workers') or os.cpu_count() or 1, thread_name_prefix="image_upscale"
+        )
         
     async def _initialize_agent(self):
         """Инициализация ImageAgent"""
@@ -30,10 +114,30 @@ class ImageAgent(BaseAgent):
         
         # Создание директории для выходных изображений
         os.makedirs(self.output_path, exist_ok=True)
+        os.makedirs(self.preview_path, exist_ok=True)
+        
+        if self.db_pool and self.config.get('cache_enabled', True):
+            self.image_cache = ImageResultCache(self.db_pool, self.image_cache_max_bytes)
         
         # Загрузка модели Stable Diffusion
         await self._load_model()
         
+        if self.tome_ratio > 0 and not tomesd_available():
+            self.logger.warning("Пакет tomesd не установлен, token merging отключен")
+            self.tome_ratio = 0.0
+        if self.deepcache_interval > 1 and not deepcache_available():
+            self.logger.warning("Пакет DeepCache не установлен, переиспользование признаков отключено")
+            self.deepcache_interval = 0
+        
+        # Безусловный эмбеддинг и частые негативные промпты считаются заранее
+        if self.prompt_cache_config.get('enabled', True):
+            self.prompt_cache = PromptEmbeddingCache(
+                self.pipeline, max_items=self.prompt_cache_config.get('max_items', 256)
+            )
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.prompt_cache.warmup, self.prompt_cache_config.get('warmup_prompts', [])
+            )
+        
         self.logger.info("ImageAgent успешно инициализирован")
     
     async def _load_model(self):
@@ -53,8 +157,8 @@ class ImageAgent(BaseAgent):
             # Настройка для CPU
             self.pipeline = self.pipeline.to(self.device)
             
-            # Оптимизация для CPU
-            self.pipeline.enable_attention_slicing()
+            self.scheduler_pipelines = {DEFAULT_SCHEDULER: self.pipeline}
+            self.model_id = model_file
             
             self.logger.info("Stable Diffusion 1.5 загружен успешно")
             
@@ -70,7 +174,8 @@ class ImageAgent(BaseAgent):
                     use_safetensors=True
                 )
                 self.pipeline = self.pipeline.to(self.device)
-                self.pipeline.enable_attention_slicing()
+                self.scheduler_pipelines = {DEFAULT_SCHEDULER: self.pipeline}
+                self.model_id = "runwayml/stable-diffusion-v1-5"
                 
                 self.logger.info("Модель загружена из HuggingFace")
                 
@@ -78,6 +183,159 @@ class ImageAgent(BaseAgent):
                 self.logger.error(f"Критическая ошибка загрузки модели: {e2}")
                 raise
     
+    def _pipeline_for(self, scheduler: str) -> StableDiffusionPipeline:
+        """Пайплайн с нужным планировщиком без перезагрузки UNet (компоненты общие)"""
+        pipeline = self.scheduler_pipelines.get(scheduler)
+        if pipeline is None:
+            components = dict(self.pipeline.components)
+            components["scheduler"] = create_scheduler(scheduler, self.pipeline.scheduler.config)
+            pipeline = StableDiffusionPipeline(**components)
+            self.scheduler_pipelines[scheduler] = pipeline
+            self.logger.info(f"Подготовлен планировщик {scheduler}")
+        return pipeline
+    
+    def _img2img_pipeline_for(self, scheduler: str) -> StableDiffusionImg2ImgPipeline:
+        """img2img пайплайн из компонентов загруженной модели (без второй копии весов)"""
+        pipeline = self.img2img_pipelines.get(scheduler)
+        if pipeline is None:
+            pipeline = StableDiffusionImg2ImgPipeline(**self._pipeline_for(scheduler).components)
+            self.img2img_pipelines[scheduler] = pipeline
+        return pipeline
+    
+    def _text_inputs(self, prompts: List[str], negative_prompts: List[str]) -> Dict[str, Any]:
+        """Аргументы текста для пайплайна: готовые эмбеддинги из кэша или сами промпты"""
+        if self.prompt_cache:
+            # Готовые эмбеддинги из кэша - текстовый энкодер не вызывается
+            return {
+                "prompt_embeds": self.prompt_cache.get_batch(prompts),
+                "negative_prompt_embeds": self.prompt_cache.get_batch(negative_prompts)
+            }
+        return {"prompt": prompts, "negative_prompt": negative_prompts}
+    
+    def _acceleration(self) -> Dict[str, Any]:
+        """Активные режимы ускорения (влияют на результат генерации)"""
+        return {
+            "tome_ratio": self.tome_ratio,
+            "deepcache_interval": self.deepcache_interval if self.deepcache_interval > 1 else 0,
+            "deepcache_branch_id": self.deepcache_branch_id
+        }
+    
+    def _model_variant(self) -> str:
+        """Модель вместе с режимами ускорения - часть ключа кэша результатов"""
+        variant = self.model_id
+        if self.tome_ratio > 0:
+            variant += f"+tome{self.tome_ratio}"
+        if self.deepcache_interval > 1:
+            variant += f"+deepcache{self.deepcache_interval}b{self.deepcache_branch_id}"
+        return variant
+    
+    def _accelerated(self, pipeline, tome_ratio: Optional[float] = None, deepcache_interval: Optional[int] = None):
+        return accelerated(
+            pipeline,
+            self.tome_ratio if tome_ratio is None else tome_ratio,
+            self.deepcache_interval if deepcache_interval is None else deepcache_interval,
+            self.deepcache_branch_id
+        )
+    
+    def _progress_callback(self, tasks: List[Task], total_steps: int) -> Callable:
+        """callback_on_step_end: прогресс не чаще раза в секунду, превью раз в preview_interval шагов"""
+        loop = asyncio.get_running_loop()
+        state = {"published_at": 0.0}
+        # Списки создаются в цикле событий; поток денойзинга только дописывает в них
+        for item_task in tasks:
+            self._progress_publishes.setdefault(item_task.id, [])
+        
+        def callback(pipeline, step: int, timestep, callback_kwargs: Dict[str, Any]) -> Dict[str, Any]:
+            done = step + 1
+            with_preview = (
+                self.preview_interval > 0 and done % self.preview_interval == 0 and done < total_steps
+            )
+            now = time.monotonic()
+            if with_preview or now - state["published_at"] >= 1.0:
+                state["published_at"] = now
+                previews = (
+                    latents_to_previews(callback_kwargs["latents"], self.preview_size)
+                    if with_preview else [None] * len(tasks)
+                )
+                # Публикация в цикле событий - поток денойзинга не ждет БД
+                for item_task, preview in zip(tasks, previews):
+                    publishes = self._progress_publishes.get(item_task.id)
+                    if publishes is None:
+                        continue
+                    publishes.append(asyncio.run_coroutine_threadsafe(
+                        self._publish_progress(item_task.id, done, total_steps, preview), loop
+                    ))
+            return callback_kwargs
+        
+        return callback
+    
+    async def _publish_progress(self, task_id: str, step: int, total_steps: int,
+                                preview: Optional[Image.Image] = None):
+        """Сохранение прогресса задачи и превью (читается TelegramAgent и веб-интерфейсом)"""
+        try:
+            preview_file = None
+            if preview is not None:
+                preview_file = os.path.join(self.preview_path, f"{task_id}.jpg")
+                
+                def write():
+                    tmp_file = preview_file + ".tmp"
+                    preview.save(tmp_file, format="JPEG", quality=80)
+                    os.replace(tmp_file, preview_file)
+                
+                await asyncio.get_running_loop().run_in_executor(None, write)
+            
+            async with self.db_pool.acquire() as conn:
+                await conn.execute(
+                    """
+                    INSERT INTO task_progress (task_id, step, total_steps, preview_path)
+                    VALUES ($1, $2, $3, $4)
+                    ON CONFLICT (task_id) DO UPDATE
+                    SET step = EXCLUDED.step,
+                        total_steps = EXCLUDED.total_steps,
+                        preview_path = COALESCE(EXCLUDED.preview_path, task_progress.preview_path),
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE task_progress.step <= EXCLUDED.step
+                    """,
+                    task_id,
+                    step,
+                    total_steps,
+                    preview_file
+                )
+        except Exception as e:
+            self.logger.error(f"Ошибка публикации прогресса задачи {task_id}: {e}")
+    
+    async def _clear_progress(self, task_id: str):
+        """Удаление превью и строки прогресса завершенной задачи"""
+        publishes = self._progress_publishes.pop(task_id, [])
+        if publishes:
+            await asyncio.gather(*(asyncio.wrap_future(f) for f in publishes), return_exceptions=True)
+        try:
+            preview_file = os.path.join(self.preview_path, f"{task_id}.jpg")
+            for filename in (preview_file, preview_file + ".tmp"):
+                if os.path.exists(filename):
+                    os.remove(filename)
+            if self.db_pool:
+                async with self.db_pool.acquire() as conn:
+                    await conn.execute("DELETE FROM task_progress WHERE task_id = $1", task_id)
+        except Exception as e:
+            self.logger.error(f"Ошибка очистки прогресса задачи {task_id}: {e}")
+    
+    async def _process_task(self, task: Task):
+        """Обработка задачи; прогресс удаляется после записи итогового статуса"""
+        try:
+            await super()._process_task(task)
+        finally:
+            await self._clear_progress(task.id)
+    
+    def _record_profile_timing(self, profile: str, seconds_per_image: float) -> float:
+        """Обновление скользящего среднего времени генерации профиля"""
+        timing = self.profile_timings.setdefault(profile, {"images": 0, "avg_seconds_per_image": 0.0})
+        timing["images"] += 1
+        timing["avg_seconds_per_image"] += (
+            (seconds_per_image - timing["avg_seconds_per_image"]) / timing["images"]
+        )
+        return timing["avg_seconds_per_image"]
+    
     async def process_task(self, task: Task) -> Dict[str, Any]:
         """Обработка задач генерации изображений"""
         if task.task_type == "image_generation":
@@ -86,155 +344,729 @@ class ImageAgent(BaseAgent):
             return await self._create_image_variation(task)
         elif task.task_type == "image_upscale":
             return await self._upscale_image(task)
+        elif task.task_type == "acceleration_benchmark":
+            return await self._acceleration_benchmark(task)
         
         return {"status": "unknown_task_type"}
     
+    def _generation_params(self, task: Task) -> Dict[str, Any]:
+        """Параметры генерации задачи со значениями по умолчанию"""
+        seed = task.data.get("seed", None)
+        profile_name = task.data.get("profile", self.default_profile)
+        if profile_name is not None and profile_name not in SCHEDULER_PROFILES:
+            raise ValueError(f"Неизвестный профиль генерации: {profile_name}")
+        profile = SCHEDULER_PROFILES.get(profile_name, {})
+        scheduler = task.data.get("scheduler", profile.get("scheduler", DEFAULT_SCHEDULER))
+        if scheduler not in SCHEDULERS:
+            raise ValueError(f"Неизвестный планировщик: {scheduler}")
+        return {
+            "prompt": task.data.get("prompt", "beautiful landscape"),
+            "negative_prompt": task.data.get("negative_prompt", ""),
+            "width": task.data.get("width", 512),
+            "height": task.data.get("height", 512),
+            "num_inference_steps": task.data.get(
+                "num_inference_steps", profile.get("num_inference_steps", 20)
+            ),
+            "guidance_scale": task.data.get("guidance_scale", 7.5),
+            "profile": profile_name or "custom",
+            "scheduler": scheduler,
+            # Сид фиксируется всегда, чтобы результат можно было воспроизвести
+            "seed": seed if seed is not None else random.randint(0, 2 ** 31 - 1),
+            # Только явно заданный сид делает запрос повторяемым - такие ищутся в кэше
+            "cacheable": seed is not None
+        }
+    
+    def _apply_attention_plan(self, pipeline: StableDiffusionPipeline, attention_slicing: bool):
+        """Переключение attention slicing (процессоры внимания общего UNet)"""
+        if attention_slicing != self.attention_slicing:
+            if attention_slicing:
+                pipeline.enable_attention_slicing()
+            else:
+                pipeline.disable_attention_slicing()
+            self.attention_slicing = attention_slicing
+    
+    @staticmethod
+    def _apply_vae_plan(pipeline: StableDiffusionPipeline, vae_slicing: bool, vae_tiling: bool):
+        """Режим VAE: целиком, по одному изображению или тайлами"""
+        if vae_slicing:
+            pipeline.vae.enable_slicing()
+        else:
+            pipeline.vae.disable_slicing()
+        if vae_tiling:
+            pipeline.vae.enable_tiling()
+        else:
+            pipeline.vae.disable_tiling()
+    
+    def _plan_memory(self, width: int, height: int, batch_size: int) -> ExecutionPlan:
+        plan = self.memory_planner.plan(width, height, batch_size)
+        if plan.fits:
+            self.logger.info(f"План памяти {width}x{height}: {plan.describe()}")
+        else:
+            self.logger.warning(f"План памяти {width}x{height} без запаса: {plan.describe()}")
+        return plan
+    
+    async def _claim_compatible_tasks(self, params: Dict[str, Any], limit: int) -> List[Task]:
+        """Захват ожидающих задач с теми же размером, шагами, guidance и планировщиком"""
+        if limit <= 0 or not self.db_pool:
+            return []
+        
+        try:
+            async with self.db_pool.acquire() as conn:
+                async with conn.transaction():
+                    rows = await conn.fetch(
+                        """
+                        UPDATE tasks SET status = 'processing'
+                        WHERE id IN (
+                            SELECT id FROM tasks
+                            WHERE agent_name = $1 AND status = 'pending'
+                              AND task_type = 'image_generation'
+                              AND COALESCE((data->>'width')::int, 512) = $2
+                              AND COALESCE((data->>'height')::int, 512) = $3
+                              AND COALESCE((data->>'num_inference_steps')::int, {steps}::int, 20) = $4
+                              AND COALESCE((data->>'guidance_scale')::float, 7.5) = $5
+                              AND COALESCE(data->>'scheduler', {scheduler}, 'default') = $6
+                            ORDER BY priority DESC, created_at ASC
+                            LIMIT $7
+                            FOR UPDATE SKIP LOCKED
+                        )
+                        RETURNING *
+                        """.format(
+                            # Профиль задачи (или профиль по умолчанию) раскрывается
+                            # в планировщик и шаги прямо в SQL
+                            steps=sql_profile_case("num_inference_steps", "COALESCE(data->>'profile', $8)"),
+                            scheduler=sql_profile_case("scheduler", "COALESCE(data->>'profile', $8)")
+                        ),
+                        self.name,
+                        params["width"],
+                        params["height"],
+                        params["num_inference_steps"],
+                        float(params["guidance_scale"]),
+                        params["scheduler"],
+                        limit,
+                        self.default_profile
+                    )
+                    return await self._tasks_from_claimed_rows(conn, rows)
+        except Exception as e:
+            self.logger.error(f"Ошибка захвата задач для пакета: {e}")
+            return []
+    
     async def _generate_image(self, task: Task) -> Dict[str, Any]:
-        """Генерация изображения по промпту"""
+        """Генерация изображения по промпту (вместе с совместимыми ожидающими задачами)"""
+        # Захваченные задачи без итогового статуса; при сбое возвращаются в очередь
+        unfinished: List[Task] = []
         try:
-            prompt = task.data.get("prompt", "beautiful landscape")
-            negative_prompt = task.data.get("negative_prompt", "")
-            width = task.data.get("width", 512)
-            height = task.data.get("height", 512)
-            num_inference_steps = task.data.get("num_inference_steps", 20)
-            guidance_scale = task.data.get("guidance_scale", 7.5)
-            seed = task.data.get("seed", None)
-            
-            self.logger.info(f"Генерация изображения: {prompt}")
-            
-            # Генератор для воспроизводимости
-            generator = torch.Generator(device=self.device)
-            if seed is not None:
-                generator.manual_seed(seed)
-            
-            # Генерация изображения
-            with torch.no_grad():
-                result = self.pipeline(
-                    prompt=prompt,
-                    negative_prompt=negative_prompt,
-                    width=width,
-                    height=height,
-                    num_inference_steps=num_inference_steps,
-                    guidance_scale=guidance_scale,
-                    generator=generator
+            params = self._generation_params(task)
+            tasks, params_list = [task], [params]
+            if task.task_type == "image_generation":
+                limit = self.memory_planner.max_batch(params["width"], params["height"]) - 1
+                unfinished = await self._claim_compatible_tasks(params, limit)
+                for extra in list(unfinished):
+                    try:
+                        params_list.append(self._generation_params(extra))
+                        tasks.append(extra)
+                    except ValueError as e:
+                        await self._finish_extra_task(extra, {"status": "error", "error": str(e)})
+                        unfinished.remove(extra)
+            
+            # Задачи с найденным в кэше результатом не попадают в пакет
+            results: List[Optional[Dict[str, Any]]] = [
+                await self._cached_result(item_task, params) for item_task, params in zip(tasks, params_list)
+            ]
+            missing = [i for i, result in enumerate(results) if result is None]
+            if missing:
+                generated = await self._generate_batch(
+                    [tasks[i] for i in missing], [params_list[i] for i in missing]
                 )
+                for i, result in zip(missing, generated):
+                    results[i] = result
+            
+            # Результаты присоединенных задач сохраняются здесь, основной - в BaseAgent
+            for extra, result in zip(tasks[1:], results[1:]):
+                await self._finish_extra_task(extra, result)
+                unfinished.remove(extra)
+            
+            return results[0]
+            
+        except Exception as e:
+            self.logger.error(f"Ошибка генерации изображения: {e}")
+            return {
+                "status": "error",
+                "error": str(e)
+            }
+        finally:
+            for extra in unfinished:
+                await self._update_task_status(extra.id, "pending")
+                await self._clear_progress(extra.id)
+            if unfinished:
+                self.logger.warning(f"Задачи пакета возвращены в очередь: {[extra.id for extra in unfinished]}")
+    
+    async def _finish_extra_task(self, extra: Task, result: Dict[str, Any]):
+        """Итоговый статус задачи, присоединенной к пакету"""
+        success = result["status"] == "success"
+        await self._save_task_result(extra.id, result)
+        await self._update_task_status(extra.id, "completed" if success else "failed")
+        await self._clear_progress(extra.id)
+        if success:
+            self.status.tasks_completed += 1
+        else:
+            self.status.errors_count += 1
+    
+    async def _cached_result(self, task: Task, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Готовый результат для повторного детерминированного запроса"""
+        if not self.image_cache or not params["cacheable"]:
+            return None
+        
+        try:
+            key = content_key(params, self._model_variant())
+            cached = await self.image_cache.lookup(key)
+        except Exception as e:
+            self.logger.error(f"Ошибка чтения кэша изображений: {e}")
+            return None
+        if cached is None:
+            return None
+        
+        metadata = cached["metadata"]
+        metadata = dict(json.loads(metadata) if isinstance(metadata, str) else metadata or {})
+        metadata.update({
+            "cache_hit": True,
+            "filename": os.path.basename(cached["image_path"]),
+            "filepath": cached["image_path"]
+        })
+        # Ссылка берется вместе с записью истории; запись могли вытеснить после lookup
+        if not await self._save_image_metadata(task.id, metadata):
+            return None
+        
+        self.logger.info(f"Изображение взято из кэша: {cached['image_path']}")
+        
+        return {
+            "status": "success",
+            "image_path": cached["image_path"],
+            "delivery_path": variant_path(metadata, "delivery"),
+            "thumbnail_path": variant_path(metadata, "thumbnail"),
+            "filename": metadata["filename"],
+            "metadata": metadata
+        }
+    
+    async def _generate_batch(self, tasks: List[Task], params_list: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Один вызов пайплайна для пакета задач с индивидуальными промптами и сидами"""
+        shared = params_list[0]
+        
+        self.logger.info(
+            f"Генерация пакета из {len(tasks)} изображений: {[p['prompt'] for p in params_list]}"
+        )
+        
+        try:
+            # Отдельный генератор на каждое изображение - сид каждой задачи воспроизводим
+            generators = [
+                torch.Generator(device=self.device).manual_seed(p["seed"]) for p in params_list
+            ]
+            
+            pipeline = self._pipeline_for(shared["scheduler"])
+            
+            progress = self._progress_callback(tasks, shared["num_inference_steps"])
+            planned: Dict[str, ExecutionPlan] = {}
+            
+            def denoise(force_slicing: bool):
+                # План строится в потоке денойзинга: после ожидания в очереди
+                # память и резерв незавершенных декодирований актуальны
+                plan = self._plan_memory(shared["width"], shared["height"], len(tasks))
+                if force_slicing:
+                    plan.attention_slicing = True
+                planned["plan"] = plan
+                started = time.perf_counter()
+                self._apply_attention_plan(pipeline, plan.attention_slicing)
+                text_inputs = self._text_inputs(
+                    [p["prompt"] for p in params_list], [p["negative_prompt"] for p in params_list]
+                )
+                with torch.no_grad(), self._accelerated(pipeline):
+                    latents = pipeline(
+                        **text_inputs,
+                        width=shared["width"],
+                        height=shared["height"],
+                        num_inference_steps=shared["num_inference_steps"],
+                        guidance_scale=shared["guidance_scale"],
+                        generator=generators,
+                        output_type="latent",
+                        callback_on_step_end=progress
+                    ).images
+                # Резерв до выхода из потока: следующий пакет может начать планирование сразу
+                self.memory_planner.reserve_decode(plan.vae_mb)
+                return latents, plan, time.perf_counter() - started
+            
+            def decode(latents, vae_slicing: bool, vae_tiling: bool):
+                started = time.perf_counter()
+                images = self._decode_latents(pipeline, latents, vae_slicing, vae_tiling)
+                return images, time.perf_counter() - started
+            
+            # Время стадий без ожидания в очереди исполнителя
+            loop = asyncio.get_running_loop()
+            try:
+                latents, plan, denoise_seconds = await loop.run_in_executor(
+                    self.denoise_executor, denoise, False
+                )
+            except Exception as e:
+                failed_plan = planned.get("plan")
+                if not is_oom_error(e) or (len(tasks) == 1 and failed_plan and failed_plan.attention_slicing):
+                    raise
+                if len(tasks) > 1:
+                    # Нехватка памяти на пакет - половины выполняются отдельно
+                    half = len(tasks) // 2
+                    self.logger.warning(f"Нехватка памяти на пакет из {len(tasks)}, разбиение: {e}")
+                    return (
+                        await self._generate_batch(tasks[:half], params_list[:half])
+                        + await self._generate_batch(tasks[half:], params_list[half:])
+                    )
+                self.logger.warning(f"Нехватка памяти без attention slicing, повтор со slicing: {e}")
+                latents, plan, denoise_seconds = await loop.run_in_executor(self.denoise_executor, denoise, True)
+            
+            # Поток денойзинга свободен - следующая задача уже может занять UNet
+            try:
+                try:
+                    images, decode_seconds = await loop.run_in_executor(
+                        self.decode_executor, decode, latents, plan.vae_slicing, plan.vae_tiling
+                    )
+                except Exception as e:
+                    if not is_oom_error(e) or plan.vae_tiling:
+                        raise
+                    self.logger.warning(f"Нехватка памяти при декодировании VAE, повтор тайлами: {e}")
+                    plan.vae_slicing, plan.vae_tiling = True, True
+                    images, decode_seconds = await loop.run_in_executor(
+                        self.decode_executor, decode, latents, True, True
+                    )
+            finally:
+                self.memory_planner.release_decode(plan.vae_mb)
             
-            # Сохранение изображения
-            image = result.images[0]
-            filename = f"image_{task.id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png"
-            filepath = os.path.join(self.output_path, filename)
+            self.logger.info(f"Пакет из {len(tasks)} готов, пиковый RSS {peak_rss_mb():.0f} МБ")
             
-            image.save(filepath)
+            seconds_per_image = (denoise_seconds + decode_seconds) / len(tasks)
+            profile_average = self._record_profile_timing(shared["profile"], seconds_per_image)
+            stage_seconds = {"denoise": denoise_seconds, "decode": decode_seconds}
+        except Exception as e:
+            self.logger.error(f"Ошибка генерации пакета изображений: {e}")
+            return [{"status": "error", "error": str(e)} for _ in tasks]
+        
+        # Кодирование, запись и вставка метаданных всех изображений пакета параллельно
+        return list(await asyncio.gather(*[
+            self._save_generated(item_task, params, image, len(tasks), seconds_per_image,
+                                 profile_average, stage_seconds, plan.to_dict())
+            for item_task, params, image in zip(tasks, params_list, images)
+        ]))
+    
+    def _decode_latents(
+        self,
+        pipeline: StableDiffusionPipeline,
+        latents: torch.Tensor,
+        vae_slicing: bool,
+        vae_tiling: bool
+    ) -> List[Image.Image]:
+        """VAE декодирование и проверка безопасности (то же, что делает пайплайн после денойзинга)
+
+        Пайплайны вызываются с output_type="latent" и декодируют только здесь:
+        режим VAE (slicing/tiling) не может смениться посреди чужого декодирования.
+        """
+        with self._vae_lock, torch.no_grad():
+            self._apply_vae_plan(pipeline, vae_slicing, vae_tiling)
+            decoded = pipeline.vae.decode(latents / pipeline.vae.config.scaling_factor, return_dict=False)[0]
+            decoded, has_nsfw_concept = pipeline.run_safety_checker(decoded, self.device, latents.dtype)
+        do_denormalize = [True] * decoded.shape[0] if has_nsfw_concept is None else [not nsfw for nsfw in has_nsfw_concept]
+        return pipeline.image_processor.postprocess(decoded, output_type="pil", do_denormalize=do_denormalize)
+    
+    async def _save_generated(
+        self,
+        item_task: Task,
+        params: Dict[str, Any],
+        image: Image.Image,
+        batch_size: int,
+        seconds_per_image: float,
+        profile_average: float,
+        stage_seconds: Dict[str, float],
+        memory_plan: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """Стадия записи: кодирование вариантов в пуле потоков, запись и сохранение метаданных"""
+        try:
+            # Сохранение изображения (с заданным сидом - под хэшем параметров генерации)
+            cached = bool(self.image_cache and params["cacheable"])
+            key = content_key(params, self._model_variant()) if cached else store_key(item_task.id)
+            variants = await self.image_store.save(image, key)
+            filepath = variants["original"]["path"]
+            filename = os.path.basename(filepath)
             
             # Сохранение метаданных
             metadata = {
-                "prompt": prompt,
-                "negative_prompt": negative_prompt,
-                "width": width,
-                "height": height,
-                "num_inference_steps": num_inference_steps,
-                "guidance_scale": guidance_scale,
-                "seed": seed,
+                "prompt": params["prompt"],
+                "negative_prompt": params["negative_prompt"],
+                "width": params["width"],
+                "height": params["height"],
+                "num_inference_steps": params["num_inference_steps"],
+                "guidance_scale": params["guidance_scale"],
+                "seed": params["seed"],
+                "profile": params["profile"],
+                "scheduler": params["scheduler"],
+                "batch_size": batch_size,
+                "seconds_per_image": seconds_per_image,
+                "profile_avg_seconds_per_image": profile_average,
+                "stage_seconds": stage_seconds,
+                "memory_plan": memory_plan,
+                "acceleration": self._acceleration(),
                 "filename": filename,
                 "filepath": filepath,
+                "variants": variants,
+                "content_hash": key if cached else None,
                 "generated_at": datetime.now().isoformat()
             }
             
-            # Сохранение в базу данных
-            await self._save_image_metadata(task.id, metadata)
+            # Сохранение в базу данных (своя строка на каждую задачу) вместе
+            # с регистрацией в кэше и ссылкой на файл
+            await self._save_image_metadata(item_task.id, metadata, variants if cached else None)
+            
+            if cached:
+                await self.image_cache.evict()
             
             self.logger.info(f"Изображение сохранено: {filepath}")
             
             return {
                 "status": "success",
                 "image_path": filepath,
+                "delivery_path": variants["delivery"]["path"],
+                "thumbnail_path": variants["thumbnail"]["path"],
                 "filename": filename,
                 "metadata": metadata
             }
-            
         except Exception as e:
-            self.logger.error(f"Ошибка генерации изображения: {e}")
-            return {
-                "status": "error",
-                "error": str(e)
-            }
+            self.logger.error(f"Ошибка сохранения изображения задачи {item_task.id}: {e}")
+            return {"status": "error", "error": str(e)}
+    
+    @staticmethod
+    def _load_rgb(image_path: str) -> Image.Image:
+        with Image.open(image_path) as image:
+            return image.convert("RGB")
     
     async def _create_image_variation(self, task: Task) -> Dict[str, Any]:
-        """Создание вариации изображения"""
+        """Вариация изображения через img2img: выполняется только strength * steps шагов"""
         try:
             image_path = task.data.get("image_path")
             if not image_path or not os.path.exists(image_path):
                 return {"status": "error", "error": "Изображение не найдено"}
             
-            # Загрузка исходного изображения
-            original_image = Image.open(image_path)
+            strength = float(task.data.get("strength", 0.8))
+            if not 0.0 < strength <= 1.0:
+                return {"status": "error", "error": "strength должен быть в диапазоне (0, 1]"}
             
-            # Создание вариации (упрощенная реализация)
-            prompt = task.data.get("prompt", "variation of the image")
-            strength = task.data.get("strength", 0.8)
+            # Загрузка исходного изображения (декодирование вне event loop)
+            loop = asyncio.get_running_loop()
+            original_image = await loop.run_in_executor(None, self._load_rgb, image_path)
             
-            # Здесь можно использовать img2img пайплайн
-            # Для простоты используем обычную генерацию с похожим промптом
-            return await self._generate_image(task)
+            # Размер по умолчанию - пропорции исходного с большей стороной не более
+            # variation_max_side, кратный 8 (требование VAE)
+            scale = min(1.0, self.variation_max_side / max(original_image.size))
+            params = self._generation_params(task.copy(update={"data": {
+                "prompt": "variation of the image",
+                "width": round(original_image.width * scale),
+                "height": round(original_image.height * scale),
+                **task.data
+            }}))
+            width = max(8, params["width"] // 8 * 8)
+            height = max(8, params["height"] // 8 * 8)
+            if original_image.size != (width, height):
+                original_image = await loop.run_in_executor(
+                    None, original_image.resize, (width, height), Image.Resampling.LANCZOS
+                )
+            
+            pipeline = self._img2img_pipeline_for(params["scheduler"])
+            generator = torch.Generator(device=self.device).manual_seed(params["seed"])
+            denoising_steps = min(int(params["num_inference_steps"] * strength), params["num_inference_steps"])
+            progress = self._progress_callback([task], denoising_steps)
+            
+            def run_pipeline():
+                # План в потоке денойзинга - с учетом декодирований, идущих параллельно
+                plan = self._plan_memory(width, height, 1)
+                self._apply_attention_plan(pipeline, plan.attention_slicing)
+                with torch.no_grad(), self._accelerated(pipeline):
+                    latents = pipeline(
+                        **self._text_inputs([params["prompt"]], [params["negative_prompt"]]),
+                        image=original_image,
+                        strength=strength,
+                        num_inference_steps=params["num_inference_steps"],
+                        guidance_scale=params["guidance_scale"],
+                        generator=generator,
+                        output_type="latent",
+                        callback_on_step_end=progress
+                    ).images
+                return self._decode_latents(pipeline, latents, plan.vae_slicing, plan.vae_tiling)[0]
+            
+            started = datetime.now()
+            image = await loop.run_in_executor(self.denoise_executor, run_pipeline)
+            seconds = (datetime.now() - started).total_seconds()
+            
+            # Сохранение
+            variants = await self.image_store.save(image, store_key(task.id), prefix="variation")
+            filepath = variants["original"]["path"]
+            filename = os.path.basename(filepath)
+            
+            metadata = {
+                "prompt": params["prompt"],
+                "negative_prompt": params["negative_prompt"],
+                "source_image": image_path,
+                "width": width,
+                "height": height,
+                "strength": strength,
+                "num_inference_steps": params["num_inference_steps"],
+                # Шаги, которые реально выполнил img2img
+                "denoising_steps": denoising_steps,
+                "guidance_scale": params["guidance_scale"],
+                "seed": params["seed"],
+                "scheduler": params["scheduler"],
+                "acceleration": self._acceleration(),
+                "seconds": seconds,
+                "filename": filename,
+                "filepath": filepath,
+                "variants": variants,
+                "generated_at": datetime.now().isoformat()
+            }
+            await self._save_image_metadata(task.id, metadata)
+            
+            self.logger.info(f"Вариация сохранена: {filepath}")
+            
+            return {
+                "status": "success",
+                "image_path": filepath,
+                "delivery_path": variants["delivery"]["path"],
+                "thumbnail_path": variants["thumbnail"]["path"],
+                "filename": filename,
+                "metadata": metadata
+            }
             
         except Exception as e:
             self.logger.error(f"Ошибка создания вариации: {e}")
             return {"status": "error", "error": str(e)}
     
-    async def _upscale_image(self, task: Task) -> Dict[str, Any]:
-        """Увеличение разрешения изображения"""
+    async def _acceleration_benchmark(self, task: Task) -> Dict[str, Any]:
+        """Секунды на изображение и качество (PSNR/SSIM к базовой генерации) для ToMe и DeepCache"""
         try:
-            image_path = task.data.get("image_path")
-            scale_factor = task.data.get("scale_factor", 2)
+            prompts = task.data.get("prompts", [
+                "a photo of a mountain lake at sunrise",
+                "portrait of an old fisherman, detailed"
+            ])
+            width = task.data.get("width", 512)
+            height = task.data.get("height", 512)
+            steps = task.data.get("num_inference_steps", 20)
+            guidance_scale = task.data.get("guidance_scale", 7.5)
+            seed = task.data.get("seed", 0)
+            tome_ratio = float(task.data.get("tome_ratio", self.tome_ratio or 0.5))
+            deepcache_interval = int(task.data.get("deepcache_interval", self.deepcache_interval or 3))
             
-            if not image_path or not os.path.exists(image_path):
-                return {"status": "error", "error": "Изображение не найдено"}
+            variants = {"baseline": (0.0, 0)}
+            unavailable = []
+            if tomesd_available():
+                variants["tome"] = (tome_ratio, 0)
+            else:
+                unavailable.append("tome")
+            if deepcache_available():
+                variants["deepcache"] = (0.0, deepcache_interval)
+            else:
+                unavailable.append("deepcache")
+            if "tome" in variants and "deepcache" in variants:
+                variants["tome+deepcache"] = (tome_ratio, deepcache_interval)
             
-            # Загрузка изображения
-            image = Image.open(image_path)
+            self.logger.info(f"Бенчмарк ускорения UNet: {list(variants)} на {len(prompts)} промптах")
             
-            # Простое увеличение разрешения (можно заменить на более продвинутые методы)
-            new_size = (image.width * scale_factor, image.height * scale_factor)
-            upscaled_image = image.resize(new_size, Image.Resampling.LANCZOS)
+            pipeline = self.pipeline
             
-            # Сохранение
-            filename = f"upscaled_{task.id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png"
-            filepath = os.path.join(self.output_path, filename)
-            upscaled_image.save(filepath)
+            def run(variant_tome: float, variant_deepcache: int):
+                plan = self._plan_memory(width, height, 1)
+                self._apply_attention_plan(pipeline, plan.attention_slicing)
+                images = []
+                started = time.perf_counter()
+                for prompt in prompts:
+                    generator = torch.Generator(device=self.device).manual_seed(seed)
+                    with torch.no_grad(), self._accelerated(pipeline, variant_tome, variant_deepcache):
+                        latents = pipeline(
+                            prompt=prompt,
+                            width=width,
+                            height=height,
+                            num_inference_steps=steps,
+                            guidance_scale=guidance_scale,
+                            generator=generator,
+                            output_type="latent"
+                        ).images
+                    images.extend(self._decode_latents(pipeline, latents, plan.vae_slicing, plan.vae_tiling))
+                return images, (time.perf_counter() - started) / len(prompts)
+            
+            loop = asyncio.get_running_loop()
+            outputs = {}
+            for name, (variant_tome, variant_deepcache) in variants.items():
+                outputs[name] = await loop.run_in_executor(
+                    self.denoise_executor, run, variant_tome, variant_deepcache
+                )
+            
+            baseline_images, baseline_seconds = outputs["baseline"]
+            report = {}
+            for name, (images, seconds_per_image) in outputs.items():
+                metrics = [quality_metrics(ref, img) for ref, img in zip(baseline_images, images)]
+                report[name] = {
+                    "seconds_per_image": seconds_per_image,
+                    "speedup": baseline_seconds / seconds_per_image if seconds_per_image else 0.0,
+                    "psnr": sum(m["psnr"] for m in metrics) / len(metrics),
+                    "ssim": sum(m["ssim"] for m in metrics) / len(metrics)
+                }
             
             return {
                 "status": "success",
-                "image_path": filepath,
-                "original_size": (image.width, image.height),
-                "new_size": new_size,
-                "scale_factor": scale_factor
+                "results": report,
+                "unavailable": unavailable,
+                "metadata": {
+                    "prompts": prompts,
+                    "width": width,
+                    "height": height,
+                    "num_inference_steps": steps,
+                    "seed": seed,
+                    "tome_ratio": tome_ratio,
+                    "deepcache_interval": deepcache_interval,
+                    "benchmarked_at": datetime.now().isoformat()
+                }
             }
             
+        except Exception as e:
+            self.logger.error(f"Ошибка бенчмарка ускорения: {e}")
+            return {"status": "error", "error": str(e)}
+    
+    async def _upscale_image(self, task: Task) -> Dict[str, Any]:
+        """Увеличение разрешения одного (image_path) или нескольких (image_paths) изображений"""
+        try:
+            image_paths = task.data.get("image_paths") or [task.data.get("image_path")]
+            resample = task.data.get("resample", "lanczos")
+            
+            # Параметры и размеры проверяются до ресемплинга
+            scale_factor = validate_upscale(task.data.get("scale_factor", 2), resample)
+            for image_path in image_paths:
+                if not image_path or not os.path.exists(image_path):
+                    return {"status": "error", "error": f"Изображение не найдено: {image_path}"}
+                with Image.open(image_path) as image:
+                    pixels = image.width * image.height * scale_factor ** 2
+                if pixels > self.upscale_max_pixels:
+                    return {
+                        "status": "error",
+                        "error": f"Результат {image_path} превышает {self.upscale_max_pixels} пикселей"
+                    }
+            
+            loop = asyncio.get_running_loop()
+            images = []
+            for index, image_path in enumerate(image_paths):
+                key = store_key(f"{task.id}_{index}")
+                filepath = self.image_store.path_for(key, prefix="upscaled")
+                os.makedirs(os.path.dirname(filepath), exist_ok=True)
+                
+                info = await loop.run_in_executor(
+                    None,
+                    upscale_to_png,
+                    image_path,
+                    filepath,
+                    scale_factor,
+                    resample,
+                    self.upscale_executor,
+                    self.upscale_tile_size
+                )
+                
+                # Варианты доставки строятся из исходника сразу в целевом размере -
+                # полноразмерный результат повторно не читается
+                new_width, new_height = info["new_size"]
+                fit = min(1.0, self.image_store.delivery_max_side / max(new_width, new_height))
+                
+                def delivery_source() -> Image.Image:
+                    with Image.open(image_path) as source:
+                        return source.convert("RGBA" if info["mode"] == "RGBA" else "RGB").resize(
+                            (max(1, round(new_width * fit)), max(1, round(new_height * fit))),
+                            Image.Resampling.LANCZOS
+                        )
+                
+                variants = await self.image_store.save(
+                    await loop.run_in_executor(None, delivery_source),
+                    key,
+                    prefix="upscaled",
+                    original_size=info["new_size"]
+                )
+                
+                self.logger.info(f"Изображение увеличено: {filepath} ({info['tiles']} тайлов)")
+                
+                images.append({
+                    "image_path": filepath,
+                    "delivery_path": variants["delivery"]["path"],
+                    "thumbnail_path": variants["thumbnail"]["path"],
+                    "variants": variants,
+                    "source_path": image_path,
+                    "original_size": info["original_size"],
+                    "new_size": info["new_size"],
+                    "tiles": info["tiles"]
+                })
+            
+            return {
+                "status": "success",
+                # Поля одиночного запроса сохранены для совместимости
+                "image_path": images[0]["image_path"],
+                "original_size": images[0]["original_size"],
+                "new_size": images[0]["new_size"],
+                "images": images,
+                "scale_factor": scale_factor,
+                "resample": resample
+            }
+            
+        except ValueError as e:
+            return {"status": "error", "error": str(e)}
         except Exception as e:
             self.logger.error(f"Ошибка увеличения изображения: {e}")
             return {"status": "error", "error": str(e)}
     
-    async def _save_image_metadata(self, task_id: str, metadata: Dict[str, Any]):
-        """Сохранение метаданных изображения в базу данных"""
+    async def _save_image_metadata(self, task_id: str, metadata: Dict[str, Any],
+                                   cache_variants: Optional[Dict[str, Dict[str, Any]]] = None) -> bool:
+        """Сохранение метаданных изображения в базу данных
+        
+        Для результата из кэша (content_hash) в той же транзакции берется ссылка:
+        cache_variants - новый файл регистрируется, иначе ссылка добавляется
+        к существующей записи. False - записи кэша уже нет или ошибка БД.
+        """
         try:
             async with self.db_pool.acquire() as conn:
-                await conn.execute(
-                    """
-                    INSERT INTO generated_images 
-                    (task_id, agent_name, prompt, image_path, metadata)
-                    VALUES ($1, $2, $3, $4, $5)
-                    """,
-                    task_id,
-                    self.name,
-                    metadata["prompt"],
-                    metadata["filepath"],
-                    metadata
-                )
+                async with conn.transaction():
+                    key = metadata.get("content_hash")
+                    if key and cache_variants is not None:
+                        await ImageResultCache.register(conn, key, cache_variants, metadata)
+                    elif key and not await ImageResultCache.add_reference(conn, key):
+                        return False
+                    await conn.execute(
+                        """
+                        INSERT INTO generated_images 
+                        (task_id, agent_name, prompt, image_path, metadata, content_hash)
+                        VALUES ($1, $2, $3, $4, $5, $6)
+                        """,
+                        task_id,
+                        self.name,
+                        metadata["prompt"],
+                        metadata["filepath"],
+                        metadata,
+                        key
+                    )
+            return True
         except Exception as e:
             self.logger.error(f"Ошибка сохранения метаданных: {e}")
+            return False
+    
+    async def _background_work(self):
+        """Снятие просроченных ссылок истории и вытеснение кэша (раз в cache_maintenance_interval)"""
+        if not self.image_cache or time.monotonic() - self._cache_maintained_at < self.cache_maintenance_interval:
+            return
+        self._cache_maintained_at = time.monotonic()
+        try:
+            await self.image_cache.release_expired(self.image_cache_reference_days)
+            await self.image_cache.evict()
+        except Exception as e:
+            self.logger.error(f"Ошибка обслуживания кэша изображений: {e}")
     
     async def _cleanup_agent(self):
         """Очистка ресурсов ImageAgent"""
+        self.denoise_executor.shutdown(wait=False)
+        self.decode_executor.shutdown(wait=False)
+        self.upscale_executor.shutdown(wait=False)
+        
         if self.pipeline:
             del self.pipeline
             torch.cuda.empty_cache() if torch.cuda.is_available() else None
@@ -247,6 +1079,7 @@ class ImageAgent(BaseAgent):
             "model_name": "Stable Diffusion 1.5",
             "device": self.device,
             "loaded": self.pipeline is not None,
+            "acceleration": self._acceleration(),
             "output_path": self.output_path
         }
     
@@ -256,5 +1089,9 @@ class ImageAgent(BaseAgent):
             "status": "healthy" if self.pipeline is not None else "error",
             "model_loaded": self.pipeline is not None,
             "device": self.device,
-            "output_directory_exists": os.path.exists(self.output_path)
+            "output_directory_exists": os.path.exists(self.output_path),
+            "profile_timings": self.profile_timings,
+            "prompt_cache": self.prompt_cache.get_stats() if self.prompt_cache else {},
+            "memory": self.memory_planner.get_stats(),
+            "image_cache": await self.image_cache.get_stats() if self.image_cache else {}
         }
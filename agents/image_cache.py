@@ -0,0 +1,183 @@
+"""
+Контентно-адресуемый кэш результатов ImageAgent
+
+При заданном сиде кортеж (prompt, negative_prompt, width, height, steps,
+guidance, scheduler, seed, model) полностью определяет изображение, поэтому
+файл хранится под хэшем этого кортежа. Индекс image_cache считает ссылки
+из generated_images и время последнего обращения; при превышении лимита
+размера в порядке LRU вытесняются только файлы, на которые больше никто не
+ссылается. Ссылка берется в той же транзакции, что и запись generated_images,
+а снимается триггером при удалении строки или при обнулении content_hash -
+так release_expired отпускает файлы записей старше срока хранения ссылок.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Dict, Optional
+
+
+def content_key(params: Dict[str, Any], model_id: str) -> str:
+    """SHA-256 параметров, полностью определяющих результат генерации"""
+    payload = [
+        params["prompt"],
+        params["negative_prompt"],
+        int(params["width"]),
+        int(params["height"]),
+        int(params["num_inference_steps"]),
+        float(params["guidance_scale"]),
+        params["scheduler"],
+        int(params["seed"]),
+        model_id
+    ]
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class ImageResultCache:
+    """Индекс в PostgreSQL для файлов, записанных ImageOutputStore под хэшем параметров"""
+
+    def __init__(self, db_pool, max_bytes: int):
+        self.db_pool = db_pool
+        self.max_bytes = max_bytes
+        self.logger = logging.getLogger("agent.image_agent.image_cache")
+        self.stats = {"hits": 0, "misses": 0, "evicted": 0}
+        self._evict_lock = asyncio.Lock()
+
+    async def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        """Путь и метаданные исходной генерации или None"""
+        async with self.db_pool.acquire() as conn:
+            row = await conn.fetchrow(
+                """
+                UPDATE image_cache SET last_accessed = CURRENT_TIMESTAMP
+                WHERE content_hash = $1
+                RETURNING image_path, metadata
+                """,
+                key
+            )
+            if row and not os.path.exists(row["image_path"]):
+                # Файл удален вручную - запись индекса больше не действительна
+                await conn.execute("DELETE FROM image_cache WHERE content_hash = $1", key)
+                row = None
+
+        if row is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return {"image_path": row["image_path"], "metadata": row["metadata"]}
+
+    @staticmethod
+    async def register(conn, key: str, variants: Dict[str, Dict[str, Any]], metadata: Dict[str, Any]):
+        """Регистрация записанных вариантов вместе со ссылкой (в транзакции вызывающего)
+
+        Запись никогда не видна с нулевым счетчиком, поэтому параллельное
+        вытеснение не удалит только что записанный файл.
+        """
+        await conn.execute(
+            """
+            INSERT INTO image_cache (content_hash, image_path, size_bytes, metadata, refcount)
+            VALUES ($1, $2, $3, $4, 1)
+            ON CONFLICT (content_hash) DO UPDATE
+            SET image_path = EXCLUDED.image_path,
+                size_bytes = EXCLUDED.size_bytes,
+                metadata = EXCLUDED.metadata,
+                refcount = image_cache.refcount + 1,
+                last_accessed = CURRENT_TIMESTAMP
+            """,
+            key,
+            variants["original"]["path"],
+            sum(variant["bytes"] for variant in variants.values()),
+            metadata
+        )
+
+    @staticmethod
+    async def add_reference(conn, key: str) -> bool:
+        """Ссылка на найденную запись; False - ее успели вытеснить после lookup"""
+        referenced = await conn.fetchval(
+            """
+            UPDATE image_cache SET refcount = refcount + 1, last_accessed = CURRENT_TIMESTAMP
+            WHERE content_hash = $1
+            RETURNING content_hash
+            """,
+            key
+        )
+        return referenced is not None
+
+    async def release_expired(self, days: int) -> int:
+        """Снятие ссылок записей generated_images старше days дней (история остается)"""
+        if days <= 0:
+            return 0
+        async with self.db_pool.acquire() as conn:
+            result = await conn.execute(
+                """
+                UPDATE generated_images SET content_hash = NULL
+                WHERE content_hash IS NOT NULL
+                  AND created_at < CURRENT_TIMESTAMP - make_interval(days => $1)
+                """,
+                days
+            )
+        released = int(result.split()[-1])
+        if released:
+            self.logger.info(f"Сняты ссылки кэша изображений у {released} записей истории")
+        return released
+
+    async def evict(self):
+        """Вытеснение давно не запрошенных файлов без ссылок сверх лимита размера"""
+        if self.max_bytes <= 0:
+            return
+        async with self._evict_lock:
+            async with self.db_pool.acquire() as conn:
+                total = await conn.fetchval("SELECT COALESCE(SUM(size_bytes), 0) FROM image_cache")
+                if total <= self.max_bytes:
+                    return
+
+                # Файлы, на которые ссылаются generated_images, задачи и Telegram, не трогаются
+                rows = await conn.fetch(
+                    """
+                    SELECT content_hash, image_path, size_bytes, metadata FROM image_cache
+                    WHERE refcount <= 0
+                    ORDER BY last_accessed ASC
+                    """
+                )
+                for row in rows:
+                    if total <= self.max_bytes:
+                        break
+                    # Ссылка могла появиться после выборки - удаление только при нулевом счетчике
+                    deleted = await conn.fetchval(
+                        """
+                        DELETE FROM image_cache WHERE content_hash = $1 AND refcount <= 0
+                        RETURNING content_hash
+                        """,
+                        row["content_hash"]
+                    )
+                    if deleted is None:
+                        continue
+                    # Оригинал и все его варианты (доставка, миниатюра)
+                    metadata = row["metadata"]
+                    if isinstance(metadata, str):
+                        metadata = json.loads(metadata)
+                    paths = {row["image_path"]}
+                    paths.update(v["path"] for v in ((metadata or {}).get("variants") or {}).values())
+                    for path in paths:
+                        try:
+                            os.remove(path)
+                        except FileNotFoundError:
+                            pass
+                    total -= row["size_bytes"]
+                    self.stats["evicted"] += 1
+                    self.logger.info(f"Вытеснено из кэша изображений: {row['image_path']}")
+
+    async def get_stats(self) -> Dict[str, Any]:
+        total = self.stats["hits"] + self.stats["misses"]
+        async with self.db_pool.acquire() as conn:
+            row = await conn.fetchrow(
+                "SELECT COUNT(*) AS entries, COALESCE(SUM(size_bytes), 0) AS bytes FROM image_cache"
+            )
+        return {
+            **self.stats,
+            "entries": row["entries"],
+            "bytes": row["bytes"],
+            "max_bytes": self.max_bytes,
+            "hit_ratio": self.stats["hits"] / total if total else 0.0
+        }
@@ -0,0 +1,176 @@
+"""
+Асинхронная загрузка изображений по URL или пути к файлу
+
+Загрузка по URL идет через aiohttp сессию агента потоково, с ограничениями
+размера и таймаутами; декодирование выполняется в пуле потоков, цикл
+событий не блокируется. Декодированные изображения хранятся в ограниченном
+LRU: для URL ключ проверяется по ETag/Last-Modified условным запросом,
+для файлов - по времени изменения и размеру.
+"""
+
+import asyncio
+import io
+import logging
+import os
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+import aiohttp
+from PIL import Image
+
+
+class ImageLoadError(Exception):
+    """Изображение не удалось получить или декодировать"""
+
+
+class AsyncImageLoader:
+    """Загрузчик с общим LRU декодированных изображений"""
+
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        max_bytes: int = 20 * 1024 * 1024,
+        max_pixels: int = 50_000_000,
+        timeout: float = 30.0,
+        connect_timeout: float = 10.0,
+        cache_items: int = 32
+    ):
+        self.session = session
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        self.timeout = aiohttp.ClientTimeout(total=timeout, sock_connect=connect_timeout, sock_read=connect_timeout)
+        self.cache_items = cache_items
+        self.logger = logging.getLogger("agent.vision_agent.image_loader")
+        # ключ -> (валидатор, изображение); валидатор: (ETag, Last-Modified) или (mtime, размер)
+        self._cache: "OrderedDict[Tuple[str, str], Tuple[Any, Image.Image]]" = OrderedDict()
+        # Параллельные запросы одного и того же изображения выполняют одну загрузку
+        self._inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+        self.stats = {"hits": 0, "revalidated": 0, "misses": 0, "errors": 0}
+
+    async def load(self, image_path: Optional[str] = None, image_url: Optional[str] = None) -> Image.Image:
+        """RGB изображение; общее для всех вызывающих - изменять его нельзя"""
+        if image_path:
+            key = ("file", os.path.realpath(image_path))
+        elif image_url:
+            key = ("url", image_url)
+        else:
+            raise ImageLoadError("Не указан путь или URL изображения")
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                # Отменили загружавшего, а не этого ожидающего - загрузка повторяется
+                if inflight.cancelled() and not asyncio.current_task().cancelling():
+                    return await self.load(image_path, image_url)
+                raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            image = await (self._load_file(key[1]) if key[0] == "file" else self._load_url(key[1]))
+            future.set_result(image)
+            return image
+        except Exception as e:
+            self.stats["errors"] += 1
+            future.set_exception(e)
+            # Исключение уже передано ожидающим; без этого asyncio сообщит о непрочитанной ошибке
+            future.exception()
+            raise
+        except BaseException:
+            # CancelledError не Exception: без этого ожидающие зависли бы на future
+            future.cancel()
+            raise
+        finally:
+            del self._inflight[key]
+
+    def _cached(self, key: Tuple[str, str], validator: Any) -> Optional[Image.Image]:
+        entry = self._cache.get(key)
+        if entry is None or entry[0] != validator:
+            return None
+        self._cache.move_to_end(key)
+        return entry[1]
+
+    def _remember(self, key: Tuple[str, str], validator: Any, image: Image.Image):
+        self._cache[key] = (validator, image)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_items:
+            self._cache.popitem(last=False)
+
+    async def _load_file(self, path: str) -> Image.Image:
+        try:
+            stat = os.stat(path)
+        except OSError as e:
+            raise ImageLoadError(f"Файл изображения недоступен: {e}")
+
+        key = ("file", path)
+        validator = (stat.st_mtime_ns, stat.st_size)
+        image = self._cached(key, validator)
+        if image is not None:
+            self.stats["hits"] += 1
+            return image
+
+        self.stats["misses"] += 1
+        if stat.st_size > self.max_bytes:
+            raise ImageLoadError(f"Файл больше {self.max_bytes} байт: {stat.st_size}")
+        image = await asyncio.get_running_loop().run_in_executor(None, self._decode, path)
+        self._remember(key, validator, image)
+        return image
+
+    async def _load_url(self, url: str) -> Image.Image:
+        key = ("url", url)
+        entry = self._cache.get(key)
+        headers = {}
+        if entry is not None:
+            etag, last_modified = entry[0]
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        try:
+            async with self.session.get(url, headers=headers, timeout=self.timeout) as response:
+                if response.status == 304 and entry is not None:
+                    self.stats["revalidated"] += 1
+                    self._cache.move_to_end(key)
+                    return entry[1]
+                if response.status != 200:
+                    raise ImageLoadError(f"HTTP {response.status} при загрузке {url}")
+                if response.content_length is not None and response.content_length > self.max_bytes:
+                    raise ImageLoadError(f"Изображение больше {self.max_bytes} байт: {response.content_length}")
+
+                # Content-Length может отсутствовать или быть неверным - лимит проверяется по факту
+                buffer = bytearray()
+                async for chunk in response.content.iter_chunked(64 * 1024):
+                    buffer.extend(chunk)
+                    if len(buffer) > self.max_bytes:
+                        raise ImageLoadError(f"Изображение больше {self.max_bytes} байт")
+                validator = (response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        except asyncio.TimeoutError:
+            raise ImageLoadError(f"Таймаут загрузки {url}")
+        except aiohttp.ClientError as e:
+            raise ImageLoadError(f"Ошибка загрузки {url}: {e}")
+
+        self.stats["misses"] += 1
+        image = await asyncio.get_running_loop().run_in_executor(None, self._decode, io.BytesIO(bytes(buffer)))
+        # Без валидаторов ответ нельзя перепроверить - такой URL не кэшируется
+        if any(validator):
+            self._remember(key, validator, image)
+        else:
+            self._cache.pop(key, None)
+        return image
+
+    def _decode(self, source) -> Image.Image:
+        """Проверка размера по заголовку до декодирования и приведение к RGB"""
+        try:
+            with Image.open(source) as image:
+                if image.width * image.height > self.max_pixels:
+                    raise ImageLoadError(f"Изображение больше {self.max_pixels} пикселей: {image.size}")
+                return image.convert("RGB")
+        except ImageLoadError:
+            raise
+        except Exception as e:
+            raise ImageLoadError(f"Не удалось декодировать изображение: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "cached": len(self._cache), "cache_items": self.cache_items}
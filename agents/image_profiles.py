@@ -0,0 +1,43 @@
+"""
+Профили скорости/качества Stable Diffusion для ImageAgent
+
+Многошаговые солверы (DPM-Solver++, UniPC) дают сопоставимое качество за
+заметно меньшее число шагов, чем планировщик по умолчанию, что на CPU
+напрямую сокращает время генерации. Планировщики создаются из конфигурации
+исходного, поэтому UNet, VAE и текстовый энкодер не перезагружаются.
+"""
+
+from typing import Any, Dict
+
+
+DEFAULT_SCHEDULER = "default"
+
+# Профиль задает планировщик и число шагов; явные параметры задачи имеют приоритет
+SCHEDULER_PROFILES: Dict[str, Dict[str, Any]] = {
+    "draft": {"scheduler": "dpmsolver++", "num_inference_steps": 8},
+    "standard": {"scheduler": "dpmsolver++", "num_inference_steps": 15},
+    "quality": {"scheduler": "unipc", "num_inference_steps": 25}
+}
+
+SCHEDULERS = (DEFAULT_SCHEDULER, "dpmsolver++", "unipc")
+
+
+def create_scheduler(name: str, base_config: Dict[str, Any]):
+    """Планировщик по имени на основе конфигурации планировщика модели"""
+    from diffusers import DPMSolverMultistepScheduler, UniPCMultistepScheduler
+
+    if name == "dpmsolver++":
+        return DPMSolverMultistepScheduler.from_config(
+            base_config, algorithm_type="dpmsolver++", use_karras_sigmas=True
+        )
+    if name == "unipc":
+        return UniPCMultistepScheduler.from_config(base_config)
+    raise ValueError(f"Неизвестный планировщик: {name}")
+
+
+def sql_profile_case(field: str, profile_expr: str) -> str:
+    """SQL выражение значения поля по профилю задачи (для группировки задач в пакет)"""
+    branches = " ".join(
+        f"WHEN '{profile}' THEN '{values[field]}'" for profile, values in SCHEDULER_PROFILES.items()
+    )
+    return f"(CASE {profile_expr} {branches} END)"
@@ -0,0 +1,134 @@
+"""
+Хранилище выходных изображений ImageAgent
+
+Файлы раскладываются по подкаталогам из префикса хэша (ab/cd/<hash>...),
+чтобы каталог вывода не превращался в один плоский список. При записи
+вместе с оригиналом (PNG) создаются сжатый вариант для доставки
+(JPEG/WebP, ограниченный по большей стороне) и миниатюра: веб-интерфейс
+и Telegram передают их вместо полноразмерного PNG. Кодирование выполняется
+в пуле потоков, запись - через aiofiles.
+"""
+
+import asyncio
+import hashlib
+import io
+import os
+import tempfile
+from typing import Any, Dict, Optional, Tuple
+import aiofiles
+from PIL import Image
+
+
+DELIVERY_FORMATS = {"jpeg": ("JPEG", ".jpg"), "webp": ("WEBP", ".webp")}
+
+
+def store_key(name: str) -> str:
+    """Ключ для изображений без контентного хэша (например, по id задачи)"""
+    return hashlib.sha256(name.encode("utf-8")).hexdigest()
+
+
+class ImageOutputStore:
+    """Запись оригинала, варианта доставки и миниатюры в шардированные каталоги"""
+
+    def __init__(
+        self,
+        root: str,
+        delivery_format: str = "jpeg",
+        delivery_quality: int = 85,
+        delivery_max_side: int = 1024,
+        thumbnail_size: int = 256
+    ):
+        if delivery_format not in DELIVERY_FORMATS:
+            raise ValueError(f"Неизвестный формат доставки: {delivery_format}")
+        self.root = root
+        self.delivery_format = delivery_format
+        self.delivery_quality = delivery_quality
+        self.delivery_max_side = delivery_max_side
+        self.thumbnail_size = thumbnail_size
+
+    def shard_dir(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key[2:4])
+
+    def path_for(self, key: str, variant: str = "original", prefix: str = "image") -> str:
+        if variant == "original":
+            suffix = ".png"
+        else:
+            suffix = ("_thumb" if variant == "thumbnail" else "") + DELIVERY_FORMATS[self.delivery_format][1]
+        return os.path.join(self.shard_dir(key), f"{prefix}_{key}{suffix}")
+
+    def _encode_variants(self, image: Image.Image, with_original: bool) -> Dict[str, Dict[str, Any]]:
+        """Кодирование вариантов в память (выполняется в пуле потоков)"""
+        pil_format = DELIVERY_FORMATS[self.delivery_format][0]
+        # JPEG без альфа-канала; WebP сохраняет прозрачность
+        rgb = image if pil_format == "WEBP" or image.mode == "RGB" else image.convert("RGB")
+
+        variants = {}
+        if with_original:
+            buffer = io.BytesIO()
+            image.save(buffer, format="PNG")
+            variants["original"] = {"data": buffer.getvalue(), "format": "png", "size": image.size}
+
+        for variant, max_side in (("delivery", self.delivery_max_side), ("thumbnail", self.thumbnail_size)):
+            resized = rgb
+            if max(rgb.size) > max_side:
+                resized = rgb.copy()
+                resized.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+            buffer = io.BytesIO()
+            resized.save(buffer, format=pil_format, quality=self.delivery_quality, optimize=True)
+            variants[variant] = {"data": buffer.getvalue(), "format": self.delivery_format, "size": resized.size}
+        return variants
+
+    async def _write(self, path: str, data: bytes):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # Уникальный временный файл: один ключ может записываться параллельно
+        # (одинаковые промпты и сиды в одном батче)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path), suffix=".tmp")
+        os.close(fd)
+        try:
+            async with aiofiles.open(tmp_path, "wb") as f:
+                await f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    async def save(self, image: Image.Image, key: str, prefix: str = "image",
+                   original_size: Optional[Tuple[int, int]] = None) -> Dict[str, Dict[str, Any]]:
+        """Запись вариантов; описание (путь, формат, размер, байты) для generated_images.metadata
+
+        original_size - оригинал уже записан по path_for(key) (например, потоковым
+        PNG при увеличении), из image создаются только вариант доставки и миниатюра.
+        """
+        with_original = original_size is None
+        encoded = await asyncio.get_running_loop().run_in_executor(
+            None, self._encode_variants, image, with_original
+        )
+
+        variants = {}
+        for variant, item in encoded.items():
+            path = self.path_for(key, variant, prefix)
+            await self._write(path, item["data"])
+            variants[variant] = {
+                "path": path,
+                "format": item["format"],
+                "size": list(item["size"]),
+                "bytes": len(item["data"])
+            }
+        if not with_original:
+            path = self.path_for(key, "original", prefix)
+            variants["original"] = {
+                "path": path,
+                "format": "png",
+                "size": list(original_size),
+                "bytes": os.path.getsize(path)
+            }
+        return variants
+
+
+def variant_path(metadata: Optional[Dict[str, Any]], variant: str) -> Optional[str]:
+    """Путь варианта из метаданных изображения (None для записей без вариантов)"""
+    return ((metadata or {}).get("variants") or {}).get(variant, {}).get("path")
@@ -0,0 +1,40 @@
+"""
+Дешевые превью генерации Stable Diffusion из латентов
+
+Вместо VAE декодирования 4 канала латента проецируются в RGB фиксированной
+линейной матрицей (приближение декодера SD 1.x), что занимает доли
+миллисекунды и не требует дополнительной модели. Превью имеет разрешение
+латента (1/8 от итогового) и увеличивается до preview_size.
+"""
+
+from typing import List
+import numpy as np
+from PIL import Image
+
+
+# Вклад каждого канала латента SD 1.x в R, G, B
+SD15_LATENT_RGB_FACTORS = np.array([
+    [0.3512, 0.2297, 0.3227],
+    [0.3250, 0.4974, 0.2350],
+    [-0.2829, 0.1762, 0.2721],
+    [-0.2120, -0.2616, -0.7177]
+], dtype=np.float32)
+
+
+def latents_to_previews(latents, preview_size: int = 256) -> List[Image.Image]:
+    """Превью для каждого латента пакета (тензор или массив формы (B, 4, h, w))"""
+    array = latents.detach().float().cpu().numpy() if hasattr(latents, "detach") else np.asarray(latents)
+    # (B, 4, h, w) x (4, 3) -> (B, h, w, 3) в диапазоне примерно [-1, 1]
+    rgb = np.einsum("bchw,cr->bhwr", array.astype(np.float32), SD15_LATENT_RGB_FACTORS)
+    pixels = np.clip((rgb + 1.0) * 127.5, 0, 255).astype(np.uint8)
+
+    previews = []
+    for item in pixels:
+        image = Image.fromarray(item, "RGB")
+        scale = preview_size / max(image.size)
+        if scale > 1:
+            image = image.resize(
+                (round(image.width * scale), round(image.height * scale)), Image.Resampling.BILINEAR
+            )
+        previews.append(image)
+    return previews
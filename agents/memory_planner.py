@@ -0,0 +1,208 @@
+"""
+Планировщик памяти для Stable Diffusion на CPU
+
+Перед каждым запуском оценивается свободная память (MemAvailable и лимит
+cgroup контейнера) и выбирается самый быстрый режим, который в нее
+помещается: полное внимание или attention slicing, VAE декодирование целиком,
+по одному изображению (slicing) или тайлами (tiling), и максимальный размер
+пакета для разрешения запроса. При конвейере стадий UNet следующего пакета
+работает одновременно с VAE предыдущего, поэтому память декодирований, еще не
+завершенных к моменту планирования, резервируется и вычитается из бюджета.
+"""
+
+import resource
+import threading
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Optional
+
+
+# Оценки пикового прироста памяти на одно изображение 512x512 (float32, CFG)
+ATTENTION_MEMORY_MB = 1024  # матрицы внимания самого крупного слоя UNet, растут как площадь^2
+VAE_DECODE_MEMORY_MB = 1600  # активации декодера VAE без тайлинга
+VAE_TILE_MEMORY_MB = 600  # декодирование одного тайла 512x512
+# Запас на веса модели, аллокатор и прочие процессы контейнера
+HEADROOM = 0.8
+
+
+def _read_int(path: str) -> Optional[int]:
+    try:
+        with open(path) as f:
+            value = f.read().strip()
+    except OSError:
+        return None
+    return int(value) if value.isdigit() else None
+
+
+def cgroup_available_mb() -> Optional[float]:
+    """Остаток лимита памяти cgroup (v2 или v1); None - лимита нет"""
+    for limit_file, usage_file in (
+        ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory.current"),
+        ("/sys/fs/cgroup/memory/memory.limit_in_bytes", "/sys/fs/cgroup/memory/memory.usage_in_bytes")
+    ):
+        limit = _read_int(limit_file)
+        usage = _read_int(usage_file)
+        # В v1 отсутствие лимита выражается огромным числом
+        if limit is not None and usage is not None and limit < 2 ** 60:
+            return max(0, limit - usage) / (1024 * 1024)
+    return None
+
+
+def meminfo_available_mb() -> Optional[float]:
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def available_memory_mb() -> Optional[float]:
+    """Доступная память с учетом лимита контейнера"""
+    values = [v for v in (meminfo_available_mb(), cgroup_available_mb()) if v is not None]
+    return min(values) if values else None
+
+
+def peak_rss_mb() -> float:
+    """Пиковый RSS процесса (ru_maxrss в Linux в килобайтах)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def is_oom_error(error: BaseException) -> bool:
+    """Нехватка памяти, о которой сообщил аллокатор torch (до вмешательства OOM killer)"""
+    if isinstance(error, MemoryError):
+        return True
+    message = str(error).lower()
+    return isinstance(error, RuntimeError) and (
+        "out of memory" in message or "can't allocate memory" in message
+    )
+
+
+@dataclass
+class ExecutionPlan:
+    """Режим выполнения одного запроса"""
+    batch_size: int
+    attention_slicing: bool
+    vae_slicing: bool
+    vae_tiling: bool
+    available_mb: Optional[float]
+    estimated_mb: float
+    fits: bool = True
+    reserved_mb: float = 0.0
+    vae_mb: float = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    def describe(self) -> str:
+        available = f"{self.available_mb:.0f}" if self.available_mb is not None else "?"
+        return (
+            f"пакет={self.batch_size}, attention_slicing={self.attention_slicing}, "
+            f"vae_slicing={self.vae_slicing}, vae_tiling={self.vae_tiling}, "
+            f"оценка={self.estimated_mb:.0f} МБ из {available} МБ, "
+            f"резерв декодирований={self.reserved_mb:.0f} МБ"
+        )
+
+
+class MemoryPlanner:
+    """Выбор attention slicing, режима VAE и размера пакета по свободной памяти"""
+
+    def __init__(self, item_memory_mb: float = 1200, max_batch_size: int = 4, overlapped: bool = False):
+        self.item_memory_mb = item_memory_mb
+        self.max_batch_size = max(1, max_batch_size)
+        # UNet и VAE разных пакетов выполняются одновременно (конвейер стадий)
+        self.overlapped = overlapped
+        self.last_plan: Optional[ExecutionPlan] = None
+        self._reserved_mb = 0.0
+        self._reserve_lock = threading.Lock()
+
+    def reserve_decode(self, mb: float):
+        """Резерв под декодирование, которое начнется или уже идет параллельно с UNet"""
+        with self._reserve_lock:
+            self._reserved_mb += mb
+
+    def release_decode(self, mb: float):
+        with self._reserve_lock:
+            self._reserved_mb = max(0.0, self._reserved_mb - mb)
+
+    @property
+    def reserved_mb(self) -> float:
+        with self._reserve_lock:
+            return self._reserved_mb
+
+    def _unet_mb(self, scale: float, batch: int, attention_slicing: bool) -> float:
+        # Срезы по головам внимания держат в памяти одну матрицу за раз
+        attention = ATTENTION_MEMORY_MB * scale * scale
+        if attention_slicing:
+            attention /= 8
+        return batch * (self.item_memory_mb * scale + attention)
+
+    def _vae_mb(self, scale: float, batch: int, vae_slicing: bool, vae_tiling: bool) -> float:
+        per_image = VAE_TILE_MEMORY_MB if vae_tiling else VAE_DECODE_MEMORY_MB * scale
+        return per_image * (1 if vae_slicing else batch)
+
+    def max_batch(self, width: int, height: int) -> int:
+        """Наибольший пакет, помещающийся в память хотя бы с attention slicing"""
+        available = available_memory_mb()
+        if available is None:
+            return 1
+        scale = (width * height) / (512 * 512)
+        budget = available * HEADROOM - self.reserved_mb
+        for batch in range(self.max_batch_size, 0, -1):
+            if self._unet_mb(scale, batch, attention_slicing=True) <= budget:
+                return batch
+        return 1
+
+    def plan(self, width: int, height: int, batch_size: int) -> ExecutionPlan:
+        """Самый быстрый режим для пакета заданного разрешения
+
+        Вызывается непосредственно перед запуском UNet (в потоке денойзинга),
+        чтобы MemAvailable и резерв декодирований были актуальны.
+        """
+        available = available_memory_mb()
+        budget = available * HEADROOM if available is not None else None
+        scale = (width * height) / (512 * 512)
+        reserved = self.reserved_mb
+
+        if budget is None:
+            # Память неизвестна - самый экономный режим
+            vae_mb = self._vae_mb(scale, batch_size, True, scale > 1)
+            plan = ExecutionPlan(batch_size, True, True, scale > 1, None, 0.0, fits=False,
+                                 reserved_mb=reserved, vae_mb=vae_mb)
+            self.last_plan = plan
+            return plan
+
+        def estimate(unet_mb: float, vae_mb: float) -> float:
+            if self.overlapped:
+                # UNet идет одновременно с незавершенными декодированиями, а VAE этого
+                # пакета - с UNet следующего (оценивается по текущему)
+                return unet_mb + max(reserved, vae_mb)
+            return reserved + max(unet_mb, vae_mb)
+
+        # Режимы от быстрых к экономным; если не помещается ни один - самый экономный
+        modes = [
+            (attention_slicing, vae_slicing, vae_tiling)
+            for attention_slicing in (False, True)
+            for vae_slicing, vae_tiling in ((False, False), (True, False), (True, True))
+        ]
+        for attention_slicing, vae_slicing, vae_tiling in modes:
+            vae_mb = self._vae_mb(scale, batch_size, vae_slicing, vae_tiling)
+            estimated = estimate(self._unet_mb(scale, batch_size, attention_slicing), vae_mb)
+            if estimated <= budget:
+                break
+
+        plan = ExecutionPlan(
+            batch_size, attention_slicing, vae_slicing, vae_tiling, available, estimated,
+            fits=estimated <= budget, reserved_mb=reserved, vae_mb=vae_mb
+        )
+        self.last_plan = plan
+        return plan
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "available_mb": available_memory_mb(),
+            "peak_rss_mb": peak_rss_mb(),
+            "reserved_decode_mb": self.reserved_mb,
+            "last_plan": self.last_plan.to_dict() if self.last_plan else None
+        }
@@ -0,0 +1,268 @@
+"""
+Пространства имен векторных коллекций (тенант, чат)
+
+NamespaceRouter лениво открывает отдельную коллекцию на каждое пространство
+имен, поэтому поиск идет только по векторам нужного тенанта или чата, а не по
+глобальному индексу с фильтром where. У каждого пространства и свой BM25
+индекс, так что разреженный поиск тоже не зависит от размера всего корпуса.
+Маленькие пространства целиком держатся в памяти и ищутся точным перебором
+одной матричной операцией.
+"""
+
+import asyncio
+import contextlib
+import hashlib
+import logging
+import re
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+import numpy as np
+
+
+NAMESPACE_KEYS = ("namespace", "tenant", "chat_id")
+# Префикс у каждого ключа: namespace="tenant-x" и tenant="x" - разные коллекции
+NAMESPACE_PREFIXES = {"namespace": "ns", "tenant": "tenant", "chat_id": "chat"}
+# Имя коллекции Chroma - не длиннее 63 символов вместе с именем базовой коллекции
+MAX_COLLECTION_NAME = 63
+MAX_NAMESPACE_LENGTH = 40
+
+
+def namespace_from(data: Dict[str, Any]) -> Optional[str]:
+    """Пространство имен задачи: namespace, tenant или chat_id
+
+    Допустимое значение используется как есть; если символы пришлось заменить,
+    имя усечено или заканчивается не буквой/цифрой (требование Chroma), к нему
+    добавляется хэш исходного значения, чтобы разные значения не совпали.
+    """
+    for key in NAMESPACE_KEYS:
+        value = data.get(key)
+        if value not in (None, ""):
+            raw = f"{NAMESPACE_PREFIXES[key]}-{value}"
+            namespace = re.sub(r"[^A-Za-z0-9_-]+", "_", raw)
+            if namespace != raw or len(namespace) > MAX_NAMESPACE_LENGTH or not namespace[-1].isalnum():
+                digest = hashlib.sha1(raw.encode("utf-8")).hexdigest()[:12]
+                namespace = f"{namespace[:MAX_NAMESPACE_LENGTH - len(digest) - 1]}-{digest}"
+            return namespace
+    return None
+
+
+class NamespaceCollection:
+    """Коллекция пространства имен с точным поиском в памяти для малых размеров
+
+    Повторяет API AsyncVectorStore; операции, не переопределенные здесь,
+    делегируются хранилищу.
+    """
+
+    def __init__(self, namespace: str, store, small_threshold: int, text_index=None):
+        self.namespace = namespace
+        self.store = store
+        self.text_index = text_index
+        self.name = store.name
+        self.small_threshold = small_threshold
+        self.active = 0
+        self._matrix: Optional[np.ndarray] = None
+        self._ids: List[str] = []
+        self._documents: List[Optional[str]] = []
+        self._metadatas: List[Dict[str, Any]] = []
+        self._loaded = False
+        self._version = 0
+        self._load_lock = asyncio.Lock()
+
+    def __getattr__(self, name: str):
+        return getattr(self.store, name)
+
+    def _invalidate(self):
+        self._version += 1
+        self._loaded = False
+        self._matrix = None
+
+    async def add(self, ids, embeddings, documents=None, metadatas=None):
+        self._invalidate()
+        await self.store.add(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    async def delete(self, **kwargs):
+        self._invalidate()
+        await self.store.delete(**kwargs)
+
+    async def _load(self) -> bool:
+        """Загрузка малого пространства в память; False - пространство велико"""
+        async with self._load_lock:
+            if self._loaded:
+                return self._matrix is not None
+            version = self._version
+            if await self.store.count() > self.small_threshold:
+                self._loaded = version == self._version
+                return False
+
+            page = await self.store.scan(limit=self.small_threshold + 1, include_documents=True)
+            vectors = np.asarray(page["embeddings"], dtype=np.float32)
+            if len(vectors):
+                vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+            self._matrix = vectors
+            self._ids = page["ids"]
+            self._documents = page["documents"] or [None] * len(self._ids)
+            self._metadatas = page["metadatas"] or [{}] * len(self._ids)
+            # Запись во время загрузки: снимок мог устареть, следующий запрос перечитает
+            self._loaded = version == self._version
+            return True
+
+    async def query(self, query_embeddings, n_results=10, where=None, include=None) -> Dict[str, Any]:
+        # Фильтры метаданных оцениваются хранилищем
+        if where or not await self._load():
+            return await self.store.query(
+                query_embeddings=query_embeddings, n_results=n_results, where=where, include=include
+            )
+
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries[None, :]
+        result: Dict[str, Any] = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        if not len(self._ids):
+            for key in result:
+                result[key] = [[] for _ in queries]
+            return result
+
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        similarities = queries @ self._matrix.T
+        k = min(n_results, len(self._ids))
+        top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        for qi, candidates in enumerate(top):
+            order = candidates[np.argsort(-similarities[qi, candidates], kind="stable")]
+            result["ids"].append([self._ids[i] for i in order])
+            result["documents"].append([self._documents[i] for i in order])
+            result["metadatas"].append([self._metadatas[i] for i in order])
+            result["distances"].append((1.0 - similarities[qi, order]).tolist())
+        return result
+
+    def in_memory(self) -> bool:
+        return self._matrix is not None
+
+
+class NamespaceRouter:
+    """Ленивое открытие коллекций пространств имен с ограничением числа открытых
+
+    Открытие и закрытие хранилищ выполняются вне общей блокировки (задачами на
+    пространство имен), поэтому медленный диск одного тенанта не задерживает
+    запросы к остальным.
+    """
+
+    def __init__(
+        self,
+        open_store: Callable[[str], Awaitable[Any]],
+        base_name: str,
+        small_threshold: int = 2048,
+        max_open: int = 256,
+        open_text_index: Optional[Callable[[str, Any], Awaitable[Any]]] = None,
+        compact_text_index: Optional[Callable[[Any, bool], Awaitable[None]]] = None
+    ):
+        self.open_store = open_store
+        self.open_text_index = open_text_index
+        self.compact_text_index = compact_text_index
+        self.base_name = base_name
+        self.small_threshold = small_threshold
+        self.max_open = max(1, max_open)
+        self.logger = logging.getLogger("agent.embedding_agent.namespaces")
+        self._collections: "OrderedDict[str, NamespaceCollection]" = OrderedDict()
+        self._opening: Dict[str, asyncio.Task] = {}
+        self._closing: Dict[str, asyncio.Task] = {}
+        self._lock = asyncio.Lock()
+
+    def collection_name(self, namespace: str) -> str:
+        name = f"{self.base_name}__{namespace}"
+        if len(name) > MAX_COLLECTION_NAME:
+            raise ValueError(f"Имя коллекции длиннее {MAX_COLLECTION_NAME} символов: {name}")
+        return name
+
+    async def _open(self, namespace: str):
+        try:
+            # Повторное открытие только после того, как закрытие сохранило состояние
+            closing = self._closing.get(namespace)
+            if closing is not None:
+                await asyncio.gather(closing, return_exceptions=True)
+            name = self.collection_name(namespace)
+            store = await self.open_store(name)
+            text_index = await self.open_text_index(name, store) if self.open_text_index else None
+            collection = NamespaceCollection(namespace, store, self.small_threshold, text_index)
+            async with self._lock:
+                self._collections[namespace] = collection
+            self.logger.info(f"Открыто пространство имен {namespace}")
+        finally:
+            del self._opening[namespace]
+
+    async def _close(self, namespace: str, collection: NamespaceCollection):
+        try:
+            await collection.store.close()
+            if collection.text_index is not None and self.compact_text_index:
+                await self.compact_text_index(collection.text_index, True)
+        except Exception as e:
+            self.logger.error(f"Ошибка закрытия пространства имен {namespace}: {e}")
+        finally:
+            if self._closing.get(namespace) is asyncio.current_task():
+                del self._closing[namespace]
+
+    @contextlib.asynccontextmanager
+    async def use(self, namespace: str) -> AsyncIterator[NamespaceCollection]:
+        """Коллекция пространства имен (создается при первом обращении);
+        пока она используется, вытеснение ее не закроет"""
+        while True:
+            async with self._lock:
+                collection = self._collections.get(namespace)
+                if collection is not None:
+                    collection.active += 1
+                    self._collections.move_to_end(namespace)
+                    break
+                opening = self._opening.get(namespace)
+                if opening is None:
+                    # Задача, а не корутина вызывающего: отмена одного ожидающего не прерывает открытие
+                    opening = asyncio.create_task(self._open(namespace))
+                    self._opening[namespace] = opening
+            # Открытая коллекция могла быть сразу вытеснена - тогда следующий круг откроет ее снова
+            await asyncio.shield(opening)
+
+        try:
+            yield collection
+        finally:
+            collection.active -= 1
+            async with self._lock:
+                for victim_namespace, victim in self._select_victims():
+                    self._closing[victim_namespace] = asyncio.create_task(
+                        self._close(victim_namespace, victim)
+                    )
+
+    def _select_victims(self) -> List:
+        """Давно не использованные коллекции сверх лимита (закрываются вне блокировки)"""
+        victims = []
+        for namespace in list(self._collections):
+            if len(self._collections) <= self.max_open:
+                break
+            collection = self._collections[namespace]
+            if collection.active:
+                continue
+            del self._collections[namespace]
+            victims.append((namespace, collection))
+        return victims
+
+    async def snapshot(self):
+        for collection in list(self._collections.values()):
+            await collection.store.snapshot()
+            if collection.text_index is not None and self.compact_text_index:
+                await self.compact_text_index(collection.text_index, False)
+
+    async def close(self):
+        async with self._lock:
+            collections = list(self._collections.items())
+            self._collections.clear()
+        for namespace, collection in collections:
+            await self._close(namespace, collection)
+        if self._closing:
+            await asyncio.gather(*self._closing.values(), return_exceptions=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "open": len(self._collections),
+            "opening": len(self._opening),
+            "closing": len(self._closing),
+            "in_memory": sum(1 for c in self._collections.values() if c.in_memory()),
+            "max_open": self.max_open,
+            "small_threshold": self.small_threshold
+        }
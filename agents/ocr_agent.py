@@ -12,6 +12,7 @@ import numpy as np
 from PIL import Image
 import easyocr
 from .base_agent import BaseAgent, Task
+from .onnx_backend import benchmark, export_easyocr_recognizer, parity_report
 
 
 class OCRAgent(BaseAgent):
@@ -22,6 +23,11 @@ class OCRAgent(BaseAgent):
         self.model_path = config.get('models_path', '/app/models')
         self.reader: Optional[easyocr.Reader] = None
         self.languages = ['en', 'ru']  # Поддерживаемые языки
+        # torch или onnx для распознавателя; детектор остается на torch
+        self.inference_backend = config.get('inference_backend', 'torch')
+        self.onnx_config = config.get('onnx', {})
+        self.torch_recognizer = None
+        self.onnx_model_file: Optional[str] = None
         
     async def _initialize_agent(self):
         """Инициализация OCRAgent"""
@@ -30,6 +36,9 @@ class OCRAgent(BaseAgent):
         # Загрузка модели EasyOCR
         await self._load_model()
         
+        if self.inference_backend == 'onnx':
+            await self._enable_onnx_backend()
+        
         self.logger.info("OCRAgent успешно инициализирован")
     
     async def _load_model(self):
@@ -37,11 +46,13 @@ class OCRAgent(BaseAgent):
         try:
             self.logger.info("Загрузка EasyOCR модели")
             
-            # Инициализация EasyOCR
+            # Инициализация EasyOCR. Для ONNX бэкенда распознаватель нужен
+            # с float весами: int8 квантизацию EasyOCR экспортер не поддерживает
             self.reader = easyocr.Reader(
                 self.languages,
                 gpu=False,  # CPU-only
-                model_storage_directory=self.model_path
+                model_storage_directory=self.model_path,
+                quantize=self.inference_backend != 'onnx'
             )
             
             self.logger.info("EasyOCR модель загружена успешно")
@@ -50,6 +61,108 @@ class OCRAgent(BaseAgent):
             self.logger.error(f"Ошибка загрузки модели: {e}")
             raise
     
+    def _onnx_recognizer_name(self) -> str:
+        return f"easyocr_recognizer_{'_'.join(self.languages)}"
+    
+    def _sample_recognizer_batch(self, count: int = 16, width: int = 256):
+        """Синтетические строки текста в формате входа распознавателя EasyOCR"""
+        import torch
+        
+        samples = ["Invoice 1542", "Итого 12 500,00", "ООО Ромашка", "12.03.2024", "Total amount due"]
+        batch = np.full((count, 1, 64, width), 255, dtype=np.uint8)
+        for i in range(count):
+            cv2.putText(
+                batch[i, 0], samples[i % len(samples)], (4, 44),
+                cv2.FONT_HERSHEY_SIMPLEX, 1.1, 0, 2, cv2.LINE_AA
+            )
+        # Нормализация как в EasyOCR: [0, 255] -> [-1, 1]
+        image = torch.from_numpy(batch.astype(np.float32) / 255.0).sub_(0.5).div_(0.5)
+        text = torch.zeros(count, 1, dtype=torch.long)
+        return image, text
+    
+    def _recognizer_parity(self, onnx_recognizer) -> Dict[str, Any]:
+        import torch
+        
+        image, text = self._sample_recognizer_batch()
+        with torch.no_grad():
+            reference = self.torch_recognizer(image, text).numpy()
+            candidate = onnx_recognizer(image, text).numpy()
+        report = parity_report(reference, candidate)
+        report["min_agreement_required"] = self.onnx_config.get('min_agreement', 0.99)
+        report["passed"] = report["argmax_agreement"] >= report["min_agreement_required"]
+        return report
+    
+    def _build_onnx_recognizer(self):
+        return export_easyocr_recognizer(
+            self.torch_recognizer,
+            self.model_path,
+            self._onnx_recognizer_name(),
+            threads=self.onnx_config.get('threads', 0),
+            quantize=self.onnx_config.get('quantize', False)
+        )
+    
+    async def _enable_onnx_backend(self):
+        """Экспорт распознавателя в ONNX и подмена после сверки с torch"""
+        loop = asyncio.get_running_loop()
+        try:
+            self.torch_recognizer = self.reader.recognizer
+            onnx_recognizer, model_file = await loop.run_in_executor(None, self._build_onnx_recognizer)
+            parity = await loop.run_in_executor(None, self._recognizer_parity, onnx_recognizer)
+            if not parity["passed"]:
+                self.logger.warning(f"ONNX распознаватель не прошел сверку с torch ({parity}), используется torch")
+                return
+            # EasyOCR вызывает распознаватель как torch-модуль - подменяется только он
+            self.reader.recognizer = onnx_recognizer
+            self.onnx_model_file = model_file
+            self.logger.info(f"Распознавание через ONNX Runtime: {model_file}")
+        except Exception as e:
+            self.logger.warning(f"ONNX бэкенд недоступен ({e}), используется torch")
+    
+    async def _backend_benchmark(self, task: Task) -> Dict[str, Any]:
+        """Сверка и сравнение пропускной способности распознавателя torch и ONNX Runtime"""
+        try:
+            import torch
+            
+            count = task.data.get("num_crops", 64)
+            width = task.data.get("width", 256)
+            
+            self.logger.info(f"Сравнение бэкендов распознавателя на {count} строках")
+            
+            if self.torch_recognizer is None:
+                self.torch_recognizer = self.reader.recognizer
+            
+            loop = asyncio.get_running_loop()
+            
+            def run():
+                onnx_recognizer, model_file = self._build_onnx_recognizer()
+                parity = self._recognizer_parity(onnx_recognizer)
+                image, text = self._sample_recognizer_batch(count, width)
+                with torch.no_grad():
+                    throughput = benchmark({
+                        "torch": lambda: self.torch_recognizer(image, text),
+                        "onnx": lambda: onnx_recognizer(image, text)
+                    }, items=count, repeats=task.data.get("repeats", 3))
+                return model_file, parity, throughput
+            
+            model_file, parity, throughput = await loop.run_in_executor(None, run)
+            
+            return {
+                "status": "success",
+                "active_backend": "onnx" if self.onnx_model_file else "torch",
+                "onnx_model": model_file,
+                "parity": parity,
+                "throughput": throughput,
+                "speedup": throughput["onnx"]["items_per_second"] / throughput["torch"]["items_per_second"],
+                "metadata": {
+                    "benchmarked_at": datetime.now().isoformat(),
+                    "crop_width": width
+                }
+            }
+            
+        except Exception as e:
+            self.logger.error(f"Ошибка сравнения бэкендов: {e}")
+            return {"status": "error", "error": str(e)}
+    
     async def process_task(self, task: Task) -> Dict[str, Any]:
         """Обработка задач OCR"""
         if task.task_type == "text_extraction":
@@ -60,6 +173,8 @@ class OCRAgent(BaseAgent):
             return await self._analyze_document(task)
         elif task.task_type == "table_extraction":
             return await self._extract_table(task)
+        elif task.task_type == "backend_benchmark":
+            return await self._backend_benchmark(task)
         
         return {"status": "unknown_task_type"}
     
@@ -394,7 +509,8 @@ class OCRAgent(BaseAgent):
             "model_name": "EasyOCR",
             "languages": self.languages,
             "loaded": self.reader is not None,
-            "gpu_enabled": False  # CPU-only
+            "gpu_enabled": False,  # CPU-only
+            "recognizer_backend": "onnx" if self.onnx_model_file else "torch"
         }
     
     async def health_check(self) -> Dict[str, Any]:
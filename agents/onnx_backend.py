@@ -0,0 +1,239 @@
+"""
+ONNX Runtime бэкенд для малых моделей (MiniLM в EmbeddingAgent, распознаватель EasyOCR)
+
+Модель один раз экспортируется из torch в .onnx под MODELS_PATH/onnx (опционально
+с динамической int8 квантизацией весов), дальше инференс идет через
+onnxruntime с настроенным числом intra-op потоков. Перед включением бэкенда
+выходы сверяются с torch (parity), а benchmark сравнивает пропускную способность.
+"""
+
+import copy
+import logging
+import os
+import re
+import time
+from typing import Any, Callable, Dict, List
+import numpy as np
+
+
+logger = logging.getLogger("agent.onnx_backend")
+
+
+def onnx_available() -> bool:
+    try:
+        import onnxruntime  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def onnx_model_path(models_path: str, name: str, quantize: bool) -> str:
+    """Путь кэшированного .onnx файла модели"""
+    safe_name = re.sub(r"[^A-Za-z0-9_.-]+", "_", name)
+    suffix = ".int8.onnx" if quantize else ".onnx"
+    return os.path.join(models_path, "onnx", safe_name + suffix)
+
+
+def create_session(model_file: str, threads: int = 0):
+    """Сессия onnxruntime на CPU с заданным числом intra-op потоков (0 - по числу ядер)"""
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.intra_op_num_threads = threads or (os.cpu_count() or 1)
+    # Один запрос за раз: межоператорный параллелизм только мешает intra-op потокам
+    options.inter_op_num_threads = 1
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    return ort.InferenceSession(model_file, options, providers=["CPUExecutionProvider"])
+
+
+def export_once(model_file: str, export_fn: Callable[[str], None], quantize: bool):
+    """Экспорт в .onnx, если кэшированного файла еще нет (атомарно через tmp файл)"""
+    if os.path.exists(model_file):
+        return
+    os.makedirs(os.path.dirname(model_file), exist_ok=True)
+
+    float_file = model_file.replace(".int8.onnx", ".onnx") if quantize else model_file
+    if not os.path.exists(float_file):
+        tmp_file = float_file + ".tmp"
+        logger.info(f"Экспорт модели в ONNX: {float_file}")
+        export_fn(tmp_file)
+        os.replace(tmp_file, float_file)
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        tmp_file = model_file + ".tmp"
+        logger.info(f"Int8 квантизация ONNX модели: {model_file}")
+        quantize_dynamic(float_file, tmp_file, weight_type=QuantType.QInt8)
+        os.replace(tmp_file, model_file)
+
+
+def _session_feed(session, inputs: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Только те входы, которые остались в графе после экспорта"""
+    names = {i.name for i in session.get_inputs()}
+    return {name: value for name, value in inputs.items() if name in names}
+
+
+class OnnxSentenceEncoder:
+    """Замена SentenceTransformer.encode: трансформер в ONNX + mean pooling + нормализация"""
+
+    def __init__(self, model, models_path: str, name: str, threads: int = 0, quantize: bool = False):
+        from sentence_transformers.models import Normalize, Pooling
+
+        transformer = model[0]
+        pooling = next((m for m in model if isinstance(m, Pooling)), None)
+        if pooling is None or not pooling.pooling_mode_mean_tokens:
+            raise ValueError("ONNX бэкенд поддерживает только mean pooling")
+
+        self.tokenizer = transformer.tokenizer
+        self.max_length = model.max_seq_length
+        self.normalize = any(isinstance(m, Normalize) for m in model)
+        self.model_file = onnx_model_path(models_path, name, quantize)
+        self.quantize = quantize
+
+        export_once(self.model_file, lambda path: self._export(transformer.auto_model, path), quantize)
+        self.session = create_session(self.model_file, threads)
+
+    def _export(self, auto_model, path: str):
+        import torch
+
+        dummy = self.tokenizer(["export"], padding=True, return_tensors="pt")
+        # Порядок совпадает с позиционными аргументами forward у BERT-подобных моделей
+        input_names = [k for k in ("input_ids", "attention_mask", "token_type_ids") if k in dummy]
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+        dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+        auto_model.eval()
+        with torch.no_grad():
+            torch.onnx.export(
+                auto_model,
+                tuple(dummy[name] for name in input_names),
+                path,
+                input_names=input_names,
+                output_names=["last_hidden_state"],
+                dynamic_axes=dynamic_axes,
+                opset_version=14
+            )
+
+    def encode(self, texts: List[str], batch_size: int = 64) -> np.ndarray:
+        outputs = []
+        for start in range(0, len(texts), batch_size):
+            batch = self.tokenizer(
+                texts[start:start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_length,
+                return_tensors="np"
+            )
+            feed = _session_feed(self.session, {k: v.astype(np.int64) for k, v in batch.items()})
+            hidden = self.session.run(["last_hidden_state"], feed)[0]
+
+            mask = batch["attention_mask"][..., None].astype(np.float32)
+            embeddings = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            if self.normalize:
+                embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+            outputs.append(embeddings.astype(np.float32))
+        return np.concatenate(outputs) if outputs else np.zeros((0, 0), dtype=np.float32)
+
+
+def _recognizer_module(session):
+    """torch-модуль с интерфейсом распознавателя EasyOCR (forward(image, text))"""
+    import torch
+
+    class OnnxRecognizer(torch.nn.Module):
+        def forward(self, image, text=None):
+            feed = {"image": image.cpu().numpy().astype(np.float32)}
+            if text is not None:
+                feed["text"] = text.cpu().numpy().astype(np.int64)
+            return torch.from_numpy(session.run(None, _session_feed(session, feed))[0])
+
+    return OnnxRecognizer()
+
+
+def _exportable_recognizer(recognizer):
+    """Копия распознавателя, которую можно экспортировать с динамической шириной
+
+    EasyOCR сводит высоту признаков через AdaptiveAvgPool2d((None, 1)); экспортер
+    не поддерживает адаптивный пулинг с неконстантным размером выхода, поэтому
+    в копии он заменяется эквивалентным средним по последней оси.
+    """
+    import torch
+
+    class MeanOverLastDim(torch.nn.Module):
+        def forward(self, x):
+            return x.mean(dim=-1, keepdim=True)
+
+    if any(".quantized" in type(module).__module__ for module in recognizer.modules()):
+        raise ValueError("распознаватель квантован (easyocr.Reader(quantize=True)), экспорт в ONNX невозможен")
+
+    exportable = copy.deepcopy(recognizer)
+    for name, module in list(exportable.named_modules()):
+        if isinstance(module, torch.nn.AdaptiveAvgPool2d) and tuple(module.output_size) == (None, 1):
+            parent_name, _, attribute = name.rpartition(".")
+            setattr(exportable.get_submodule(parent_name), attribute, MeanOverLastDim())
+    return exportable.eval()
+
+
+def export_easyocr_recognizer(recognizer, models_path: str, name: str, threads: int = 0, quantize: bool = False):
+    """Экспорт torch-распознавателя EasyOCR и torch-модуль, выполняющий его в onnxruntime
+
+    Распознаватель должен быть с float весами: динамически квантованные
+    (quantize=True в easyocr.Reader) LSTM и Linear в ONNX не экспортируются.
+    """
+    import torch
+
+    model_file = onnx_model_path(models_path, name, quantize)
+
+    def export(path: str):
+        # Вход распознавателя: серые строки высотой 64, ширина переменная.
+        # Батч из двух строк: при батче 1 экспортер фиксирует размер батча в графе
+        image = torch.rand(2, 1, 64, 256)
+        text = torch.zeros(2, 1, dtype=torch.long)
+        with torch.no_grad():
+            torch.onnx.export(
+                _exportable_recognizer(recognizer),
+                (image, text),
+                path,
+                input_names=["image", "text"],
+                output_names=["logits"],
+                dynamic_axes={
+                    "image": {0: "batch", 3: "width"},
+                    "text": {0: "batch"},
+                    "logits": {0: "batch", 1: "steps"}
+                },
+                opset_version=14
+            )
+
+    export_once(model_file, export, quantize)
+    return _recognizer_module(create_session(model_file, threads)), model_file
+
+
+def parity_report(reference: np.ndarray, candidate: np.ndarray, cosine: bool = False) -> Dict[str, Any]:
+    """Сравнение выходов torch и ONNX"""
+    reference = np.asarray(reference, dtype=np.float32)
+    candidate = np.asarray(candidate, dtype=np.float32)
+    report = {"max_abs_diff": float(np.abs(reference - candidate).max()) if reference.size else 0.0}
+    if cosine:
+        ref = reference / np.maximum(np.linalg.norm(reference, axis=-1, keepdims=True), 1e-12)
+        cand = candidate / np.maximum(np.linalg.norm(candidate, axis=-1, keepdims=True), 1e-12)
+        report["min_cosine"] = float((ref * cand).sum(axis=-1).min()) if reference.size else 1.0
+    else:
+        # Для логитов распознавателя важно совпадение выбранных символов
+        report["argmax_agreement"] = (
+            float((reference.argmax(-1) == candidate.argmax(-1)).mean()) if reference.size else 1.0
+        )
+    return report
+
+
+def benchmark(run_fns: Dict[str, Callable[[], Any]], items: int, repeats: int = 3) -> Dict[str, Any]:
+    """Пропускная способность (элементов/с) для каждого варианта, лучший из repeats"""
+    report = {}
+    for name, run in run_fns.items():
+        run()  # прогрев
+        best = float("inf")
+        for _ in range(repeats):
+            started = time.perf_counter()
+            run()
+            best = min(best, time.perf_counter() - started)
+        report[name] = {"seconds": best, "items_per_second": items / best if best else 0.0}
+    return report
@@ -0,0 +1,84 @@
+"""
+PromptEmbeddingCache - LRU кэш эмбеддингов CLIP текстового энкодера для ImageAgent
+
+Пользователи часто повторяют промпты, а негативный промпт почти всегда один
+и тот же, поэтому эмбеддинги (prompt_embeds / negative_prompt_embeds)
+кэшируются по нормализованному тексту и ревизии модели и передаются
+в пайплайн напрямую, минуя текстовый энкодер.
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+import torch
+
+
+def normalize_prompt(text: str) -> str:
+    """CLIP токенизатор приводит текст к нижнему регистру и схлопывает пробелы"""
+    return " ".join((text or "").lower().split())
+
+
+class PromptEmbeddingCache:
+    """Потокобезопасный LRU кэш тензоров (1, 77, dim) текстового энкодера"""
+
+    def __init__(self, pipeline, max_items: int = 256):
+        self.pipeline = pipeline
+        self.max_items = max_items
+        self.revision = self._model_revision(pipeline)
+        self.logger = logging.getLogger("agent.image_agent.prompt_cache")
+        self._items: "OrderedDict[Tuple[str, str], torch.Tensor]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def _model_revision(pipeline) -> str:
+        config = pipeline.text_encoder.config
+        name = getattr(config, "_name_or_path", "") or pipeline.config.get("_name_or_path", "")
+        return f"{name}@{getattr(config, '_commit_hash', None) or 'local'}"
+
+    def _encode(self, text: str) -> torch.Tensor:
+        with torch.no_grad():
+            prompt_embeds, _ = self.pipeline.encode_prompt(
+                text, self.pipeline.device, 1, do_classifier_free_guidance=False
+            )
+        return prompt_embeds
+
+    def get(self, text: str) -> torch.Tensor:
+        """Эмбеддинг одного текста ("" - безусловный эмбеддинг)"""
+        key = (self.revision, normalize_prompt(text))
+        with self._lock:
+            embeds = self._items.get(key)
+            if embeds is not None:
+                self._items.move_to_end(key)
+                self.stats["hits"] += 1
+                return embeds
+            self.stats["misses"] += 1
+
+        # Кодирование вне блокировки; повторное вычисление при гонке безвредно
+        embeds = self._encode(key[1])
+        with self._lock:
+            self._items[key] = embeds
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+        return embeds
+
+    def get_batch(self, texts: List[str]) -> torch.Tensor:
+        return torch.cat([self.get(text) for text in texts])
+
+    def warmup(self, texts: List[str]):
+        """Предварительное вычисление частых текстов (безусловный эмбеддинг всегда)"""
+        for text in [""] + list(texts):
+            self.get(text)
+        self.logger.info(f"Кэш эмбеддингов промптов прогрет: {len(self._items)} записей")
+
+    def get_stats(self) -> Dict[str, Any]:
+        total = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "items": len(self._items),
+            "max_items": self.max_items,
+            "hit_ratio": self.stats["hits"] / total if total else 0.0,
+            "revision": self.revision
+        }
@@ -3,12 +3,14 @@ TelegramAgent - интеграция с Telegram для управления AGI
 """
 
 import asyncio
+import json
 import logging
-from typing import Dict, Any, Optional
+import os
+from typing import Dict, Any, Optional, Tuple
 from datetime import datetime
 import aiohttp
 import asyncpg
-from telegram import Update, Bot
+from telegram import Update, Bot, InputMediaPhoto, Message
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 from .base_agent import BaseAgent, Task
 
@@ -22,6 +24,12 @@ class TelegramAgent(BaseAgent):
         self.allowed_chat_id = config.get('telegram_chat_id')
         self.bot: Optional[Bot] = None
         self.application: Optional[Application] = None
+        # Генерации в процессе по (чат, промпт) - повторный /generate не создает дубль
+        self.active_generations: Dict[Tuple[int, str], str] = {}
+        # Ссылки на задачи отслеживания: event loop хранит только слабые ссылки
+        self._watchers: set = set()
+        self.progress_poll_interval = config.get('progress_poll_interval', 3.0)
+        self.progress_timeout = config.get('progress_timeout', 900)
         
     async def _initialize_agent(self):
         """Инициализация Telegram бота"""
@@ -131,21 +139,130 @@ class TelegramAgent(BaseAgent):
         
         await self._log_telegram_message(update, "generate", prompt)
         
+        key = (update.effective_chat.id, " ".join(prompt.lower().split()))
+        active_task_id = self.active_generations.get(key)
+        if active_task_id:
+            await update.message.reply_text(
+                f"⏳ Это изображение уже генерируется (задача {active_task_id}).\n"
+                f"Прогресс и превью обновляются в сообщении выше."
+            )
+            return
+        
         try:
             # Создание задачи генерации изображения
             task_id = await self._create_image_generation_task(prompt, update.effective_chat.id)
             
-            await update.message.reply_text(
+            status_message = await update.message.reply_text(
                 f"🎨 Генерация изображения запущена!\n"
                 f"Промпт: {prompt}\n"
                 f"ID задачи: {task_id}\n"
                 f"Ожидайте результат..."
             )
             
+            if task_id != "unknown":
+                self.active_generations[key] = task_id
+                watcher = asyncio.create_task(self._watch_generation(task_id, key, prompt, status_message))
+                self._watchers.add(watcher)
+                watcher.add_done_callback(self._watchers.discard)
+            
         except Exception as e:
             await update.message.reply_text(f"Ошибка создания задачи: {e}")
             self.logger.error(f"Ошибка создания задачи генерации: {e}")
     
+    async def _get_generation_progress(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """Статус, прогресс и результат задачи генерации"""
+        async with self.db_pool.acquire() as conn:
+            row = await conn.fetchrow(
+                """
+                SELECT t.status, p.step, p.total_steps, p.preview_path, r.result
+                FROM tasks t
+                LEFT JOIN task_progress p ON p.task_id = t.id
+                LEFT JOIN LATERAL (
+                    SELECT result FROM task_results
+                    WHERE task_id = t.id ORDER BY created_at DESC LIMIT 1
+                ) r ON TRUE
+                WHERE t.id = $1
+                """,
+                task_id
+            )
+        if row is None:
+            return None
+        progress = dict(row)
+        if isinstance(progress["result"], str):
+            progress["result"] = json.loads(progress["result"])
+        return progress
+    
+    async def _watch_generation(self, task_id: str, key: Tuple[int, str], prompt: str, status_message: Message):
+        """Правка сообщения о генерации: шаг, превью из латентов и итоговое изображение"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.progress_timeout
+        preview_message: Optional[Message] = None
+        last_text = None
+        last_preview = None
+        
+        try:
+            while loop.time() < deadline:
+                await asyncio.sleep(self.progress_poll_interval)
+                try:
+                    progress = await self._get_generation_progress(task_id)
+                    if progress is None:
+                        continue
+                    
+                    if progress["status"] in ("completed", "failed"):
+                        await self._finish_generation(task_id, prompt, progress, status_message, preview_message)
+                        return
+                    
+                    if progress["step"]:
+                        filled = int(10 * progress["step"] / progress["total_steps"])
+                        text = (
+                            f"🎨 Генерация: шаг {progress['step']}/{progress['total_steps']} "
+                            f"{'█' * filled}{'░' * (10 - filled)}\n"
+                            f"Промпт: {prompt}\n"
+                            f"ID задачи: {task_id}"
+                        )
+                        # Telegram отклоняет правку без изменений
+                        if text != last_text:
+                            await status_message.edit_text(text)
+                            last_text = text
+                    
+                    preview_file = progress["preview_path"]
+                    if preview_file and os.path.exists(preview_file):
+                        preview_version = (preview_file, os.path.getmtime(preview_file))
+                        if preview_version != last_preview:
+                            last_preview = preview_version
+                            with open(preview_file, "rb") as f:
+                                if preview_message is None:
+                                    preview_message = await status_message.reply_photo(photo=f, caption="Превью")
+                                else:
+                                    await preview_message.edit_media(InputMediaPhoto(media=f, caption="Превью"))
+                except Exception as e:
+                    self.logger.warning(f"Ошибка обновления прогресса задачи {task_id}: {e}")
+            
+            await status_message.edit_text(f"⌛ Генерация не завершилась вовремя\nID задачи: {task_id}")
+        except Exception as e:
+            self.logger.error(f"Ошибка отслеживания генерации {task_id}: {e}")
+        finally:
+            self.active_generations.pop(key, None)
+    
+    async def _finish_generation(self, task_id: str, prompt: str, progress: Dict[str, Any],
+                                 status_message: Message, preview_message: Optional[Message]):
+        """Итоговое изображение на месте превью (или новым сообщением)"""
+        result = progress["result"] or {}
+        # Сжатый вариант доставки вместо полноразмерного PNG
+        image_path = result.get("delivery_path") or result.get("image_path")
+        if progress["status"] == "failed" or not image_path or not os.path.exists(image_path):
+            await status_message.edit_text(
+                f"❌ Ошибка генерации: {result.get('error', 'неизвестная ошибка')}\nID задачи: {task_id}"
+            )
+            return
+        
+        await status_message.edit_text(f"✅ Изображение готово\nПромпт: {prompt}\nID задачи: {task_id}")
+        with open(image_path, "rb") as f:
+            if preview_message is None:
+                await status_message.reply_photo(photo=f, caption=prompt)
+            else:
+                await preview_message.edit_media(InputMediaPhoto(media=f, caption=prompt))
+    
     async def _cmd_report(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработка команды /report"""
         if not await self._check_authorization(update):
@@ -350,6 +467,11 @@ class TelegramAgent(BaseAgent):
     
     async def _cleanup_agent(self):
         """Очистка ресурсов TelegramAgent"""
+        for watcher in list(self._watchers):
+            watcher.cancel()
+        if self._watchers:
+            await asyncio.gather(*self._watchers, return_exceptions=True)
+        
         if self.application:
             await self.application.stop()
             await self.application.shutdown()
@@ -0,0 +1,198 @@
+"""
+TextIndex - инкрементальный инвертированный индекс с BM25 скорингом
+
+Используется EmbeddingAgent для гибридного поиска: ключевые слова (номера счетов,
+имена из OCR) плохо находятся плотными векторами, BM25 их находит точно.
+Обновления пишутся в журнал (append-only JSONL) и периодически сворачиваются
+в снапшот, поэтому индекс никогда не перестраивается на запрос.
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    """Разбиение текста на токены в нижнем регистре"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class TextIndex:
+    """Инвертированный индекс BM25 с инкрементальными обновлениями"""
+
+    def __init__(self, path: str, name: str, k1: float = 1.2, b: float = 0.75, compact_every: int = 10000):
+        self.path = os.path.join(path, name)
+        self.k1 = k1
+        self.b = b
+        self.compact_every = compact_every
+        self.logger = logging.getLogger("agent.embedding_agent.text_index")
+        self._lock = threading.RLock()
+
+        self.snapshot_file = os.path.join(self.path, "bm25_snapshot.json")
+        self.journal_file = os.path.join(self.path, "bm25_journal.jsonl")
+
+        # term -> {doc_id: tf}
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._doc_lengths: Dict[str, int] = {}
+        self._doc_terms: Dict[str, List[str]] = {}
+        self._total_length = 0
+        self._journal_entries = 0
+
+        os.makedirs(self.path, exist_ok=True)
+        self._restore()
+
+    # ---- обновления -------------------------------------------------------
+
+    def add(self, ids: List[str], texts: List[str]):
+        """Добавление (или замена) документов"""
+        with self._lock:
+            self._append_journal({"op": "add", "ids": ids, "texts": texts})
+            for doc_id, text in zip(ids, texts):
+                self._apply_add(doc_id, text)
+
+    def delete(self, ids: List[str]):
+        """Удаление документов"""
+        with self._lock:
+            self._append_journal({"op": "delete", "ids": ids})
+            for doc_id in ids:
+                self._apply_delete(doc_id)
+
+    def _apply_add(self, doc_id: str, text: str):
+        if doc_id in self._doc_lengths:
+            self._apply_delete(doc_id)
+        counts = Counter(tokenize(text))
+        for term, tf in counts.items():
+            self._postings.setdefault(term, {})[doc_id] = tf
+        length = sum(counts.values())
+        self._doc_lengths[doc_id] = length
+        self._doc_terms[doc_id] = list(counts)
+        self._total_length += length
+
+    def _apply_delete(self, doc_id: str):
+        length = self._doc_lengths.pop(doc_id, None)
+        if length is None:
+            return
+        self._total_length -= length
+        for term in self._doc_terms.pop(doc_id, []):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+
+    # ---- поиск ----------------------------------------------------------
+
+    def search(self, query: str, top_k: int = 10, allowed_ids: Optional[set] = None) -> List[Tuple[str, float]]:
+        """Top-k документов по BM25"""
+        with self._lock:
+            n_docs = len(self._doc_lengths)
+            if n_docs == 0:
+                return []
+            avg_length = self._total_length / n_docs
+
+            scores: Dict[str, float] = {}
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                df = len(postings)
+                idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+
+                doc_ids = list(postings)
+                tf = np.fromiter(postings.values(), dtype=np.float64, count=df)
+                lengths = np.fromiter(
+                    (self._doc_lengths[d] for d in doc_ids), dtype=np.float64, count=df
+                )
+                term_scores = idf * tf * (self.k1 + 1) / (
+                    tf + self.k1 * (1 - self.b + self.b * lengths / avg_length)
+                )
+                for doc_id, score in zip(doc_ids, term_scores):
+                    scores[doc_id] = scores.get(doc_id, 0.0) + float(score)
+
+        if allowed_ids is not None:
+            scores = {d: s for d, s in scores.items() if d in allowed_ids}
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+    # ---- персистентность --------------------------------------------------
+
+    def _append_journal(self, entry: Dict[str, Any]):
+        with open(self.journal_file, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._journal_entries += 1
+
+    def _restore(self):
+        """Загрузка снапшота и проигрывание журнала"""
+        if os.path.exists(self.snapshot_file):
+            with open(self.snapshot_file, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            self._postings = state["postings"]
+            self._doc_lengths = state["doc_lengths"]
+            self._total_length = state["total_length"]
+            self._doc_terms = {}
+            for term, postings in self._postings.items():
+                for doc_id in postings:
+                    self._doc_terms.setdefault(doc_id, []).append(term)
+
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Оборванная последняя запись после аварийного завершения
+                        break
+                    if entry["op"] == "add":
+                        for doc_id, text in zip(entry["ids"], entry["texts"]):
+                            self._apply_add(doc_id, text)
+                    else:
+                        for doc_id in entry["ids"]:
+                            self._apply_delete(doc_id)
+                    self._journal_entries += 1
+
+        self.logger.info(f"BM25 индекс загружен: {len(self._doc_lengths)} документов")
+
+    def compact(self, force: bool = False):
+        """Свертка журнала в снапшот"""
+        with self._lock:
+            if not self._journal_entries or (not force and self._journal_entries < self.compact_every):
+                return
+            tmp_file = self.snapshot_file + ".tmp"
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump({
+                    "postings": self._postings,
+                    "doc_lengths": self._doc_lengths,
+                    "total_length": self._total_length
+                }, f, ensure_ascii=False)
+            os.replace(tmp_file, self.snapshot_file)
+            open(self.journal_file, "w").close()
+            self._journal_entries = 0
+
+    def count(self) -> int:
+        with self._lock:
+            return len(self._doc_lengths)
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], weights: Optional[List[float]] = None, k: int = 60) -> List[Tuple[str, float]]:
+    """Векторизованное слияние ранжирований (RRF): score = sum(w / (k + rank))"""
+    weights = weights or [1.0] * len(rankings)
+    all_ids = list(dict.fromkeys(doc_id for ranking in rankings for doc_id in ranking))
+    if not all_ids:
+        return []
+
+    position = {doc_id: i for i, doc_id in enumerate(all_ids)}
+    # Матрица рангов: строки - ранжирования, столбцы - документы (inf - отсутствует)
+    ranks = np.full((len(rankings), len(all_ids)), np.inf)
+    for r, ranking in enumerate(rankings):
+        ranks[r, [position[doc_id] for doc_id in ranking]] = np.arange(1, len(ranking) + 1)
+
+    scores = (np.asarray(weights)[:, None] / (k + ranks)).sum(axis=0)
+    order = np.argsort(-scores, kind="stable")
+    return [(all_ids[i], float(scores[i])) for i in order]
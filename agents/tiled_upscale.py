@@ -0,0 +1,186 @@
+"""
+Тайловое увеличение изображений с ограниченной памятью
+
+Выход делится на полосы высотой tile_size, полоса - на тайлы. Каждый тайл
+ресемплируется из своего фрагмента исходника с перекрытием, покрывающим
+носитель фильтра (Image.resize с box), поэтому стыков нет. Тайлы полосы
+считаются в пуле потоков (PIL отпускает GIL при ресемплинге), готовые полосы
+сразу сжимаются в PNG, так что в памяти находятся только исходник и одна
+полоса выхода.
+
+Совпадение с ресемплингом целого изображения побитовое для целых масштабов
+(границы тайлов выравниваются на период отношения размеров, box фрагмента
+тогда целый) и для nearest при любом масштабе (индексы берутся из PIL). При
+дробном масштабе с фильтром коэффициенты тайла считаются от другого начала
+отсчета, и округление в фиксированной точке дает расхождение на единицу
+уровня; для RGBA оно усиливается делением на малую альфу.
+"""
+
+import functools
+import math
+import struct
+import zlib
+from concurrent.futures import Executor
+from fractions import Fraction
+from typing import Any, Dict, Tuple
+import numpy as np
+from PIL import Image
+
+
+RESAMPLING_FILTERS = {
+    "lanczos": Image.Resampling.LANCZOS,
+    "bicubic": Image.Resampling.BICUBIC,
+    "bilinear": Image.Resampling.BILINEAR,
+    "nearest": Image.Resampling.NEAREST
+}
+
+# Перекрытие в пикселях исходника: носитель Lanczos - 3 пикселя, плюс округление
+TILE_OVERLAP = 4
+
+MAX_SCALE_FACTOR = 8
+
+# Цветовой тип PNG и число каналов для поддерживаемых режимов
+PNG_COLOR_TYPES = {"L": (0, 1), "RGB": (2, 3), "RGBA": (6, 4)}
+
+
+def validate_upscale(scale_factor: Any, resample: str) -> float:
+    """Проверка параметров до загрузки изображения; ValueError с описанием"""
+    try:
+        scale = float(scale_factor)
+    except (TypeError, ValueError):
+        raise ValueError(f"scale_factor должен быть числом: {scale_factor!r}")
+    if not 1.0 < scale <= MAX_SCALE_FACTOR:
+        raise ValueError(f"scale_factor должен быть в диапазоне (1, {MAX_SCALE_FACTOR}]: {scale}")
+    if resample not in RESAMPLING_FILTERS:
+        raise ValueError(
+            f"Неизвестный фильтр {resample!r}, доступны: {', '.join(RESAMPLING_FILTERS)}"
+        )
+    return scale
+
+
+class StreamingPngWriter:
+    """Построчная запись PNG: полосы сжимаются и пишутся IDAT чанками по мере поступления"""
+
+    def __init__(self, path: str, width: int, height: int, mode: str, compress_level: int = 6):
+        color_type, self.channels = PNG_COLOR_TYPES[mode]
+        self.width = width
+        self.file = open(path, "wb")
+        self.compressor = zlib.compressobj(compress_level)
+        self.file.write(b"\x89PNG\r\n\x1a\n")
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0))
+
+    def _chunk(self, chunk_type: bytes, data: bytes):
+        self.file.write(struct.pack(">I", len(data)))
+        self.file.write(chunk_type + data)
+        self.file.write(struct.pack(">I", zlib.crc32(chunk_type + data) & 0xFFFFFFFF))
+
+    def write_rows(self, rows: np.ndarray):
+        """Строки формы (n, width, channels) uint8"""
+        rows = rows.reshape(rows.shape[0], self.width * self.channels)
+        # Фильтр Sub: разность с соседним пикселем слева, заметно лучше сжимается
+        filtered = rows.copy()
+        filtered[:, self.channels:] -= rows[:, :-self.channels]
+        data = np.empty((rows.shape[0], rows.shape[1] + 1), dtype=np.uint8)
+        data[:, 0] = 1
+        data[:, 1:] = filtered
+        compressed = self.compressor.compress(data.tobytes())
+        if compressed:
+            self._chunk(b"IDAT", compressed)
+
+    def close(self):
+        self._chunk(b"IDAT", self.compressor.flush())
+        self._chunk(b"IEND", b"")
+        self.file.close()
+
+
+def aligned_tile_size(tile_size: int, source_size: int, out_size: int) -> int:
+    """Размер тайла, кратный периоду отношения размеров (если период не больше тайла)
+
+    На границе, кратной периоду, координата исходника целая - box фрагмента
+    точный, и тайлы совпадают с ресемплингом целого изображения.
+    """
+    period = out_size // math.gcd(source_size, out_size)
+    return tile_size // period * period if period <= tile_size else tile_size
+
+
+def _resample_tile(source: Image.Image, out_box, out_size, resample) -> np.ndarray:
+    """Тайл выхода out_box = (x0, y0, x1, y1) из фрагмента исходника с перекрытием"""
+    x0, y0, x1, y1 = out_box
+    # Область тайла в координатах исходника - точные дроби, округляются только в box
+    scale_x = Fraction(source.width, out_size[0])
+    scale_y = Fraction(source.height, out_size[1])
+    sx0, sy0, sx1, sy1 = x0 * scale_x, y0 * scale_y, x1 * scale_x, y1 * scale_y
+    cx0 = max(0, math.floor(sx0) - TILE_OVERLAP)
+    cy0 = max(0, math.floor(sy0) - TILE_OVERLAP)
+    cx1 = min(source.width, math.ceil(sx1) + TILE_OVERLAP)
+    cy1 = min(source.height, math.ceil(sy1) + TILE_OVERLAP)
+    box = (float(sx0 - cx0), float(sy0 - cy0), float(sx1 - cx0), float(sy1 - cy0))
+    tile = source.crop((cx0, cy0, cx1, cy1)).resize((x1 - x0, y1 - y0), resample, box=box)
+    return np.asarray(tile)
+
+
+def _nearest_indices(source_size: int, out_size: int) -> np.ndarray:
+    """Индексы исходника для nearest - ресемплингом самой PIL строки индексов"""
+    indices = Image.fromarray(np.arange(source_size, dtype=np.int32)[None, :], "I")
+    return np.asarray(indices.resize((out_size, 1), Image.Resampling.NEAREST))[0]
+
+
+def _gather_tile(pixels: np.ndarray, out_box, indices: Tuple[np.ndarray, np.ndarray]) -> np.ndarray:
+    """Тайл nearest выборкой пикселей исходника"""
+    x0, y0, x1, y1 = out_box
+    index_x, index_y = indices
+    return pixels[np.ix_(index_y[y0:y1], index_x[x0:x1])]
+
+
+def upscale_to_png(
+    image_path: str,
+    output_path: str,
+    scale: float,
+    resample: str,
+    executor: Executor,
+    tile_size: int = 512
+) -> Dict[str, Any]:
+    """Тайловое увеличение с потоковой записью PNG (блокирующая функция для пула потоков)"""
+    with Image.open(image_path) as opened:
+        mode = opened.mode if opened.mode in PNG_COLOR_TYPES else (
+            "RGBA" if "A" in opened.getbands() or "transparency" in opened.info else "RGB"
+        )
+        source = opened.convert(mode)
+
+    original_size = source.size
+    out_size = (round(source.width * scale), round(source.height * scale))
+    channels = PNG_COLOR_TYPES[mode][1]
+    tile_width = aligned_tile_size(tile_size, source.width, out_size[0])
+    tile_height = aligned_tile_size(tile_size, source.height, out_size[1])
+
+    if resample == "nearest":
+        # Выборка по индексам PIL совпадает с Image.resize при любом масштабе
+        indices = (_nearest_indices(source.width, out_size[0]), _nearest_indices(source.height, out_size[1]))
+        tile_fn = functools.partial(_gather_tile, np.asarray(source), indices=indices)
+        source = None
+    else:
+        tile_fn = functools.partial(
+            _resample_tile, source, out_size=out_size, resample=RESAMPLING_FILTERS[resample]
+        )
+
+    writer = StreamingPngWriter(output_path, out_size[0], out_size[1], mode)
+    try:
+        for y0 in range(0, out_size[1], tile_height):
+            y1 = min(out_size[1], y0 + tile_height)
+            futures = [
+                executor.submit(tile_fn, (x0, y0, min(out_size[0], x0 + tile_width), y1))
+                for x0 in range(0, out_size[0], tile_width)
+            ]
+            strip = np.concatenate(
+                [f.result().reshape(y1 - y0, -1, channels) for f in futures], axis=1
+            )
+            writer.write_rows(strip)
+    finally:
+        writer.close()
+
+    return {
+        "original_size": original_size,
+        "new_size": out_size,
+        "mode": mode,
+        "tiles": math.ceil(out_size[0] / tile_width) * math.ceil(out_size[1] / tile_height)
+    }
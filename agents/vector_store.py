@@ -0,0 +1,935 @@
+"""
+Хранилища векторов для EmbeddingAgent
+
+VectorStore - общий интерфейс, повторяющий API коллекции ChromaDB
+(add / query / get / delete / count), поэтому код агента работает с любым бэкендом:
+- ChromaVectorStore - обертка над коллекцией ChromaDB
+- LocalVectorStore - локальный индекс: memory-mapped float32 векторы, IVF индекс
+  с инкрементальными вставками и tombstone-удалением, колоночные метаданные;
+  ID, документы и метаданные пишутся в append-only журнал при вставке, а
+  снапшот содержит только компактное состояние индекса (tombstones, IVF)
+
+AsyncVectorStore - неблокирующая обертка: все вызовы идут через ограниченный
+пул потоков с таймаутами и повторами, большие add разбиваются на чанки,
+которые отправляются конвейером.
+"""
+
+import asyncio
+import functools
+import json
+import logging
+import math
+import os
+import pickle
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence
+import numpy as np
+from . import vector_quantization as vq
+
+
+class VectorStore(ABC):
+    """Интерфейс хранилища векторов (совместим с API коллекции ChromaDB)"""
+
+    name: str = ""
+
+    @abstractmethod
+    def add(
+        self,
+        ids: List[str],
+        embeddings: Sequence[Sequence[float]],
+        documents: Optional[List[str]] = None,
+        metadatas: Optional[List[Dict[str, Any]]] = None
+    ):
+        """Добавление векторов"""
+
+    @abstractmethod
+    def query(
+        self,
+        query_embeddings: Sequence[Sequence[float]],
+        n_results: int = 10,
+        where: Optional[Dict[str, Any]] = None,
+        include: Optional[List[str]] = None
+    ) -> Dict[str, Any]:
+        """Поиск ближайших соседей для каждого запроса"""
+
+    @abstractmethod
+    def get(
+        self,
+        ids: Optional[List[str]] = None,
+        where: Optional[Dict[str, Any]] = None,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+        include: Optional[List[str]] = None
+    ) -> Dict[str, Any]:
+        """Получение записей по ID или фильтру"""
+
+    @abstractmethod
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None):
+        """Удаление записей"""
+
+    @abstractmethod
+    def count(self) -> int:
+        """Количество записей"""
+
+    def scan(
+        self,
+        where: Optional[Dict[str, Any]] = None,
+        cursor: Optional[Any] = None,
+        limit: int = 1024,
+        include_documents: bool = False
+    ) -> Dict[str, Any]:
+        """Страница записей с векторами для потокового экспорта
+
+        Возвращает ids, embeddings (np.ndarray), metadatas, documents и cursor
+        для следующей страницы (None - записи закончились). Базовая реализация
+        использует offset-пагинацию get(): ChromaDB не поддерживает keyset.
+        """
+        offset = cursor or 0
+        include = ["embeddings", "metadatas"] + (["documents"] if include_documents else [])
+        page = self.get(where=where, limit=limit, offset=offset, include=include)
+        ids = page["ids"]
+        return {
+            "ids": ids,
+            "embeddings": np.asarray(page["embeddings"] if ids else [], dtype=np.float32),
+            "metadatas": page["metadatas"],
+            "documents": page.get("documents") if include_documents else None,
+            "cursor": offset + len(ids) if len(ids) == limit else None
+        }
+
+    def snapshot(self):
+        """Сохранение состояния (для бэкендов с локальным состоянием)"""
+
+    def close(self):
+        """Освобождение ресурсов"""
+
+
+class ChromaVectorStore(VectorStore):
+    """Хранилище на базе коллекции ChromaDB"""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.name = collection.name
+
+    def add(self, ids, embeddings, documents=None, metadatas=None):
+        self.collection.add(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    def query(self, query_embeddings, n_results=10, where=None, include=None):
+        kwargs = {"query_embeddings": query_embeddings, "n_results": n_results, "where": where}
+        if include is not None:
+            kwargs["include"] = include
+        return self.collection.query(**kwargs)
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=None):
+        kwargs = {"ids": ids, "where": where, "limit": limit, "offset": offset}
+        if include is not None:
+            kwargs["include"] = include
+        return self.collection.get(**kwargs)
+
+    def delete(self, ids=None, where=None):
+        if ids is None and not where:
+            raise ValueError("Для удаления нужно указать ids или where")
+        self.collection.delete(ids=ids, where=where)
+
+    def count(self) -> int:
+        return self.collection.count()
+
+
+class _Column:
+    """Колонка метаданных: объектные значения + числовое представление для диапазонов"""
+
+    def __init__(self, capacity: int):
+        self.values = np.full(capacity, None, dtype=object)
+        self.numbers = np.full(capacity, np.nan, dtype=np.float64)
+
+    def grow(self, capacity: int):
+        values = np.full(capacity, None, dtype=object)
+        numbers = np.full(capacity, np.nan, dtype=np.float64)
+        values[:len(self.values)] = self.values
+        numbers[:len(self.numbers)] = self.numbers
+        self.values, self.numbers = values, numbers
+
+    def set(self, row: int, value: Any):
+        self.values[row] = value
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            self.numbers[row] = value
+
+
+class LocalVectorStore(VectorStore):
+    """Локальный memory-mapped IVF индекс с косинусной метрикой
+
+    При quantization="int8" или "binary" рядом с float32 векторами хранятся
+    компактные коды: первый проход поиска идет по кодам, а rescore_factor * k
+    лучших кандидатов пересчитываются по точным векторам.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        name: str,
+        dimension: int,
+        nprobe: int = 8,
+        train_threshold: int = 4096,
+        initial_capacity: int = 4096,
+        quantization: Optional[str] = None,
+        rescore_factor: int = 4
+    ):
+        if quantization and quantization not in vq.QUANTIZATION_MODES:
+            raise ValueError(f"Неизвестный режим квантизации: {quantization}")
+
+        self.path = os.path.join(path, name)
+        self.name = name
+        self.dimension = dimension
+        self.nprobe = nprobe
+        self.train_threshold = train_threshold
+        self.initial_capacity = initial_capacity
+        self.quantization = quantization or None
+        self.rescore_factor = max(1, rescore_factor)
+        self.logger = logging.getLogger("agent.embedding_agent.vector_store")
+        self._lock = threading.RLock()
+
+        self.vectors_file = os.path.join(self.path, "vectors.f32")
+        self.snapshot_file = os.path.join(self.path, "snapshot.pkl")
+        # Строка на запись в порядке строк файла векторов; удаления - номерами строк
+        self.rows_journal_file = os.path.join(self.path, "rows.jsonl")
+        self.deletes_journal_file = os.path.join(self.path, "deletes.jsonl")
+        self.codes_file = os.path.join(self.path, f"codes.{self.quantization}")
+        self.scales_file = os.path.join(self.path, "scales.f32")
+
+        self._rows = 0
+        self._capacity = 0
+        self._vectors: Optional[np.memmap] = None
+        self._codes: Optional[np.memmap] = None
+        self._scales: Optional[np.memmap] = None
+        self._ids: List[str] = []
+        self._documents: List[Optional[str]] = []
+        self._metadatas: List[Dict[str, Any]] = []
+        self._row_by_id: Dict[str, int] = {}
+        self._deleted = np.zeros(0, dtype=bool)
+        self._columns: Dict[str, _Column] = {}
+
+        # IVF: центроиды, номер списка для каждой строки и инвертированные списки
+        self._centroids: Optional[np.ndarray] = None
+        self._assignments = np.zeros(0, dtype=np.int32)
+        self._lists: List[List[int]] = []
+        self._list_arrays: Dict[int, np.ndarray] = {}
+        self._trained_rows = 0
+
+        self._dirty = False
+        self._rows_journal = None
+
+        os.makedirs(self.path, exist_ok=True)
+        self._restore()
+        self._rows_journal = open(self.rows_journal_file, "a", encoding="utf-8")
+
+    # ---- хранение -------------------------------------------------------
+
+    @staticmethod
+    def _open_memmap(filename: str, dtype, capacity: int, width: int) -> np.memmap:
+        """Отображение файла с расширением до нужной емкости"""
+        row_bytes = np.dtype(dtype).itemsize * width
+        with open(filename, "ab") as f:
+            if f.tell() < capacity * row_bytes:
+                f.truncate(capacity * row_bytes)
+        return np.memmap(filename, dtype=dtype, mode="r+", shape=(capacity, width))
+
+    def _map(self, capacity: int):
+        """(Пере)отображение файлов векторов и расширение служебных массивов"""
+        self._flush()
+        self._vectors = self._open_memmap(self.vectors_file, np.float32, capacity, self.dimension)
+        if self.quantization:
+            self._codes = self._open_memmap(
+                self.codes_file, np.uint8, capacity, vq.code_width(self.quantization, self.dimension)
+            )
+            self._scales = self._open_memmap(self.scales_file, np.float32, capacity, 1)
+
+        deleted = np.ones(capacity, dtype=bool)
+        deleted[:len(self._deleted)] = self._deleted
+        self._deleted = deleted
+
+        assignments = np.full(capacity, -1, dtype=np.int32)
+        assignments[:len(self._assignments)] = self._assignments
+        self._assignments = assignments
+
+        for column in self._columns.values():
+            column.grow(capacity)
+
+        self._capacity = capacity
+
+    def _flush(self):
+        for mapped in (self._vectors, self._codes, self._scales):
+            if mapped is not None:
+                mapped.flush()
+        self._vectors = self._codes = self._scales = None
+
+    def _ensure_capacity(self, needed: int):
+        if needed <= self._capacity:
+            return
+        capacity = max(self._capacity, 1024)
+        while capacity < needed:
+            capacity *= 2
+        self._map(capacity)
+
+    @staticmethod
+    def _read_journal(filename: str) -> List[Any]:
+        """Записи журнала; оборванный хвост отрезается, чтобы дозапись шла с новой строки"""
+        entries = []
+        if not os.path.exists(filename):
+            return entries
+        valid_bytes = 0
+        with open(filename, "rb") as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("incomplete line")
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # Оборванная последняя запись после аварийного завершения
+                    break
+                valid_bytes += len(line)
+            f.seek(0, os.SEEK_END)
+            torn = f.tell() > valid_bytes
+        if torn:
+            with open(filename, "r+b") as f:
+                f.truncate(valid_bytes)
+        return entries
+
+    def _write_rows_journal(self, records: List[Any]):
+        tmp_file = self.rows_journal_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        os.replace(tmp_file, self.rows_journal_file)
+
+    def _restore(self):
+        """Восстановление из снапшота и журналов (теплый старт без перестроения индекса)
+
+        Строки, дописанные после снапшота, берутся из журнала: их векторы уже
+        в memory-mapped файле, списки IVF назначаются по сохраненным центроидам.
+        """
+        state = None
+        if os.path.exists(self.snapshot_file):
+            try:
+                with open(self.snapshot_file, "rb") as f:
+                    state = pickle.load(f)
+            except Exception as e:
+                self.logger.error(f"Ошибка чтения снапшота {self.snapshot_file}: {e}")
+
+        if state and state.get("dimension") != self.dimension:
+            self.logger.warning(f"Размерность индекса {self.name} изменилась, индекс создается заново")
+            state = None
+            for filename in (self.rows_journal_file, self.deletes_journal_file):
+                if os.path.exists(filename):
+                    os.remove(filename)
+
+        records = self._read_journal(self.rows_journal_file)
+        if state and "ids" in state and not records:
+            # Снапшот прежнего формата хранил записи целиком - перенос в журнал
+            records = [
+                [id_, document, metadata]
+                for id_, document, metadata in zip(state["ids"], state["documents"], state["metadatas"])
+            ]
+            self._write_rows_journal(records)
+
+        if not records:
+            self._map(self.initial_capacity)
+            return
+
+        rows = len(records)
+        snapshot_rows = min(state["rows"], rows) if state else 0
+        if state:
+            self._deleted = state["deleted"][:snapshot_rows]
+            self._assignments = state["assignments"][:snapshot_rows]
+            self._centroids = state["centroids"]
+            self._trained_rows = state["trained_rows"]
+        self._rows = rows
+        self._map(max(rows, self.initial_capacity))
+
+        # Строки после снапшота живы, пока журнал удалений не скажет иного
+        self._deleted[snapshot_rows:rows] = False
+        if self._centroids is not None and rows > snapshot_rows:
+            for start in range(snapshot_rows, rows, 65536):
+                end = min(start + 65536, rows)
+                self._assignments[start:end] = np.argmax(
+                    np.asarray(self._vectors[start:end]) @ self._centroids.T, axis=1
+                )
+
+        self._columns = {}
+        for row, (id_, document, metadata) in enumerate(records):
+            self._ids.append(id_)
+            self._documents.append(document)
+            self._metadatas.append(metadata or {})
+            for key, value in (metadata or {}).items():
+                column = self._columns.get(key)
+                if column is None:
+                    column = self._columns[key] = _Column(self._capacity)
+                column.set(row, value)
+
+        for entry in self._read_journal(self.deletes_journal_file):
+            deleted_rows = [row for row in entry if row < rows]
+            self._deleted[deleted_rows] = True
+
+        self._row_by_id = {
+            id_: row for row, id_ in enumerate(self._ids) if not self._deleted[row]
+        }
+        self._rebuild_lists()
+        if self.quantization and (not state or state.get("quantization") != self.quantization):
+            self._rebuild_codes()
+        if rows > snapshot_rows:
+            self._dirty = True
+        self.logger.info(f"Локальный индекс {self.name} восстановлен: {len(self._row_by_id)} записей")
+
+    def snapshot(self):
+        """Атомарная запись компактного состояния; записи уже в журнале"""
+        with self._lock:
+            if not self._dirty:
+                return
+            for mapped in (self._vectors, self._codes, self._scales):
+                if mapped is not None:
+                    mapped.flush()
+            if self._rows_journal is not None:
+                self._rows_journal.flush()
+            state = {
+                "dimension": self.dimension,
+                "quantization": self.quantization,
+                "rows": self._rows,
+                "deleted": self._deleted[:self._rows].copy(),
+                "assignments": self._assignments[:self._rows].copy(),
+                "centroids": self._centroids,
+                "trained_rows": self._trained_rows
+            }
+            tmp_file = self.snapshot_file + ".tmp"
+            with open(tmp_file, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, self.snapshot_file)
+            # Удаления вошли в снапшот; повторное применение журнала безопасно
+            open(self.deletes_journal_file, "w").close()
+            self._dirty = False
+
+    def close(self):
+        with self._lock:
+            self.snapshot()
+            self._flush()
+            if self._rows_journal is not None:
+                self._rows_journal.close()
+                self._rows_journal = None
+
+    def _rebuild_codes(self):
+        """Построение кодов для строк, сохраненных без квантизации"""
+        for start in range(0, self._rows, 65536):
+            end = min(start + 65536, self._rows)
+            codes, scales = vq.encode(self.quantization, np.asarray(self._vectors[start:end]))
+            self._codes[start:end] = codes
+            self._scales[start:end, 0] = scales
+        self._dirty = True
+        self.logger.info(f"Коды {self.quantization} построены для {self._rows} векторов")
+
+    # ---- IVF индекс -----------------------------------------------------
+
+    def _rebuild_lists(self):
+        """Построение инвертированных списков по назначениям строк"""
+        self._list_arrays = {}
+        if self._centroids is None:
+            self._lists = []
+            return
+        live = np.flatnonzero(~self._deleted[:self._rows])
+        assignments = self._assignments[live]
+        order = np.argsort(assignments, kind="stable")
+        bounds = np.searchsorted(assignments[order], np.arange(len(self._centroids) + 1))
+        self._lists = [
+            live[order[bounds[i]:bounds[i + 1]]].tolist() for i in range(len(self._centroids))
+        ]
+
+    def _train(self):
+        """Обучение центроидов (сферический k-means) и переназначение строк"""
+        live = np.flatnonzero(~self._deleted[:self._rows])
+        nlist = int(min(4096, max(16, 4 * math.sqrt(len(live)))))
+        rng = np.random.default_rng(42)
+        sample_rows = np.sort(rng.choice(live, size=min(len(live), nlist * 64), replace=False))
+        sample = np.asarray(self._vectors[sample_rows])
+        nlist = min(nlist, len(sample))
+
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(10):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            empty = norms[:, 0] == 0
+            sums[empty] = centroids[empty]
+            norms[empty] = 1.0
+            centroids = sums / norms
+
+        self._centroids = centroids.astype(np.float32)
+        for start in range(0, self._rows, 65536):
+            end = min(start + 65536, self._rows)
+            self._assignments[start:end] = np.argmax(
+                np.asarray(self._vectors[start:end]) @ self._centroids.T, axis=1
+            )
+        self._trained_rows = len(live)
+        self._rebuild_lists()
+        self.logger.info(f"IVF индекс {self.name} обучен: {nlist} списков на {len(live)} векторах")
+
+    def _list_array(self, list_id: int) -> np.ndarray:
+        array = self._list_arrays.get(list_id)
+        if array is None:
+            array = np.asarray(self._lists[list_id], dtype=np.int64)
+            self._list_arrays[list_id] = array
+        return array
+
+    # ---- фильтры метаданных ----------------------------------------------
+
+    def _where_mask(self, where: Optional[Dict[str, Any]], start: int = 0, stop: Optional[int] = None) -> np.ndarray:
+        """Векторная оценка фильтра в формате ChromaDB на колоночных массивах
+
+        start/stop ограничивают оценку диапазоном строк (для постраничного обхода).
+        """
+        stop = self._rows if stop is None else min(stop, self._rows)
+        n = max(0, stop - start)
+        if not where:
+            return np.ones(n, dtype=bool)
+
+        mask = np.ones(n, dtype=bool)
+        for key, condition in where.items():
+            if key == "$and":
+                for sub in condition:
+                    mask &= self._where_mask(sub, start, stop)
+            elif key == "$or":
+                any_mask = np.zeros(n, dtype=bool)
+                for sub in condition:
+                    any_mask |= self._where_mask(sub, start, stop)
+                mask &= any_mask
+            else:
+                mask &= self._condition_mask(key, condition, start, stop)
+        return mask
+
+    def _condition_mask(self, key: str, condition: Any, start: int, stop: int) -> np.ndarray:
+        n = max(0, stop - start)
+        column = self._columns.get(key)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+
+        mask = np.ones(n, dtype=bool)
+        for op, value in condition.items():
+            if column is None:
+                if op in ("$ne", "$nin"):
+                    continue
+                return np.zeros(n, dtype=bool)
+
+            values = column.values[start:stop]
+            numbers = column.numbers[start:stop]
+            numeric = isinstance(value, (int, float)) and not isinstance(value, bool)
+
+            if op == "$eq":
+                mask &= (numbers == value) if numeric else (values == value)
+            elif op == "$ne":
+                mask &= (numbers != value) if numeric else (values != value)
+            elif op == "$gt":
+                mask &= numbers > value
+            elif op == "$gte":
+                mask &= numbers >= value
+            elif op == "$lt":
+                mask &= numbers < value
+            elif op == "$lte":
+                mask &= numbers <= value
+            elif op == "$in":
+                mask &= np.isin(values, list(value))
+            elif op == "$nin":
+                mask &= ~np.isin(values, list(value))
+            else:
+                raise ValueError(f"Неподдерживаемый оператор фильтра: {op}")
+        return mask
+
+    # ---- API коллекции ----------------------------------------------------
+
+    def add(self, ids, embeddings, documents=None, metadatas=None):
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.ndim != 2 or vectors.shape[1] != self.dimension:
+            raise ValueError(f"Ожидались векторы размерности {self.dimension}")
+        if len(ids) != len(vectors):
+            raise ValueError("Количество ID и векторов не совпадает")
+
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.maximum(norms, 1e-12)
+        documents = documents or [None] * len(ids)
+        metadatas = metadatas or [{} for _ in ids]
+        # Сериализация до изменения состояния: ошибка не оставит полузаписанный батч
+        journal = "".join(
+            json.dumps([id_, document, metadata or {}], ensure_ascii=False) + "\n"
+            for id_, document, metadata in zip(ids, documents, metadatas)
+        )
+
+        with self._lock:
+            duplicates = [id_ for id_ in ids if id_ in self._row_by_id]
+            if duplicates:
+                raise ValueError(f"ID уже существуют: {duplicates[:5]}")
+
+            start = self._rows
+            end = start + len(ids)
+            self._ensure_capacity(end)
+
+            self._vectors[start:end] = vectors
+            if self.quantization:
+                codes, scales = vq.encode(self.quantization, vectors)
+                self._codes[start:end] = codes
+                self._scales[start:end, 0] = scales
+            self._deleted[start:end] = False
+            # Векторы уже в файле - строка журнала делает запись восстанавливаемой
+            self._rows_journal.write(journal)
+            self._rows_journal.flush()
+            for offset, (id_, document, metadata) in enumerate(zip(ids, documents, metadatas)):
+                row = start + offset
+                self._ids.append(id_)
+                self._documents.append(document)
+                self._metadatas.append(metadata or {})
+                self._row_by_id[id_] = row
+                for key, value in (metadata or {}).items():
+                    column = self._columns.get(key)
+                    if column is None:
+                        column = self._columns[key] = _Column(self._capacity)
+                    column.set(row, value)
+            self._rows = end
+
+            if self._centroids is None:
+                if len(self._row_by_id) >= self.train_threshold:
+                    self._train()
+            elif len(self._row_by_id) > 4 * self._trained_rows:
+                self._train()
+            else:
+                # Инкрементальная вставка в ближайшие списки
+                labels = np.argmax(vectors @ self._centroids.T, axis=1)
+                self._assignments[start:end] = labels
+                for row, label in zip(range(start, end), labels):
+                    self._lists[label].append(row)
+                    self._list_arrays.pop(int(label), None)
+
+            self._dirty = True
+
+    def query(self, query_embeddings, n_results=10, where=None, include=None):
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries[None, :]
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        include = include or ["documents", "metadatas", "distances"]
+
+        with self._lock:
+            allowed = ~self._deleted[:self._rows] & self._where_mask(where)
+
+            if self._centroids is not None:
+                probes = np.argsort(-(queries @ self._centroids.T), axis=1)[:, :self.nprobe]
+
+            result = {"ids": [], "distances": [], "documents": [], "metadatas": [], "embeddings": None}
+            for qi, query in enumerate(queries):
+                if self._centroids is not None:
+                    candidates = np.concatenate([self._list_array(int(l)) for l in probes[qi]])
+                    candidates = candidates[allowed[candidates]]
+                    if len(candidates) < n_results:
+                        # Слишком строгий фильтр для выбранных списков - точный поиск
+                        candidates = np.flatnonzero(allowed)
+                else:
+                    candidates = np.flatnonzero(allowed)
+
+                rows, scores = self._top_k(query, np.sort(candidates), n_results)
+                result["ids"].append([self._ids[r] for r in rows])
+                result["distances"].append((1.0 - scores).tolist())
+                result["documents"].append([self._documents[r] for r in rows])
+                result["metadatas"].append([self._metadatas[r] for r in rows])
+
+        return {key: (value if key in include or key == "ids" else None) for key, value in result.items()}
+
+    def _top_k(self, query: np.ndarray, candidates: np.ndarray, k: int, exact: bool = False):
+        """Скоринг кандидатов и выбор top-k (с первым проходом по кодам при квантизации)"""
+        return self._score_top_k(self._vectors, self._codes, self._scales, query, candidates, k, exact)
+
+    def _score_top_k(self, vectors: np.ndarray, codes: Optional[np.ndarray], scales: Optional[np.ndarray],
+                     query: np.ndarray, candidates: np.ndarray, k: int, exact: bool = False):
+        """Top-k по явно переданным массивам (их можно захватить под блокировкой)"""
+        if len(candidates) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        shortlist = k * self.rescore_factor
+        if self.quantization and not exact and len(candidates) > shortlist:
+            approx = np.empty(len(candidates), dtype=np.float32)
+            for start in range(0, len(candidates), 65536):
+                chunk = candidates[start:start + 65536]
+                approx[start:start + len(chunk)] = vq.approximate_scores(
+                    self.quantization, query, codes[chunk], scales[chunk, 0]
+                )
+            best = np.argpartition(-approx, shortlist - 1)[:shortlist]
+            candidates = np.sort(candidates[best])
+
+        scores = np.empty(len(candidates), dtype=np.float32)
+        for start in range(0, len(candidates), 65536):
+            chunk = candidates[start:start + 65536]
+            scores[start:start + len(chunk)] = vectors[chunk] @ query
+
+        k = min(k, len(candidates))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return candidates[top], scores[top]
+
+    def benchmark_quantization(self, num_queries: int = 100, k: int = 10) -> Dict[str, Any]:
+        """Recall@k и задержка квантизованного поиска относительно точного float32"""
+        if not self.quantization:
+            raise ValueError("Квантизация не включена для этого индекса")
+
+        # Под блокировкой только снимок живых строк и ссылки на отображения: строки
+        # не переписываются (удаление - tombstone), а прежнее отображение остается
+        # валидным после расширения файла, поэтому замер не блокирует вставки и поиск
+        with self._lock:
+            live = np.flatnonzero(~self._deleted[:self._rows])
+            vectors, codes, scales = self._vectors, self._codes, self._scales
+        if len(live) <= k:
+            raise ValueError("Недостаточно векторов для оценки")
+
+        rng = np.random.default_rng(0)
+        query_rows = rng.choice(live, size=min(num_queries, len(live)), replace=False)
+        # Шум, чтобы запрос не совпадал с вектором из индекса
+        queries = np.asarray(vectors[query_rows]) + rng.normal(
+            scale=0.05, size=(len(query_rows), self.dimension)
+        ).astype(np.float32)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+        float_seconds = 0.0
+        quantized_seconds = 0.0
+        recalls = []
+        for query in queries:
+            started = time.perf_counter()
+            exact_rows, _ = self._score_top_k(vectors, codes, scales, query, live, k, exact=True)
+            float_seconds += time.perf_counter() - started
+
+            started = time.perf_counter()
+            approx_rows, _ = self._score_top_k(vectors, codes, scales, query, live, k)
+            quantized_seconds += time.perf_counter() - started
+
+            recalls.append(len(np.intersect1d(exact_rows, approx_rows)) / len(exact_rows))
+
+        code_bytes = vq.code_width(self.quantization, self.dimension)
+        return {
+            "quantization": self.quantization,
+            "vectors": int(len(live)),
+            "queries": int(len(queries)),
+            "k": k,
+            "rescore_factor": self.rescore_factor,
+            f"recall_at_{k}": float(np.mean(recalls)),
+            "float_latency_ms": float_seconds / len(queries) * 1000.0,
+            "quantized_latency_ms": quantized_seconds / len(queries) * 1000.0,
+            "bytes_per_vector_float": self.dimension * 4,
+            "bytes_per_vector_code": code_bytes
+        }
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=None):
+        # include=[] - только идентификаторы, как в Chroma
+        include = ["documents", "metadatas"] if include is None else include
+        with self._lock:
+            if ids is not None:
+                rows = [self._row_by_id[id_] for id_ in ids if id_ in self._row_by_id]
+                if where:
+                    mask = self._where_mask(where)
+                    rows = [row for row in rows if mask[row]]
+            else:
+                rows = np.flatnonzero(~self._deleted[:self._rows] & self._where_mask(where)).tolist()
+
+            start = offset or 0
+            rows = rows[start:start + limit] if limit is not None else rows[start:]
+
+            return {
+                "ids": [self._ids[r] for r in rows],
+                "documents": [self._documents[r] for r in rows] if "documents" in include else None,
+                "metadatas": [self._metadatas[r] for r in rows] if "metadatas" in include else None,
+                "embeddings": (
+                    np.asarray(self._vectors[np.asarray(rows, dtype=np.int64)]).tolist()
+                    if "embeddings" in include else None
+                )
+            }
+
+    def scan(self, where=None, cursor=None, limit=1024, include_documents=False):
+        """Keyset-пагинация по номеру строки: строки только дописываются,
+        поэтому курсор (последняя выданная строка) стабилен между страницами,
+        а фильтр оценивается только на просматриваемом диапазоне."""
+        with self._lock:
+            start = 0 if cursor is None else cursor + 1
+            window = max(limit, 4096)
+            found: List[np.ndarray] = []
+            collected = 0
+            while start < self._rows and collected < limit:
+                stop = min(start + window, self._rows)
+                live = ~self._deleted[start:stop] & self._where_mask(where, start, stop)
+                rows = np.flatnonzero(live)[:limit - collected] + start
+                found.append(rows)
+                collected += len(rows)
+                start = stop
+            rows = np.concatenate(found) if found else np.zeros(0, dtype=np.int64)
+
+            return {
+                "ids": [self._ids[r] for r in rows],
+                # Копия страницы: файл может быть переотображен после снятия блокировки
+                "embeddings": (
+                    np.array(self._vectors[rows]) if len(rows)
+                    else np.zeros((0, self.dimension), dtype=np.float32)
+                ),
+                "metadatas": [self._metadatas[r] for r in rows],
+                "documents": [self._documents[r] for r in rows] if include_documents else None,
+                "cursor": int(rows[-1]) if collected >= limit else None
+            }
+
+    def delete(self, ids=None, where=None):
+        # Как и в ChromaDB, пустой запрос не означает "удалить все"
+        if ids is None and not where:
+            raise ValueError("Для удаления нужно указать ids или where")
+        with self._lock:
+            if ids is not None:
+                rows = [self._row_by_id[id_] for id_ in ids if id_ in self._row_by_id]
+                if where:
+                    mask = self._where_mask(where)
+                    rows = [row for row in rows if mask[row]]
+            else:
+                rows = np.flatnonzero(~self._deleted[:self._rows] & self._where_mask(where)).tolist()
+
+            if not rows:
+                return
+            with open(self.deletes_journal_file, "a", encoding="utf-8") as f:
+                f.write(json.dumps([int(row) for row in rows]) + "\n")
+            for row in rows:
+                # Tombstone: строка остается в файле и списках IVF, но исключается из поиска
+                self._deleted[row] = True
+                self._row_by_id.pop(self._ids[row], None)
+            self._dirty = True
+
+    def count(self) -> int:
+        with self._lock:
+            return len(self._row_by_id)
+
+
+class AsyncVectorStore:
+    """Неблокирующий доступ к VectorStore из async-обработчиков"""
+
+    # Ошибки данных не исправятся повтором
+    NON_RETRYABLE = (ValueError, TypeError, KeyError)
+    # Повторяются только чтения: поток, по которому истек таймаут, все равно завершит
+    # запись, и повтор add/delete продублирует ее (или упадет на уже существующих ID)
+    RETRYABLE_METHODS = frozenset({"query", "get", "count", "scan"})
+
+    def __init__(
+        self,
+        store: VectorStore,
+        max_workers: int = 4,
+        timeout: float = 30.0,
+        retries: int = 2,
+        retry_delay: float = 0.5,
+        add_batch_size: int = 512,
+        max_inflight_adds: int = 4,
+        queries_per_call: int = 16,
+        executor: Optional[ThreadPoolExecutor] = None
+    ):
+        self.store = store
+        self.name = store.name
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.add_batch_size = add_batch_size
+        self.max_inflight_adds = max(1, min(max_inflight_adds, max_workers))
+        self.queries_per_call = max(1, queries_per_call)
+        # Общий пул (например, для коллекций пространств имен) не закрывается здесь
+        self._owns_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=f"vector_store_{store.name}"
+        )
+        self.logger = logging.getLogger("agent.embedding_agent.vector_store")
+
+    async def _call(self, method: str, *args, **kwargs):
+        """Вызов метода хранилища в пуле потоков с таймаутом и повторами (только для чтений)"""
+        loop = asyncio.get_running_loop()
+        call = functools.partial(getattr(self.store, method), *args, **kwargs)
+        retries = self.retries if method in self.RETRYABLE_METHODS else 0
+
+        for attempt in range(retries + 1):
+            try:
+                # По таймауту ожидание прекращается, но поток завершит вызов сам
+                return await asyncio.wait_for(
+                    loop.run_in_executor(self.executor, call), self.timeout
+                )
+            except self.NON_RETRYABLE:
+                raise
+            except Exception as e:
+                if attempt >= retries:
+                    raise
+                delay = self.retry_delay * (2 ** attempt)
+                self.logger.warning(
+                    f"Ошибка {method} в хранилище {self.name} ({e}), повтор через {delay:.1f}с"
+                )
+                await asyncio.sleep(delay)
+
+    async def add(self, ids, embeddings, documents=None, metadatas=None):
+        """Конвейерная запись чанками: до max_inflight_adds чанков одновременно"""
+        inflight = asyncio.Semaphore(self.max_inflight_adds)
+
+        async def add_chunk(start: int):
+            end = start + self.add_batch_size
+            async with inflight:
+                await self._call(
+                    "add",
+                    ids=ids[start:end],
+                    embeddings=embeddings[start:end],
+                    documents=documents[start:end] if documents is not None else None,
+                    metadatas=metadatas[start:end] if metadatas is not None else None
+                )
+
+        await asyncio.gather(*[
+            add_chunk(start) for start in range(0, len(ids), self.add_batch_size)
+        ])
+
+    async def query(self, query_embeddings, n_results=10, where=None, include=None) -> Dict[str, Any]:
+        """Поиск; большие наборы запросов делятся на параллельные вызовы"""
+        groups = [
+            query_embeddings[start:start + self.queries_per_call]
+            for start in range(0, len(query_embeddings), self.queries_per_call)
+        ]
+        kwargs = {"n_results": n_results, "where": where}
+        if include is not None:
+            kwargs["include"] = include
+
+        if len(groups) == 1:
+            return await self._call("query", query_embeddings=groups[0], **kwargs)
+
+        partial_results = await asyncio.gather(*[
+            self._call("query", query_embeddings=group, **kwargs) for group in groups
+        ])
+        merged: Dict[str, Any] = {}
+        for result in partial_results:
+            for key, value in result.items():
+                if isinstance(value, list):
+                    merged.setdefault(key, []).extend(value)
+                else:
+                    merged.setdefault(key, value)
+        return merged
+
+    async def get(self, **kwargs) -> Dict[str, Any]:
+        return await self._call("get", **kwargs)
+
+    async def delete(self, **kwargs):
+        return await self._call("delete", **kwargs)
+
+    async def count(self) -> int:
+        return await self._call("count")
+
+    async def scan(self, **kwargs) -> Dict[str, Any]:
+        return await self._call("scan", **kwargs)
+
+    async def snapshot(self):
+        return await self._call("snapshot")
+
+    async def benchmark_quantization(self, **kwargs) -> Dict[str, Any]:
+        if not hasattr(self.store, "benchmark_quantization"):
+            raise ValueError(f"Бэкенд {type(self.store).__name__} не поддерживает квантизацию")
+        return await self._call("benchmark_quantization", **kwargs)
+
+    async def close(self):
+        """Сохранение состояния и остановка пула"""
+        try:
+            await self._call("close")
+        finally:
+            if self._owns_executor:
+                self.executor.shutdown(wait=False)
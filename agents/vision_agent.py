@@ -10,8 +10,8 @@ from datetime import datetime
 import torch
 from transformers import Blip2Processor, Blip2ForConditionalGeneration
 from PIL import Image
-import requests
 from .base_agent import BaseAgent, Task
+from .image_loader import AsyncImageLoader, ImageLoadError
 
 
 class VisionAgent(BaseAgent):
@@ -24,11 +24,21 @@ class VisionAgent(BaseAgent):
         self.processor: Optional[Blip2Processor] = None
         self.model: Optional[Blip2ForConditionalGeneration] = None
         self.device = "cpu"  # CPU-only
+        # Потоковая загрузка с лимитами и LRU декодированных изображений
+        self.image_loader_config = config.get('image_loader', {})
+        self.image_loader: Optional[AsyncImageLoader] = None
         
     async def _initialize_agent(self):
         """Инициализация VisionAgent"""
         self.logger.info("Инициализация VisionAgent")
         
+        self.image_loader = AsyncImageLoader(
+            self.http_session,
+            max_bytes=self.image_loader_config.get('max_mb', 20) * 1024 * 1024,
+            timeout=self.image_loader_config.get('timeout', 30.0),
+            cache_items=self.image_loader_config.get('cache_items', 32)
+        )
+        
         # Загрузка модели BLIP2
         await self._load_model()
         
@@ -296,18 +306,15 @@ class VisionAgent(BaseAgent):
             return {"status": "error", "error": str(e)}
     
     async def _load_image(self, image_path: str = None, image_url: str = None) -> Optional[Image.Image]:
-        """Загрузка изображения"""
+        """Загрузка изображения (локальный файл имеет приоритет над URL)"""
         try:
-            if image_path and os.path.exists(image_path):
-                return Image.open(image_path)
-            elif image_url:
-                response = requests.get(image_url)
-                if response.status_code == 200:
-                    return Image.open(requests.get(image_url, stream=True).raw)
-            else:
-                self.logger.error("Не указан путь или URL изображения")
-                return None
+            if image_path and not os.path.exists(image_path):
+                image_path = None
+            return await self.image_loader.load(image_path=image_path, image_url=image_url)
                 
+        except ImageLoadError as e:
+            self.logger.error(f"Ошибка загрузки изображения: {e}")
+            return None
         except Exception as e:
             self.logger.error(f"Ошибка загрузки изображения: {e}")
             return None
@@ -337,6 +344,7 @@ class VisionAgent(BaseAgent):
             "status": "healthy" if self.model is not None else "error",
             "model_loaded": self.model is not None,
             "processor_loaded": self.processor is not None,
-            "device": self.device
+            "device": self.device,
+            "image_loader": self.image_loader.get_stats() if self.image_loader else {}
         }
 
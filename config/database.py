@@ -79,6 +79,44 @@ CREATE TABLE IF NOT EXISTS generated_images (
     FOREIGN KEY (task_id) REFERENCES tasks(id)
 );
 
+-- Контентно-адресуемый кэш изображений (ссылки из generated_images.content_hash)
+CREATE TABLE IF NOT EXISTS image_cache (
+    content_hash VARCHAR(64) PRIMARY KEY,
+    image_path VARCHAR(500) NOT NULL,
+    size_bytes BIGINT NOT NULL,
+    metadata JSONB,
+    refcount INTEGER DEFAULT 0,
+    last_accessed TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+ALTER TABLE generated_images ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64);
+
+-- Уменьшение счетчика ссылок кэша при удалении записей generated_images
+-- или обнулении content_hash (срок хранения ссылок истек)
+CREATE OR REPLACE FUNCTION release_image_cache_reference()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF OLD.content_hash IS NOT NULL THEN
+        UPDATE image_cache SET refcount = refcount - 1 WHERE content_hash = OLD.content_hash;
+    END IF;
+    IF TG_OP = 'UPDATE' THEN
+        RETURN NEW;
+    END IF;
+    RETURN OLD;
+END;
+$$ language 'plpgsql';
+
+-- Прогресс выполняемых задач (шаги генерации и превью)
+CREATE TABLE IF NOT EXISTS task_progress (
+    task_id VARCHAR(100) PRIMARY KEY,
+    step INTEGER NOT NULL,
+    total_steps INTEGER NOT NULL,
+    preview_path VARCHAR(500),
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (task_id) REFERENCES tasks(id)
+);
+
 -- Таблица векторных вложений
 CREATE TABLE IF NOT EXISTS vector_embeddings (
     id SERIAL PRIMARY KEY,
@@ -103,6 +141,7 @@ CREATE INDEX IF NOT EXISTS idx_tasks_created_at ON tasks(created_at);
 CREATE INDEX IF NOT EXISTS idx_agent_logs_agent_time ON agent_logs(agent_name, timestamp);
 CREATE INDEX IF NOT EXISTS idx_telegram_messages_chat_time ON telegram_messages(chat_id, created_at);
 CREATE INDEX IF NOT EXISTS idx_generated_images_agent_time ON generated_images(agent_name, created_at);
+CREATE INDEX IF NOT EXISTS idx_image_cache_last_accessed ON image_cache(last_accessed);
 CREATE INDEX IF NOT EXISTS idx_system_metrics_agent_time ON system_metrics(agent_name, timestamp);
 
 -- Триггер для обновления updated_at
@@ -119,6 +158,15 @@ CREATE TRIGGER update_agents_updated_at BEFORE UPDATE ON agents
 
 CREATE TRIGGER update_tasks_updated_at BEFORE UPDATE ON tasks
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
+DROP TRIGGER IF EXISTS release_image_cache_reference ON generated_images;
+CREATE TRIGGER release_image_cache_reference AFTER DELETE ON generated_images
+    FOR EACH ROW EXECUTE FUNCTION release_image_cache_reference();
+
+DROP TRIGGER IF EXISTS release_expired_image_cache_reference ON generated_images;
+CREATE TRIGGER release_expired_image_cache_reference AFTER UPDATE OF content_hash ON generated_images
+    FOR EACH ROW WHEN (OLD.content_hash IS NOT NULL AND NEW.content_hash IS NULL)
+    EXECUTE FUNCTION release_image_cache_reference();
 """
 
 
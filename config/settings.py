@@ -57,6 +57,63 @@ class Settings(BaseSettings):
     AGENT_TIMEOUT: int = 300
     MAX_CONCURRENT_TASKS: int = 10
     
+    # Настройки EmbeddingAgent
+    EMBEDDING_BATCH_MAX_ITEMS: int = 256
+    EMBEDDING_BATCH_MAX_WAIT_MS: float = 10.0
+    EMBEDDING_CACHE_PATH: str = "/app/data/embedding_cache"
+    EMBEDDING_CACHE_MEMORY_ITEMS: int = 50000
+    VECTOR_STORE_BACKEND: str = "chroma"  # chroma, local
+    VECTOR_STORE_PATH: str = "/app/data/vectors"
+    VECTOR_STORE_WORKERS: int = 4
+    VECTOR_STORE_TIMEOUT: float = 30.0
+    VECTOR_STORE_QUANTIZATION: str = ""  # "", int8, binary (только для local)
+    VECTOR_STORE_RESCORE_FACTOR: int = 4
+    TEXT_INDEX_PATH: str = "/app/data/text_index"
+    CLUSTERING_PATH: str = "/app/data/clusters"
+    DEDUP_MODE: str = "exact"  # off, exact, skip, link (почти точные дубли - только skip/link)
+    DEDUP_THRESHOLD: float = 0.9
+    DEDUP_PATH: str = "/app/data/dedup"
+    BULK_INGEST_WORKERS: int = 0  # 0 - по числу ядер
+    BULK_INGEST_BATCH_SIZE: int = 256
+    BULK_INGEST_CHECKPOINT_PATH: str = "/app/data/ingest"
+    EMBEDDING_EXPORT_PATH: str = "/app/data/exports"
+    NAMESPACE_SMALL_THRESHOLD: int = 2048
+    NAMESPACE_MAX_OPEN: int = 256
+    EMBEDDING_INFERENCE_BACKEND: str = "torch"  # torch, onnx
+    
+    # Настройки ImageAgent
+    IMAGE_MAX_BATCH_SIZE: int = 4
+    IMAGE_BATCH_ITEM_MEMORY_MB: int = 1200  # оценка на изображение 512x512
+    IMAGE_DEFAULT_PROFILE: str = ""  # "", draft, standard, quality
+    IMAGE_PROMPT_CACHE_ITEMS: int = 256
+    IMAGE_WARMUP_NEGATIVE_PROMPTS: str = "blurry, low quality, distorted"  # через ";"
+    IMAGE_PIPELINE_DEPTH: int = 2  # задач в конвейере денойзинг -> декодирование -> запись
+    IMAGE_TOME_RATIO: float = 0.0  # token merging (tomesd), 0 - выключено
+    IMAGE_DEEPCACHE_INTERVAL: int = 0  # DeepCache: полный проход UNet раз в N шагов, 0 - выключено
+    IMAGE_DEEPCACHE_BRANCH_ID: int = 0
+    IMAGE_PREVIEW_INTERVAL: int = 5  # превью из латентов раз в N шагов, 0 - выключено
+    IMAGE_VARIATION_MAX_SIDE: int = 768  # большая сторона вариации, если размер не задан
+    IMAGE_UPSCALE_TILE_SIZE: int = 512
+    IMAGE_UPSCALE_WORKERS: int = 0  # 0 - по числу ядер
+    IMAGE_DELIVERY_FORMAT: str = "jpeg"  # jpeg, webp
+    IMAGE_DELIVERY_QUALITY: int = 85
+    IMAGE_DELIVERY_MAX_SIDE: int = 1024
+    IMAGE_THUMBNAIL_SIZE: int = 256
+    IMAGE_CACHE_MAX_MB: int = 2048  # лимит кэша результатов с заданным сидом (вытесняются только файлы без ссылок), 0 - без лимита
+    IMAGE_CACHE_REFERENCE_DAYS: int = 7  # сколько дней запись истории удерживает файл кэша, 0 - бессрочно
+    
+    # Настройки VisionAgent (загрузка изображений)
+    VISION_IMAGE_MAX_MB: int = 20
+    VISION_IMAGE_TIMEOUT: float = 30.0
+    VISION_IMAGE_CACHE_ITEMS: int = 32
+    
+    # Настройки OCRAgent
+    OCR_INFERENCE_BACKEND: str = "torch"  # torch, onnx (распознаватель)
+    
+    # ONNX Runtime (общие для EmbeddingAgent и OCRAgent)
+    ONNX_INTRA_OP_THREADS: int = 0  # 0 - по числу ядер
+    ONNX_QUANTIZE: bool = False  # int8 квантизация весов при экспорте
+    
     class Config:
         env_file = ".env"
         case_sensitive = True
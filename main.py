@@ -63,11 +63,97 @@ def get_agent_config() -> dict:
         'agents': {
             'meta_agent': {'loop_interval': settings.AGENT_LOOP_INTERVAL},
             'telegram_agent': {'telegram_token': settings.TELEGRAM_TOKEN},
-            'image_agent': {'models_path': settings.MODELS_PATH},
+            'image_agent': {
+                'models_path': settings.MODELS_PATH,
+                'max_batch_size': settings.IMAGE_MAX_BATCH_SIZE,
+                'batch_item_memory_mb': settings.IMAGE_BATCH_ITEM_MEMORY_MB,
+                'default_profile': settings.IMAGE_DEFAULT_PROFILE or None,
+                'cache_max_mb': settings.IMAGE_CACHE_MAX_MB,
+                'cache_reference_days': settings.IMAGE_CACHE_REFERENCE_DAYS,
+                'max_concurrent_tasks': settings.IMAGE_PIPELINE_DEPTH,
+                'preview_interval': settings.IMAGE_PREVIEW_INTERVAL,
+                'variation_max_side': settings.IMAGE_VARIATION_MAX_SIDE,
+                'output_store': {
+                    'delivery_format': settings.IMAGE_DELIVERY_FORMAT,
+                    'delivery_quality': settings.IMAGE_DELIVERY_QUALITY,
+                    'delivery_max_side': settings.IMAGE_DELIVERY_MAX_SIDE,
+                    'thumbnail_size': settings.IMAGE_THUMBNAIL_SIZE
+                },
+                'upscale': {
+                    'tile_size': settings.IMAGE_UPSCALE_TILE_SIZE,
+                    'workers': settings.IMAGE_UPSCALE_WORKERS or None
+                },
+                'acceleration': {
+                    'tome_ratio': settings.IMAGE_TOME_RATIO,
+                    'deepcache_interval': settings.IMAGE_DEEPCACHE_INTERVAL,
+                    'deepcache_branch_id': settings.IMAGE_DEEPCACHE_BRANCH_ID
+                },
+                'prompt_cache': {
+                    'max_items': settings.IMAGE_PROMPT_CACHE_ITEMS,
+                    'warmup_prompts': [
+                        p.strip() for p in settings.IMAGE_WARMUP_NEGATIVE_PROMPTS.split(';') if p.strip()
+                    ]
+                }
+            },
             'text_agent': {'models_path': settings.MODELS_PATH},
-            'vision_agent': {'models_path': settings.MODELS_PATH},
-            'ocr_agent': {'models_path': settings.MODELS_PATH},
-            'embedding_agent': {'models_path': settings.MODELS_PATH},
+            'vision_agent': {
+                'models_path': settings.MODELS_PATH,
+                'image_loader': {
+                    'max_mb': settings.VISION_IMAGE_MAX_MB,
+                    'timeout': settings.VISION_IMAGE_TIMEOUT,
+                    'cache_items': settings.VISION_IMAGE_CACHE_ITEMS
+                }
+            },
+            'ocr_agent': {
+                'models_path': settings.MODELS_PATH,
+                'inference_backend': settings.OCR_INFERENCE_BACKEND,
+                'onnx': {
+                    'threads': settings.ONNX_INTRA_OP_THREADS,
+                    'quantize': settings.ONNX_QUANTIZE
+                }
+            },
+            'embedding_agent': {
+                'models_path': settings.MODELS_PATH,
+                'max_concurrent_tasks': settings.MAX_CONCURRENT_TASKS,
+                'embedding_batching': {
+                    'max_batch_items': settings.EMBEDDING_BATCH_MAX_ITEMS,
+                    'max_wait_ms': settings.EMBEDDING_BATCH_MAX_WAIT_MS
+                },
+                'embedding_cache': {
+                    'path': settings.EMBEDDING_CACHE_PATH,
+                    'memory_items': settings.EMBEDDING_CACHE_MEMORY_ITEMS
+                },
+                'vector_store': {
+                    'backend': settings.VECTOR_STORE_BACKEND,
+                    'path': settings.VECTOR_STORE_PATH,
+                    'max_workers': settings.VECTOR_STORE_WORKERS,
+                    'timeout': settings.VECTOR_STORE_TIMEOUT,
+                    'quantization': settings.VECTOR_STORE_QUANTIZATION or None,
+                    'rescore_factor': settings.VECTOR_STORE_RESCORE_FACTOR
+                },
+                'text_index': {'path': settings.TEXT_INDEX_PATH},
+                'clustering': {'path': settings.CLUSTERING_PATH},
+                'dedup': {
+                    'mode': settings.DEDUP_MODE,
+                    'threshold': settings.DEDUP_THRESHOLD,
+                    'path': settings.DEDUP_PATH
+                },
+                'bulk_ingest': {
+                    'workers': settings.BULK_INGEST_WORKERS or None,
+                    'batch_size': settings.BULK_INGEST_BATCH_SIZE,
+                    'checkpoint_path': settings.BULK_INGEST_CHECKPOINT_PATH
+                },
+                'export_path': settings.EMBEDDING_EXPORT_PATH,
+                'namespaces': {
+                    'small_threshold': settings.NAMESPACE_SMALL_THRESHOLD,
+                    'max_open': settings.NAMESPACE_MAX_OPEN
+                },
+                'inference_backend': settings.EMBEDDING_INFERENCE_BACKEND,
+                'onnx': {
+                    'threads': settings.ONNX_INTRA_OP_THREADS,
+                    'quantize': settings.ONNX_QUANTIZE
+                }
+            },
             'recovery_agent': {'logs_path': settings.LOG_PATH}
         }
     }
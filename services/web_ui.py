@@ -4,6 +4,7 @@ Web UI - интерфейс управления AGI Layer v3.9
 
 import asyncio
 import logging
+import os
 import streamlit as st
 import plotly.express as px
 import plotly.graph_objects as go
@@ -416,7 +417,7 @@ class WebUI:
             async with self.db_pool.acquire() as conn:
                 rows = await conn.fetch(
                     """
-                    SELECT task_id, agent_name, prompt, image_path, created_at
+                    SELECT task_id, agent_name, prompt, image_path, metadata, created_at
                     FROM generated_images 
                     ORDER BY created_at DESC 
                     LIMIT 20
@@ -428,11 +429,18 @@ class WebUI:
                         with st.expander(f"Изображение {row['task_id'][:8]}..."):
                             col1, col2 = st.columns([2, 1])
                             
+                            # Миниатюра вместо полноразмерного PNG (у старых записей ее нет)
+                            metadata = row['metadata'] or {}
+                            if isinstance(metadata, str):
+                                metadata = json.loads(metadata)
+                            variants = metadata.get('variants') or {}
+                            preview_path = variants.get('thumbnail', {}).get('path') or row['image_path']
+                            
                             with col1:
-                                if os.path.exists(row['image_path']):
-                                    st.image(row['image_path'], caption=row['prompt'])
+                                if os.path.exists(preview_path):
+                                    st.image(preview_path, caption=row['prompt'])
                                 else:
-                                    st.error(f"Файл не найден: {row['image_path']}")
+                                    st.error(f"Файл не найден: {preview_path}")
                             
                             with col2:
                                 st.write(f"**Агент:** {row['agent_name']}")
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Тесты AsyncImageLoader на локальном HTTP сервере: объединение параллельных
+запросов, перепроверка 304, лимит размера, таймаут и отмена загрузки
+"""
+
+import asyncio
+import io
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+# Добавление корневой директории в путь
+sys.path.append(str(Path(__file__).parent))
+
+aiohttp = pytest.importorskip("aiohttp")
+from PIL import Image
+
+from agents.image_loader import AsyncImageLoader, ImageLoadError
+
+
+def _png_bytes(size=(8, 6), color=(200, 30, 30)) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+PNG = _png_bytes()
+ETAG = '"image-v1"'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # HTTP/1.0: тело без Content-Length завершается закрытием соединения
+    protocol_version = "HTTP/1.0"
+    requests = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        _Handler.requests.append((self.path, self.headers.get("If-None-Match")))
+        if self.path.startswith("/slow"):
+            time.sleep(2.0)
+        elif self.path.startswith("/delay"):
+            time.sleep(0.3)
+
+        if self.path.startswith("/etag"):
+            if self.headers.get("If-None-Match") == ETAG:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("ETag", ETAG)
+            self.send_header("Content-Length", str(len(PNG)))
+            self.end_headers()
+            self.wfile.write(PNG)
+        elif self.path.startswith("/big-declared"):
+            self.send_response(200)
+            self.send_header("Content-Length", str(10 * 1024 * 1024))
+            self.end_headers()
+        elif self.path.startswith("/big-undeclared"):
+            # Размер не объявлен - лимит должен сработать по факту чтения
+            self.send_response(200)
+            self.end_headers()
+            for _ in range(64):
+                self.wfile.write(b"\0" * 64 * 1024)
+        else:
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(PNG)))
+            self.end_headers()
+            self.wfile.write(PNG)
+
+
+@pytest.fixture(scope="module")
+def server_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def _requests_to(path: str):
+    return [request for request in _Handler.requests if request[0] == path]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_loads_share_one_request(server_url):
+    async with aiohttp.ClientSession() as session:
+        loader = AsyncImageLoader(session)
+        images = await asyncio.gather(*[
+            loader.load(image_url=f"{server_url}/delay-dedup") for _ in range(5)
+        ])
+
+    assert len(_requests_to("/delay-dedup")) == 1
+    assert all(image is images[0] for image in images)
+    assert images[0].size == (8, 6)
+    assert not loader._inflight
+
+
+@pytest.mark.asyncio
+async def test_revalidation_uses_cached_image_on_304(server_url):
+    async with aiohttp.ClientSession() as session:
+        loader = AsyncImageLoader(session)
+        first = await loader.load(image_url=f"{server_url}/etag")
+        second = await loader.load(image_url=f"{server_url}/etag")
+
+    assert second is first
+    assert [etag for _, etag in _requests_to("/etag")] == [None, ETAG]
+    assert loader.stats["revalidated"] == 1
+    assert loader.stats["misses"] == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("path", ["/big-declared", "/big-undeclared"])
+async def test_size_cap(server_url, path):
+    async with aiohttp.ClientSession() as session:
+        loader = AsyncImageLoader(session, max_bytes=1024 * 1024)
+        with pytest.raises(ImageLoadError, match="больше"):
+            await loader.load(image_url=f"{server_url}{path}")
+
+    assert loader.stats["errors"] == 1
+    assert not loader._cache
+
+
+@pytest.mark.asyncio
+async def test_timeout(server_url):
+    async with aiohttp.ClientSession() as session:
+        loader = AsyncImageLoader(session, timeout=0.5, connect_timeout=0.5)
+        started = time.perf_counter()
+        with pytest.raises(ImageLoadError, match="Таймаут"):
+            await loader.load(image_url=f"{server_url}/slow-timeout")
+
+    assert time.perf_counter() - started < 1.5
+    assert not loader._inflight
+
+
+@pytest.mark.asyncio
+async def test_cancelled_loader_does_not_strand_waiters(server_url):
+    async with aiohttp.ClientSession() as session:
+        loader = AsyncImageLoader(session)
+        url = f"{server_url}/delay-cancel"
+        leader = asyncio.create_task(loader.load(image_url=url))
+        await asyncio.sleep(0.05)
+        waiter = asyncio.create_task(loader.load(image_url=url))
+        await asyncio.sleep(0.05)
+
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        # Ожидающий не зависает: он повторяет загрузку сам
+        image = await asyncio.wait_for(waiter, timeout=5.0)
+
+    assert image.size == (8, 6)
+    assert len(_requests_to("/delay-cancel")) == 2
+    assert not loader._inflight
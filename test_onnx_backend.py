@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Тесты ONNX бэкенда: экспорт маленьких случайных моделей и сверка выходов
+onnxruntime с torch (те же проверки, что выполняются перед включением бэкенда)
+"""
+
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+# Добавление корневой директории в путь
+sys.path.append(str(Path(__file__).parent))
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+
+from agents.onnx_backend import export_easyocr_recognizer, onnx_model_path, parity_report
+
+
+TEXTS = [
+    "счет номер 42 от поставщика",
+    "короткий",
+    "длинный текст с повторами повторами повторами и паддингом в батче",
+    "export",
+    "",
+]
+
+
+@pytest.fixture
+def tiny_sentence_model(tmp_path):
+    """SentenceTransformer из двухслойного BERT со случайными весами и своим словарем"""
+    transformers = pytest.importorskip("transformers")
+    st = pytest.importorskip("sentence_transformers")
+
+    words = sorted({word for text in TEXTS for word in text.split()})
+    vocab_file = tmp_path / "vocab.txt"
+    vocab_file.write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + words), encoding="utf-8")
+
+    model_dir = tmp_path / "tiny-bert"
+    torch.manual_seed(0)
+    config = transformers.BertConfig(
+        vocab_size=5 + len(words),
+        hidden_size=32,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        intermediate_size=64,
+        max_position_embeddings=64
+    )
+    transformers.BertModel(config).save_pretrained(model_dir)
+    transformers.BertTokenizerFast(vocab_file=str(vocab_file), do_lower_case=True).save_pretrained(model_dir)
+
+    transformer = st.models.Transformer(str(model_dir), max_seq_length=32)
+    pooling = st.models.Pooling(transformer.get_word_embedding_dimension(), pooling_mode="mean")
+    return st.SentenceTransformer(modules=[transformer, pooling, st.models.Normalize()], device="cpu")
+
+
+@pytest.mark.parametrize("quantize, min_cosine", [(False, 0.9999), (True, 0.98)])
+def test_sentence_encoder_parity(tmp_path, tiny_sentence_model, quantize, min_cosine):
+    from agents.onnx_backend import OnnxSentenceEncoder
+
+    models_path = str(tmp_path / "models")
+    encoder = OnnxSentenceEncoder(tiny_sentence_model, models_path, "tiny-bert", threads=1, quantize=quantize)
+    assert os.path.exists(onnx_model_path(models_path, "tiny-bert", quantize))
+
+    reference = tiny_sentence_model.encode(TEXTS, convert_to_numpy=True)
+    # Батч меньше числа текстов: паддинг и маска внимания различаются между батчами
+    candidate = encoder.encode(TEXTS, batch_size=2)
+
+    assert candidate.shape == reference.shape
+    report = parity_report(reference, candidate, cosine=True)
+    assert report["min_cosine"] >= min_cosine, report
+    np.testing.assert_allclose(np.linalg.norm(candidate, axis=1), 1.0, atol=1e-5)
+
+
+def test_sentence_encoder_reuses_exported_file(tmp_path, tiny_sentence_model):
+    from agents.onnx_backend import OnnxSentenceEncoder
+
+    models_path = str(tmp_path / "models")
+    first = OnnxSentenceEncoder(tiny_sentence_model, models_path, "tiny-bert", threads=1)
+    mtime = os.stat(first.model_file).st_mtime_ns
+    second = OnnxSentenceEncoder(tiny_sentence_model, models_path, "tiny-bert", threads=1)
+
+    assert second.model_file == first.model_file
+    assert os.stat(second.model_file).st_mtime_ns == mtime
+
+
+class _TinyRecognizer(torch.nn.Module):
+    """Распознаватель с интерфейсом EasyOCR: строка 64xW -> логиты (batch, steps, classes)"""
+
+    def __init__(self, classes: int = 12):
+        super().__init__()
+        self.conv = torch.nn.Conv2d(1, 16, kernel_size=3, stride=(4, 2), padding=1)
+        self.head = torch.nn.Linear(16, classes)
+
+    def forward(self, image, text):
+        features = torch.relu(self.conv(image)).mean(dim=2)
+        return self.head(features.permute(0, 2, 1))
+
+
+def test_recognizer_parity_on_other_width(tmp_path):
+    torch.manual_seed(0)
+    recognizer = _TinyRecognizer()
+    module, model_file = export_easyocr_recognizer(recognizer, str(tmp_path), "tiny-recognizer", threads=1)
+    assert os.path.exists(model_file)
+
+    # Экспорт шел с шириной 256 - ось ширины должна остаться динамической
+    image = torch.rand(3, 1, 64, 320)
+    text = torch.zeros(3, 1, dtype=torch.long)
+    with torch.no_grad():
+        reference = recognizer(image, text).numpy()
+    candidate = module(image, text).numpy()
+
+    assert candidate.shape == reference.shape
+    report = parity_report(reference, candidate)
+    assert report["argmax_agreement"] == 1.0, report
+    assert report["max_abs_diff"] < 1e-4, report
+
+
+@pytest.fixture(scope="module")
+def easyocr_recognizer():
+    """Распознаватель EasyOCR generation2 (VGG + BiLSTM) со случайными float весами"""
+    vgg_model = pytest.importorskip("easyocr.model.vgg_model")
+    torch.manual_seed(0)
+    return vgg_model.Model(input_channel=1, output_channel=256, hidden_size=256, num_class=97).eval()
+
+
+@pytest.fixture(scope="module")
+def exported_easyocr_recognizer(tmp_path_factory, easyocr_recognizer):
+    models_path = str(tmp_path_factory.mktemp("models"))
+    module, _ = export_easyocr_recognizer(easyocr_recognizer, models_path, "easyocr", threads=1)
+    return module
+
+
+@pytest.mark.parametrize("batch, width", [(1, 256), (3, 320), (5, 100)])
+def test_easyocr_recognizer_parity(easyocr_recognizer, exported_easyocr_recognizer, batch, width):
+    # Экспорт шел с батчем 2 и шириной 256 - обе оси должны остаться динамическими
+    module = exported_easyocr_recognizer
+    image = torch.rand(batch, 1, 64, width)
+    text = torch.zeros(batch, 1, dtype=torch.long)
+    with torch.no_grad():
+        reference = easyocr_recognizer(image, text).numpy()
+    candidate = module(image, text).numpy()
+
+    assert candidate.shape == reference.shape
+    report = parity_report(reference, candidate)
+    assert report["argmax_agreement"] == 1.0, report
+    assert report["max_abs_diff"] < 1e-4, report
+
+
+def test_quantized_easyocr_recognizer_is_rejected(tmp_path, easyocr_recognizer):
+    quantized = torch.quantization.quantize_dynamic(easyocr_recognizer, dtype=torch.qint8)
+
+    with pytest.raises(ValueError, match="квантован"):
+        export_easyocr_recognizer(quantized, str(tmp_path), "easyocr", threads=1)
+    assert not os.path.exists(onnx_model_path(str(tmp_path), "easyocr", False))